@@ -5,6 +5,7 @@ import numpy as np
 import numpy as np
 import random
 import nltk 
+from forager.vocabulary import Vocabulary
 
 def generate_sequence(words, frequency_dict, similarity_matrix, alpha, beta):
     num_items = random.randint(30, 50)
@@ -20,6 +21,8 @@ def generate_sequence(words, frequency_dict, similarity_matrix, alpha, beta):
     total_frequency_top = sum(frequency_dict[x] for x in top_words)
     top_normalized_frequencies = [frequency_dict[x] / total_frequency_top for x in top_words]
 
+    vocab = Vocabulary(words, aliases = False)
+
     # Initialize the sequence with the first item
     sequence = [np.random.choice(top_words, p=top_normalized_frequencies)]
 
@@ -27,19 +30,22 @@ def generate_sequence(words, frequency_dict, similarity_matrix, alpha, beta):
     
     for _ in range(num_items - 1):
         # Exclude previously chosen words
-        available_words = [word for word in words if word not in sequence]
+        chosen = set(sequence)
+        available_words = [word for word in words if word not in chosen]
         # also exclude words that are levenstein distance 1 away from the last word
         available_words = [word for word in available_words if nltk.edit_distance(word, sequence[-1]) > 1]
         # Calculate word scores as a combination of frequency and semantic similarity
+        previous = vocab.index(sequence[-1])
         word_scores = [
-            alpha * similarity_matrix[words.index(sequence[-1])][words.index(word)]*
-            (beta) * normalized_frequencies[words.index(word)]
+            alpha * similarity_matrix[previous][vocab.index(word)]*
+            (beta) * normalized_frequencies[vocab.index(word)]
             for word in available_words
         ]
 
         # Choose the next word based on word scores of the top 10 words with highest scores
-        top_10_words = sorted(available_words, key=lambda x: word_scores[available_words.index(x)], reverse=True)[:10]
-        top_10_scores = [word_scores[available_words.index(x)] for x in top_10_words]
+        top_10 = sorted(range(len(available_words)), key=lambda x: word_scores[x], reverse=True)[:10]
+        top_10_words = [available_words[x] for x in top_10]
+        top_10_scores = [word_scores[x] for x in top_10]
         top_10_normalized_scores = [score / sum(top_10_scores) for score in top_10_scores]
         next_word = np.random.choice(top_10_words, p=top_10_normalized_scores)
         
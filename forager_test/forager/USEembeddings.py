@@ -9,18 +9,20 @@ import re
 from alive_progress import alive_bar 
 import difflib
 import nltk
+from forager.embedding_store import EmbeddingStore, open_embeddings
 
 class USE_embeddings:
     '''
         Description: 
-            This class contains functions that create the embeddings.csv file from a list of words
-            using the Universal Sentence Encoder.
+            This class contains functions that create the USE_embeddings store (USE_embeddings.npy and
+            USE_embeddings.vocab.txt) from a list of words using the Universal Sentence Encoder.
+            EmbeddingStore.to_csv exports it as the former USE_embeddings.csv.
         
         Args:
             path_to_words: path to the csv file containing the list of words with 'vocab' as the header.
             
         Functions: 
-            (1) __init__: creates USE_embeddings.csv file
+            (1) __init__: creates the USE_embeddings store
             (2) test_embeddings: tests the similarity of two words using cosine similarity from scipy.
     
     '''
@@ -60,12 +62,8 @@ class USE_embeddings:
         
         # create a dictionary of words and their embeddings without loop
         self.dict = dict(zip(self.words, embeddings))
-        # convert dictionary to dataframe with column names as words and each column is the embedding
-
-
-        self.df = pd.DataFrame(self.dict)#.transpose()
-        # save dataframe as csv file
-        self.df.to_csv(self.path + '/USE_embeddings.csv', index=False)
+        # save the embeddings as one contiguous float32 matrix (one row per word) and its vocabulary index
+        self.store = EmbeddingStore.save(self.path + '/USE_embeddings', self.words, embeddings)
     
     def test_embeddings(word1, word2):
         """
@@ -74,10 +72,10 @@ class USE_embeddings:
         """
 
         from scipy import spatial
-        # get the embeddings of the two words from the USE_embeddings.csv file
-        df = pd.read_csv('../data/lexical_data/USE_embeddings.csv')
-        w1 = df[word1].values.tolist()
-        w2 = df[word2].values.tolist()
+        # get the embeddings of the two words from the USE_embeddings store
+        store = open_embeddings('../data/lexical_data/USE_embeddings.csv')
+        w1 = store[word1]
+        w2 = store[word2]
         # calculate cosine similarity
         cos_sim = 1 - spatial.distance.cosine(w1, w2)
         print('The cosine similarity between {} and {} is {}'.format(word1, word2, cos_sim))
@@ -0,0 +1,270 @@
+import os
+import json
+import argparse
+import warnings
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from forager.lexical import LexicalSpace
+from forager.semantic import LowRankSimilarity, normalize_embeddings
+from forager.phonology import PhonemeCodes, PhonologicalSimilarity
+from forager.cues import phonology_funcs
+from forager.embedding_store import open_embeddings, checksum, source_entry, source_changed
+
+'''
+
+Binary lexicon bundles: the lexical data of a domain converted once from its CSV files into .npy arrays, which
+    are memory-mapped at startup instead of being parsed, and whose pages are shared by all worker processes.
+
+    A bundle is written to data/lexical_data/<domain>/bundle and contains
+        semantic.npy, phonological.npy: similarity matrices (NxN), with the similarity floor already applied
+        embeddings.npy: normalized embeddings (NxD), in place of semantic.npy for domains without a semantic matrix
+        phonemes.npy, phoneme_lengths.npy: encoded pronunciations (N x Lmax, N), in place of phonological.npy for
+            domains without a phonological matrix, with topk_data.npy, topk_indices.npy, topk_indptr.npy (the CSR
+            arrays of phonological_topk.npz) if the domain has a top-k neighbor matrix
+        labels.npy, frequencies.npy: the space of words and their log-frequencies (N)
+        norms_<name>_items.npy, norms_<name>_categories.npy: (Item, Category) pairs of the animal and food norms
+        manifest.json: bundle version, dtype, floor, the size and sha256 checksum of every file, and the size,
+            modification time and sha256 checksum of every source
+
+    Functions
+        (1) source_paths: CSV files of the lexical data of a domain, resolved among the names used by the domains
+        (2) build_lexicon: converts the CSV lexical data of a domain into a bundle
+        (3) changed_sources: sources that changed since a bundle was built
+        (4) load_lexicon: memory-maps a bundle into a read-only LexicalSpace
+        (5) main: command line interface, `build-lexicon <domain>`
+'''
+
+BUNDLE_VERSION = 2
+norms_names = ['animals', 'foods']
+# file names of the lexical data of a domain, in order of preference: domains built with the USE embeddings
+# ship USE_*.csv files, the others the names of data/README.md (e.g. occupations has frequencies.csv and
+# phonmatrix.csv). Domains too large for dense matrices have embeddings instead of a semantic matrix, and no
+# phonological matrix (optionally a sparse top-k matrix); their similarities are computed on demand.
+source_names = {'semantic': ['USE_semantic_matrix.csv', 'similaritymatrix.csv'],
+                'embeddings': ['USE_embeddings.csv', 'semantic_embeddings.csv'],
+                'phonological': ['USE_phonological_matrix.csv', 'phonmatrix.csv'],
+                'phonological_topk': ['phonological_topk.npz'],
+                'frequencies': ['USE_frequencies.csv', 'frequencies.csv']}
+
+
+def source_paths(domain, root = 'data', names = None):
+    '''
+        Description:
+            Returns the CSV files that the lexical data of a domain is read from. Each lexical file is the first of
+            its source_names that exists in the directory of the domain (the first name if none exists), unless
+            its name is given.
+        Args:
+            (1) domain (str): name of the domain
+            (2) root (str): data directory that contains lexical_data and norms
+            (3) names (dict): file names that replace the resolved ones, e.g. {'frequencies': 'counts.csv'} (optional)
+        Returns:
+            (1) sources (dict): path of the semantic, embeddings, phonological, phonological_topk, frequencies and norms files
+    '''
+    lexical_path = os.path.join(root, 'lexical_data', domain)
+    names = {} if names is None else names
+    sources = {}
+    for name, candidates in source_names.items():
+        if names.get(name) is not None:
+            sources[name] = os.path.join(lexical_path, names[name])
+        else:
+            paths = [os.path.join(lexical_path, candidate) for candidate in candidates]
+            sources[name] = next((path for path in paths if os.path.exists(path)), paths[0])
+    sources['norms_animals'] = os.path.join(root, 'norms', 'animals_snafu_scheme_vocab.csv')
+    sources['norms_foods'] = os.path.join(root, 'norms', 'foods_snafu_scheme_vocab.csv')
+    return sources
+
+def bundle_path(domain, root = 'data'):
+    return os.path.join(root, 'lexical_data', domain, 'bundle')
+
+def arpabet_path(root = 'data'):
+    # binary pronunciation file shared by all domains, written by build-lexicon --arpabet
+    return os.path.join(root, 'lexical_data', 'arpabet.npz')
+
+def build_lexicon(domain, root = 'data', dtype = np.float64, floor = .0001, names = None):
+    '''
+        Description:
+            Converts the CSV lexical data of a domain into a binary bundle. The manifest is written last, so a
+            bundle without one is incomplete and is ignored by load_lexicon. Dense matrices are stored as they
+            are; without them, the bundle stores what the on-demand similarities need instead (the normalized
+            embeddings, and the encoded pronunciations with the top-k matrix if there is one), so that no NxN
+            matrix is built. Pronunciations are read from lexical_data/arpabet.npz if it exists (see --arpabet),
+            and otherwise from the NLTK CMU dictionary.
+        Args:
+            (1) domain (str): name of the domain
+            (2) root (str): data directory that contains lexical_data and norms
+            (3) dtype (np.dtype): precision of the stored matrices and frequencies
+            (4) floor (float): value assigned to similarities <= 0
+            (5) names (dict): file names of the lexical data, see source_paths (optional)
+        Returns:
+            (1) manifest (dict): contents of manifest.json
+    '''
+    sources = source_paths(domain, root, names)
+    used = ['frequencies'] + ['norms_' + name for name in norms_names]
+    used.append('semantic' if os.path.exists(sources['semantic']) or not os.path.exists(sources['embeddings']) else 'embeddings')
+    if os.path.exists(sources['phonological']):
+        used.append('phonological')
+    elif os.path.exists(sources['phonological_topk']):
+        used.append('phonological_topk')
+    for name in used:
+        if not os.path.exists(sources[name]):
+            raise Exception("The {name} file of domain '{domain}' was not found: {path}".format(name = name, domain = domain, path = sources[name]))
+    path = bundle_path(domain, root)
+    os.makedirs(path, exist_ok = True)
+    manifest_path = os.path.join(path, 'manifest.json')
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    frequencies = pd.read_csv(sources['frequencies'], header = None, encoding = "unicode-escape")
+    labels = frequencies[0].astype(str).tolist()
+    arrays = {'labels': np.array(labels),
+              'frequencies': np.array(frequencies[1], dtype = dtype)}
+    if 'semantic' in used:
+        arrays['semantic'] = np.loadtxt(sources['semantic'], delimiter = ',', dtype = dtype)
+    else:
+        # read from the binary store of the embeddings if they were imported, in the order of the labels
+        arrays['embeddings'] = normalize_embeddings(open_embeddings(sources['embeddings']).get(labels), dtype)
+    if 'phonological' in used:
+        arrays['phonological'] = np.loadtxt(sources['phonological'], delimiter = ',', dtype = dtype)
+    else:
+        phonology_funcs.load_arpabet(arpabet_path(root))
+        phonemes = phonology_funcs.encode_pronunciations(labels)
+        arrays['phonemes'], arrays['phoneme_lengths'] = phonemes.codes, phonemes.lengths
+        if 'phonological_topk' in used:
+            topk = scipy.sparse.load_npz(sources['phonological_topk']).tocsr()
+            arrays['topk_data'], arrays['topk_indices'], arrays['topk_indptr'] = topk.data, topk.indices, topk.indptr
+    for name in ['semantic', 'phonological']:
+        if name in arrays:
+            arrays[name][arrays[name] <= 0] = floor
+    for name in norms_names:
+        norms = pd.read_csv(sources['norms_' + name], encoding = "unicode-escape")
+        arrays['norms_' + name + '_items'] = np.array(norms['Item'].astype(str).tolist())
+        arrays['norms_' + name + '_categories'] = np.array(norms['Category'].astype(str).tolist())
+
+    files = {}
+    for name, array in arrays.items():
+        filename = os.path.join(path, name + '.npy')
+        np.save(filename, array)
+        files[name] = {'file': name + '.npy', 'bytes': os.path.getsize(filename), 'sha256': checksum(filename),
+                       'shape': list(array.shape), 'dtype': array.dtype.str}
+
+    manifest = {'version': BUNDLE_VERSION, 'domain': domain, 'dtype': np.dtype(dtype).name, 'floor': floor,
+                'files': files,
+                'sources': {name: source_entry(sources[name], root) for name in used}}
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent = 2)
+    return manifest
+
+def read_manifest(domain, root = 'data'):
+    '''
+        Description:
+            Returns the manifest of the bundle of a domain, or None if the domain has no complete bundle
+    '''
+    manifest_path = os.path.join(bundle_path(domain, root), 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+def changed_sources(manifest, root = 'data', verify = False):
+    '''
+        Description:
+            Returns the sources of a bundle that changed since it was built (see embedding_store.source_changed;
+            with verify = True the checksum of every source is compared). Sources that were removed are not
+            reported, since the bundle no longer needs them.
+        Args:
+            (1) manifest (dict): contents of manifest.json
+            (2) root (str): data directory that contains lexical_data and norms
+            (3) verify (bool): compare the sha256 checksum of every source
+        Returns:
+            (1) changed (list): files of the changed sources, relative to root
+    '''
+    changed = []
+    for entry in manifest['sources'].values():
+        source = os.path.join(root, entry['file'])
+        if os.path.exists(source) and source_changed(source, entry, verify):
+            changed.append(entry['file'])
+    return changed
+
+def load_lexicon(domain, root = 'data', dtype = None, verify = False):
+    '''
+        Description:
+            Memory-maps the bundle of a domain into a read-only LexicalSpace. File sizes are always checked
+            against the manifest; with verify = True every file is also checked against its sha256 checksum.
+            Bundles without dense matrices are loaded into the on-demand LowRankSimilarity and
+            PhonologicalSimilarity, built from the memory-mapped embeddings and pronunciations.
+            Sources that changed since the bundle was built (see changed_sources) raise an exception with
+            verify = True, and a warning otherwise.
+        Args:
+            (1) domain (str): name of the domain
+            (2) root (str): data directory that contains lexical_data and norms
+            (3) dtype (np.dtype): precision of the matrices and frequencies. Matrices stored in another precision
+                are converted in memory instead of being memory-mapped (default: the stored precision)
+            (4) verify (bool): check the sha256 checksum of every file and source
+        Returns:
+            (1) lexicon (LexicalSpace)
+    '''
+    manifest = read_manifest(domain, root)
+    if manifest is None:
+        raise Exception("No lexicon bundle found for domain '{domain}'. Run build-lexicon {domain} first.".format(domain = domain))
+    if manifest['version'] != BUNDLE_VERSION:
+        raise Exception("The lexicon bundle of domain '{domain}' has version {version}, expected {expected}. Run build-lexicon {domain} again.".format(domain = domain, version = manifest['version'], expected = BUNDLE_VERSION))
+    changed = changed_sources(manifest, root, verify)
+    if len(changed) > 0:
+        message = "The lexicon bundle of domain '{domain}' is out of date: {files} changed since it was built. Run build-lexicon {domain} again.".format(domain = domain, files = ', '.join(changed))
+        if verify:
+            raise Exception(message)
+        warnings.warn(message)
+
+    path = bundle_path(domain, root)
+    arrays, paths = {}, {}
+    for name, entry in manifest['files'].items():
+        filename = os.path.join(path, entry['file'])
+        if not os.path.exists(filename) or os.path.getsize(filename) != entry['bytes'] or (verify and checksum(filename) != entry['sha256']):
+            raise Exception("The file {file} of the lexicon bundle of domain '{domain}' is missing or corrupted. Run build-lexicon {domain} again.".format(file = entry['file'], domain = domain))
+        arrays[name] = np.load(filename, mmap_mode = 'r')
+        paths[name] = filename
+
+    dtype = np.dtype(manifest['dtype'] if dtype is None else dtype)
+    mapped = dtype == np.dtype(manifest['dtype'])
+    dense = [(key, name) for key, name in [('sim_matrix', 'semantic'), ('phon_matrix', 'phonological'), ('freq_matrix', 'frequencies')] if name in arrays]
+    matrices = {key: arrays[name] if mapped else arrays[name].astype(dtype) for key, name in dense}
+    bundle = {key: paths[name] for key, name in dense} if mapped else None
+    if 'sim_matrix' not in matrices:
+        matrices['sim_matrix'] = LowRankSimilarity(arrays['embeddings'], manifest['floor'], dtype)
+    if 'phon_matrix' not in matrices:
+        topk = None
+        if 'topk_data' in arrays:
+            N = len(arrays['labels'])
+            topk = scipy.sparse.csr_matrix((arrays['topk_data'], arrays['topk_indices'], arrays['topk_indptr']), shape = (N, N))
+        phonemes = PhonemeCodes.from_arrays(arrays['phonemes'], arrays['phoneme_lengths'])
+        matrices['phon_matrix'] = PhonologicalSimilarity(phonemes, manifest['floor'], dtype = dtype, topk = topk)
+
+    norms = [pd.DataFrame({'Category': arrays['norms_' + name + '_categories'], 'Item': arrays['norms_' + name + '_items']}) for name in norms_names]
+    return LexicalSpace(arrays['labels'].tolist(), matrices['sim_matrix'], matrices['freq_matrix'], matrices['phon_matrix'], norms, domain,
+                        manifest['floor'], clamped = True, bundle = bundle)
+
+def main(args = None):
+    parser = argparse.ArgumentParser(prog = 'build-lexicon', description = 'Build the binary lexicon bundle of a domain from its CSV lexical data.')
+    parser.add_argument('domain', type = str, help = 'domain to build, e.g. animals')
+    parser.add_argument('--root', type = str, default = 'data', help = 'data directory that contains lexical_data and norms')
+    parser.add_argument('--precision', type = str, default = 'float64', choices = ['float64', 'float32'], help = 'floating point precision of the stored matrices')
+    parser.add_argument('--verify', action = 'store_true', help = 'verify the checksums of an existing bundle and of its sources instead of building it')
+    parser.add_argument('--arpabet', action = 'store_true', help = 'also write the binary pronunciation file lexical_data/arpabet.npz from the NLTK CMU dictionary')
+    for name in source_names:
+        parser.add_argument('--' + name, type = str, default = None, help = 'file name of the {name} data in the directory of the domain (default: the first of {names} that exists)'.format(name = name, names = ', '.join(source_names[name])))
+    args = parser.parse_args(args)
+
+    if args.arpabet:
+        phonology_funcs.build_arpabet(arpabet_path(args.root))
+        print("Pronunciations written to {path}".format(path = arpabet_path(args.root)))
+    if args.verify:
+        lexicon = load_lexicon(args.domain, args.root, verify = True)
+        print("Lexicon bundle of domain '{domain}' is valid ({n} words)".format(domain = args.domain, n = len(lexicon)))
+    else:
+        manifest = build_lexicon(args.domain, args.root, np.dtype(args.precision), names = {name: getattr(args, name) for name in source_names})
+        print("Lexicon bundle of domain '{domain}' written to {path} ({n} words)".format(domain = args.domain, path = bundle_path(args.domain, args.root), n = manifest['files']['labels']['shape'][0]))
+
+
+if __name__ == '__main__':
+    main()
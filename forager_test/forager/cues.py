@@ -1,11 +1,15 @@
+import os
 import numpy as np
-import scipy
 import pandas as pd
 import nltk
 from functools import lru_cache
+from collections import OrderedDict
 from itertools import product as iterprod
 import re
-from tqdm import tqdm
+from forager.vocabulary import Vocabulary
+from forager import semantic
+from forager.embedding_store import open_embeddings
+from forager.phonology import PhonemeCodes, PhonologicalSimilarity, pair_similarity, similarity_matrix
 
 '''
 
@@ -14,93 +18,239 @@ Generate Cue History for each type of cue (similarity, frequency, phonology). In
 
     Functions
         (1) create_history_variables: creates similarity, frequency, and phonologyZ list and history
-        variables to be used by foraging methods in foraging.py
-        (2) create_semantic_matrix: converts a word embedding space into a similarity matrix
-        (3) phonology_funcs: class to execute the creation of a phonological similarity matrix
+        variables to be used by foraging methods in foraging.py, as a compact CueHistory of HistoryRows
+        (2) create_semantic_matrix: converts a word embedding space into a similarity matrix, in row blocks
+        that can be streamed to a memory-mapped file
+        (3) phonology_funcs: class to execute the creation of a phonological similarity matrix (dense, or on
+        demand for large vocabularies)
+        (4) PronunciationStore: lazily loaded, process-wide ARPAbet pronunciation dictionary used by phonology_funcs
 '''
 
 
-def create_history_variables(fluency_list, subject, corrections_df, labels, sim_matrix, freq_matrix, phon_matrix = None):
+class HistoryRows:
     '''
+        Description:
+            Lazy history of one cue: the L rows of size N that the cue takes over the whole vocabulary at each
+            position of a fluency list. Only the row id of each position is stored, alongside a reference to the
+            shared matrix, so a history takes O(L) memory instead of O(L*N). Row k is the zero-copy view
+            matrix[ids[k]] (or the 1-D matrix itself, for a cue such as frequency that is the same at every
+            position), unless it is replaced by a row of overrides. All rows are gathered in one vectorized
+            fancy-index (gather), which is also what np.array(history) returns.
         Args:
-            (1) sim_matrix: semantic similarity matrix (NxN np.array)
-            (2) phon_matrix: phonological similarity matrix (NxN np.array)
+            (1) matrix: shared cue matrix (NxN np.array), or a cue array that is the same at every position (size N)
+            (2) ids: row of matrix used at each position (int32 np.array, size L)
+            (3) overrides: rows replacing the matrix row at some positions (dict of position -> array of size N)
+    '''
+    def __init__(self, matrix, ids, overrides = None):
+        self.matrix = matrix
+        self.ids = ids
+        self.overrides = {} if overrides is None else overrides
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return [self[i] for i in range(*k.indices(len(self)))]
+        k = range(len(self))[k]
+        if k in self.overrides:
+            return self.overrides[k]
+        return self.matrix if self.matrix.ndim == 1 else self.matrix[self.ids[k]]
+
+    def __iter__(self):
+        return (self[k] for k in range(len(self)))
+
+    def gather(self):
+        '''
+            Description:
+                Materializes the history as one array
+            Returns:
+                (1) rows (np.array, LxN): a read-only broadcast view for a 1-D matrix, otherwise a gathered copy
+        '''
+        if self.matrix.ndim == 1 and not self.overrides:
+            return np.broadcast_to(self.matrix, (len(self), len(self.matrix)))
+        rows = np.tile(self.matrix, (len(self), 1)) if self.matrix.ndim == 1 else self.matrix[self.ids]
+        for k, row in self.overrides.items():
+            rows[k] = row
+        return rows
+
+    def __array__(self, dtype = None, copy = None):
+        rows = self.gather()
+        return rows if dtype is None else rows.astype(dtype, copy = False)
+
+
+class CueHistory:
+    '''
+        Description:
+            Compact cue lists and histories of one fluency list, obtained via create_history_variables. Stores the
+            vocabulary id of each item and of its preceding item, the cue lists (size L) and one HistoryRows per
+            cue. It unpacks like the original tuple of lists:
+                sim_list, sim_history, freq_list, freq_history, phon_list, phon_history = history
+            with phon_list and phon_history set to None when no phonological matrix is given.
+        Attributes:
+            ids (int32 np.array, size L): vocabulary id of each item in the fluency list
+            prev_ids (int32 np.array, size L): vocabulary id of the history row of each item, i.e. of the preceding
+                item (the item itself at the first position)
+    '''
+    def __init__(self, ids, prev_ids, sim_list, sim_history, freq_list, freq_history, phon_list = None, phon_history = None):
+        self.ids = ids
+        self.prev_ids = prev_ids
+        self.sim_list = sim_list
+        self.sim_history = sim_history
+        self.freq_list = freq_list
+        self.freq_history = freq_history
+        self.phon_list = phon_list
+        self.phon_history = phon_history
+
+    def __iter__(self):
+        return iter((self.sim_list, self.sim_history, self.freq_list, self.freq_history, self.phon_list, self.phon_history))
+
+    def __getitem__(self, i):
+        return tuple(self)[i]
+
+    def __len__(self):
+        return 6
+
+    def detach(self):
+        '''
+            Description:
+                Returns a copy whose histories hold no reference to the shared matrices, only row ids and override
+                rows, so that it is sent to a worker process in O(L) instead of a copy of the matrices
+        '''
+        return self.attach(None, None, None)
+
+    def attach(self, sim_matrix, freq_matrix, phon_matrix):
+        '''
+            Description:
+                Returns a copy whose histories read their rows from the given matrices (e.g. the matrices of the
+                LexicalSpace of a worker process), keeping the row ids and override rows
+        '''
+        phon_history = None if self.phon_history is None else HistoryRows(phon_matrix, self.phon_history.ids, self.phon_history.overrides)
+        return CueHistory(self.ids, self.prev_ids, self.sim_list, HistoryRows(sim_matrix, self.sim_history.ids, self.sim_history.overrides),
+                          self.freq_list, HistoryRows(freq_matrix, self.freq_history.ids, self.freq_history.overrides), self.phon_list, phon_history)
+
+
+class PhonologicalRowCache:
+    '''
+        Description:
+            Bounded LRU cache of the phonological similarity rows computed on the fly for corrected words, i.e. the
+            normalized edit distance between the pronunciation of a word and that of every word in labels. Each row
+            costs N edit distances, so it is computed once per spelling and shared across subjects.
+        Args:
+            (1) labels: the space of words (Vocabulary, or list of length N)
+            (2) maxsize (int): maximum number of rows kept, least recently used rows are evicted first
+            (3) dtype (np.dtype): precision of the rows
+        Attributes:
+            hits (int): number of rows served from the cache
+            misses (int): number of rows computed
+    '''
+    def __init__(self, labels, maxsize = 256, dtype = np.float64):
+        self.labels = labels
+        self.maxsize = maxsize
+        self.dtype = dtype
+        self.hits = 0
+        self.misses = 0
+        self._rows = OrderedDict()
+        self._phonemes = None
+
+    def row(self, word):
+        '''
+            Description:
+                Returns the phonological similarity of word with every item in labels
+            Args:
+                (1) word (str)
+            Returns:
+                (1) row (np.array, size N, read-only)
+        '''
+        if word in self._rows:
+            self._rows.move_to_end(word)
+            self.hits += 1
+            return self._rows[word]
+        self.misses += 1
+        if self._phonemes is None:
+            self._phonemes = PhonemeCodes([phonology_funcs.wordbreak(label)[0] for label in self.labels])
+        # the word against every label, as one batch of edit distances
+        pronunciation = PhonemeCodes([phonology_funcs.wordbreak(word)[0]], self._phonemes.alphabet)
+        N = len(self._phonemes)
+        row = pair_similarity(pronunciation, np.zeros(N, dtype = np.int64), np.arange(N), self._phonemes).astype(self.dtype)
+        row.setflags(write = False)
+        self._rows[word] = row
+        if len(self._rows) > self.maxsize:
+            self._rows.popitem(last = False)
+        return row
+
+
+def create_history_variables(fluency_list, subject, corrections_df, labels, sim_matrix, freq_matrix, phon_matrix = None, clamp = True, phon_cache = None):
+    '''
+        Args:
+            (1) sim_matrix: semantic similarity matrix (NxN np.array, or an on-demand LowRankSimilarity)
+            (2) phon_matrix: phonological similarity matrix (NxN np.array, or an on-demand PhonologicalSimilarity)
             (3) freq_matrix: frequencies array (Nx1 array)
-            (4) labels: the space of words (list of length N)
+            (4) labels: the space of words (Vocabulary, or list of length N)
             (5) fluency_list: items produced by a participant (list of size L)
+            (6) clamp (bool): set similarities <= 0 to .0001 in sim_matrix and phon_matrix (in place). Not needed
+                for matrices that were prepared once, see LexicalSpace.history_variables
+            (7) phon_cache: PhonologicalRowCache shared across subjects for the phonological rows of corrected words
+                (a cache local to this call is used if None)
 
         Returns: 
-            (1) sim_list (list, size: L): semantic similarities between each item in fluency_list 
-            (2) sim_history(list, size: L arrays of size N): semantic similarities of each word in fluency_list with all items in labels
-            (3) phon_list (list, size: L): phonological similarities between each item in fluency_list 
-            (4) phon_history (list, size: L arrays of size N): phonological similarities of each word in fluency_list with all items in labels
-            (5) freq_list (list, size: L): frequencies of each item in fluency_list (list of size L)
-            (6) freq_history  (list, size: L arrays of size N): frequencies of all words in labels repeated L times
+            history (CueHistory), which unpacks into:
+            (1) sim_list (np.array, size: L): semantic similarities between each item in fluency_list 
+            (2) sim_history (HistoryRows, size: L rows of size N): semantic similarities of each word in fluency_list with all items in labels
+            (3) freq_list (np.array, size: L): frequencies of each item in fluency_list
+            (4) freq_history (HistoryRows, size: L rows of size N): frequencies of all words in labels repeated L times
+            (5) phon_list (np.array, size: L): phonological similarities between each item in fluency_list 
+            (6) phon_history (HistoryRows, size: L rows of size N): phonological similarities of each word in fluency_list with all items in labels
 
 
     '''
+    if clamp:
+        # on-demand similarities (LowRankSimilarity, PhonologicalSimilarity) apply their floor themselves
+        if isinstance(phon_matrix, np.ndarray):
+            phon_matrix[phon_matrix <= 0] = .0001
+        if isinstance(sim_matrix, np.ndarray):
+            sim_matrix[sim_matrix <= 0] = .0001
+
+    if not isinstance(labels, Vocabulary):
+        labels = Vocabulary(labels)
+    # encode the fluency list into vocabulary ids once
+    ids = labels.encode(fluency_list)
+    # the history row of each item is the row of the preceding item, and the item's own row for the first word
+    prev_ids = np.concatenate([ids[:1], ids[:-1]])
+
+    freq_list = freq_matrix[ids]
+    sim_list = sim_matrix[prev_ids, ids]
+    sim_list[:1] = 0.0001
+
+    phon_list, phon_history = None, None
     if phon_matrix is not None:
-        phon_matrix[phon_matrix <= 0] = .0001
-    sim_matrix[sim_matrix <= 0] = .0001
-
-    freq_list = []
-    freq_history = []
-
-    sim_list = []
-    sim_history = []
-
-    phon_list = []
-    phon_history = []
-
-    # obtain that specific IDs list, after exclusions
-
-    subject_replacement_df = corrections_df[corrections_df['SID'] == subject]
-    original_words = subject_replacement_df['entry'].tolist()
-    replaced_words = subject_replacement_df['final_word'].tolist()
-
-
-    for i in range(0,len(fluency_list)):
-        word = fluency_list[i]
-        currentwordindex = labels.index(word)
-
-        freq_list.append(freq_matrix[currentwordindex])
-        freq_history.append(freq_matrix)
-
-        if i > 0: # get similarity between this word and preceding word
-            prevword = fluency_list[i-1]
-            prevwordindex = labels.index(prevword)
-            sim_list.append(sim_matrix[prevwordindex, currentwordindex] )
-            sim_history.append(sim_matrix[prevwordindex,:])
-            if phon_matrix is not None:
-                ## check if the word is in the corrections file at all 
-                if word in replaced_words:
-                    index_of_word = replaced_words.index(word)
-                    original_current_word = original_words[index_of_word]
-                    
-                    phon_sim = phonology_funcs.normalized_edit_distance(phonology_funcs.wordbreak(prevword)[0], phonology_funcs.wordbreak(original_current_word)[0])
-                    print(f"phon sim between {prevword} and {original_current_word}={phon_sim}")
-                    phon_list.append(phon_sim)
-                    # also compute similarity of prev_word to every other word in vocab to add to history term
-                    phon_sim_history = [phonology_funcs.normalized_edit_distance(
-                                        phonology_funcs.wordbreak(prevword)[0], 
-                                        phonology_funcs.wordbreak(labels[i])[0]
-                                    ) for i in range(len(labels))]
-
-                    phon_history.append(phon_sim_history)
-                else:
-                    # no corrections
-                    phon_list.append(phon_matrix[prevwordindex, currentwordindex] )
-                    phon_history.append(phon_matrix[prevwordindex,:])
-                    
-
-        else: # first word
-            sim_list.append(0.0001)
-            sim_history.append(sim_matrix[currentwordindex,:])
-            if phon_matrix is not None:
-                phon_list.append(0.0001)
-                phon_history.append(phon_matrix[currentwordindex,:])
-
-    return sim_list, sim_history, freq_list, freq_history, phon_list, phon_history
+        phon_list = phon_matrix[prev_ids, ids]
+        phon_list[:1] = 0.0001
+
+        # obtain that specific IDs list, after exclusions
+
+        subject_replacement_df = corrections_df[corrections_df['SID'] == subject]
+        # original entry of each corrected word, keeping the first correction as with list.index
+        corrections = {}
+        for original_word, replaced_word in zip(subject_replacement_df['entry'].tolist(), subject_replacement_df['final_word'].tolist()):
+            corrections.setdefault(replaced_word, original_word)
+
+        if phon_cache is None and len(corrections) > 0:
+            phon_cache = PhonologicalRowCache(labels, dtype = phon_matrix.dtype)
+        overrides = {}
+        for i in range(1, len(fluency_list)):
+            word = fluency_list[i]
+            ## check if the word is in the corrections file at all 
+            if word in corrections:
+                prevword = fluency_list[i-1]
+                original_current_word = corrections[word]
+
+                phon_list[i] = phonology_funcs.normalized_edit_distance(phonology_funcs.wordbreak(prevword)[0], phonology_funcs.wordbreak(original_current_word)[0])
+                # also the similarity of prev_word to every other word in vocab, for the history term
+                overrides[i] = phon_cache.row(prevword)
+        phon_history = HistoryRows(phon_matrix, prev_ids, overrides)
+
+    return CueHistory(ids, prev_ids, sim_list, HistoryRows(sim_matrix, prev_ids), freq_list, HistoryRows(freq_matrix, ids), phon_list, phon_history)
     
 
 def get_labels_and_frequencies(path_to_frequencies):
@@ -120,21 +270,94 @@ def get_labels_and_frequencies(path_to_frequencies):
 
     return labels, freq_matrix
 
-def create_semantic_matrix(path_to_embeddings):
+def create_semantic_matrix(path_to_embeddings, path = None, dtype = np.float32):
     '''
         Description:
-            Takes in N word embeddings and returns a semantic similarity matrix (NxN np.array)
+            Takes in N word embeddings and returns a semantic similarity matrix (NxN np.array), computed in blocks
+            of rows by semantic.similarity_matrix
         Args:
-            (1) path_to_embeddings (str): path to a .csv file containing N word embeddings of size D each (DxN array)
+            (1) path_to_embeddings (str): embedding store of N word embeddings of size D each, or path to a .csv
+                file of them (DxN array), see embedding_store.open_embeddings
+            (2) path (str): .npy file that the matrix is streamed to as a memory map (optional)
+            (3) dtype (np.dtype): precision of the matrix
         Returns: 
-            (1) semantic_matrix: semantic similarity matrix (NxN np.array)
+            (1) semantic_matrix: semantic similarity matrix (NxN np.array, or np.memmap of path)
     '''
-    embeddings = pd.read_csv(path_to_embeddings, encoding="unicode-escape").transpose().values
-    N = len(embeddings)
-    
-    semantic_matrix = 1-scipy.spatial.distance.cdist(embeddings, embeddings, 'cosine').reshape(-1)
-    semantic_matrix = semantic_matrix.reshape((N,N))
-    return semantic_matrix
+    return semantic.similarity_matrix(open_embeddings(path_to_embeddings).vectors, path, dtype)
+
+def cmudict():
+    # the NLTK CMU dictionary, downloaded if the corpus is missing
+    try:
+        return nltk.corpus.cmudict.dict()
+    except LookupError:
+        nltk.download('cmudict')
+        return nltk.corpus.cmudict.dict()
+
+class PronunciationStore:
+    '''
+        Description:
+            ARPAbet pronunciation dictionary (the NLTK CMU dictionary), loaded once per process on first use instead
+            of on every lookup. With a path, the dictionary is read from a compact binary file (.npz of words and
+            their packed pronunciations, decoded on lookup) if it exists, and otherwise from the NLTK corpus in
+            memory. The binary file is only written by phonology_funcs.build_arpabet, never on lookup.
+        Args:
+            (1) path (str): binary file the dictionary is read from (optional)
+            (2) arpabet (dict): word -> list of pronunciations to use instead of the CMU dictionary (optional)
+    '''
+    def __init__(self, path = None, arpabet = None):
+        self.path = path
+        self._arpabet = arpabet
+
+    @property
+    def arpabet(self):
+        if self._arpabet is None:
+            self._arpabet = self.load()
+        return self._arpabet
+
+    def load(self):
+        if self.path is not None and os.path.exists(self.path):
+            return PackedArpabet(self.path)
+        return cmudict()
+
+    def __contains__(self, word):
+        return word in self.arpabet
+
+    def __getitem__(self, word):
+        return self.arpabet[word]
+
+
+class PackedArpabet:
+    '''
+        Description:
+            Pronunciation dictionary read from a binary file written by PackedArpabet.save. The pronunciations of
+            each word are stored as one string (phonemes separated by spaces, pronunciations by '|') and are only
+            split into phoneme lists when the word is looked up.
+    '''
+    def __init__(self, path):
+        with np.load(path) as packed:
+            self.index = {word: i for i, word in enumerate(packed['words'].tolist())}
+            self.pronunciations = packed['pronunciations']
+
+    @staticmethod
+    def save(path, arpabet):
+        words = list(arpabet)
+        packed = ['|'.join(' '.join(pronunciation) for pronunciation in arpabet[word]) for word in words]
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, words = np.array(words), pronunciations = np.array(packed))
+
+    def __contains__(self, word):
+        return word in self.index
+
+    def __getitem__(self, word):
+        return [pronunciation.split(' ') for pronunciation in str(self.pronunciations[self.index[word]]).split('|')]
+
+
+# shared by every phonology_funcs call of the process
+pronunciations = PronunciationStore()
+
 
 class phonology_funcs:
     '''
@@ -142,37 +365,76 @@ class phonology_funcs:
             This class contains functions to generate phonemes from a list of words and create a phonological similarity matrix.
             Code has been adapted from the following link: https://stackoverflow.com/questions/33666557/get-phonemes-from-any-word-in-python-nltk-or-other-modules
         Functions:
-            (1) load_arpabet(): loads and returns the arpabet dictionary from the NLTK CMU dictionary
-            (2) wordbreak(s, arpabet): takes in a word (str) and an arpabet dictionary and returns a list of phonemes
-            (3) normalized_edit_distance(w1, w2): takes in two strings (w1, w2) and returns the normalized edit distance between them
-            (3) create_phonological_matrix: takes in a list of labels (size N) and returns a phonological similarity matrix (NxN np.array)
+            (1) load_arpabet(path): sets the binary file of the process-wide pronunciation store and returns the store
+            (2) build_arpabet(path): writes the binary pronunciation file from the NLTK CMU dictionary
+            (3) wordbreak(s): takes in a word (str) and returns its possible pronunciations (lists of phonemes)
+            (4) normalized_edit_distance(w1, w2): takes in two strings (w1, w2) and returns the normalized edit distance between them
+            (5) create_phonological_matrix: takes in a list of labels (size N) and returns a phonological similarity matrix (NxN np.array)
+            (6) encode_pronunciations: takes in a list of labels (size N) and returns their encoded pronunciations (PhonemeCodes)
+            (7) create_phonological_similarity: takes in a list of labels (size N) and returns an on-demand phonological similarity
     '''
-    @lru_cache()
+    def load_arpabet(path = None):
+        '''
+            Description:
+                Points the process-wide pronunciation store to a binary file, which is read on the next lookup if
+                it exists (otherwise the NLTK CMU dictionary is read in memory; see build_arpabet)
+            Args:
+                (1) path (str): path of the binary pronunciation file
+            Returns:
+                (1) pronunciations (PronunciationStore)
+        '''
+        global pronunciations
+        if path != pronunciations.path:
+            pronunciations = PronunciationStore(path)
+            phonology_funcs.wordbreak.cache_clear()
+        return pronunciations
+
+    def build_arpabet(path):
+        '''
+            Description:
+                Writes the binary pronunciation file read by load_arpabet from the NLTK CMU dictionary
+            Args:
+                (1) path (str): path of the binary pronunciation file
+            Returns:
+                (1) pronunciations (PronunciationStore): the process-wide store, reading the new file
+        '''
+        global pronunciations
+        PackedArpabet.save(path, cmudict())
+        pronunciations = PronunciationStore(path)
+        phonology_funcs.wordbreak.cache_clear()
+        return pronunciations
+
+    @lru_cache(maxsize = 2**16)
     def wordbreak(s):
         '''
             Description:
-                Takes in a word (str) and an arpabet dictionary and returns a list of phonemes
+                Takes in a word (str) and returns its pronunciations. Words that are not in the arpabet dictionary
+                are segmented into dictionary words, trying split points closest to the middle first; the
+                segmentations of all suffixes are memoized, so each is searched at most once per word.
             Args:
                 (1) s (str): string to be broken into phonemes
             Returns:
-                (1) phonemes (list, size: variable): list of phonemes in s 
-        '''
-        try:
-            arpabet = nltk.corpus.cmudict.dict()
-        except LookupError:
-            nltk.download('cmudict')
-            arpabet = nltk.corpus.cmudict.dict()
-                
+                (1) phonemes (list, size: variable): list of pronunciations (lists of phonemes) of s, or None
+        '''
+        arpabet = pronunciations
         s = s.lower()
         if s in arpabet:
             return arpabet[s]
-        middle = len(s)/2
-        partition = sorted(list(range(len(s))), key=lambda x: (x-middle)**2-x)
-        for i in partition:
-            pre, suf = (s[:i], s[i:])
-            if pre in arpabet and phonology_funcs.wordbreak(suf) is not None:
-                return [x+y for x,y in iterprod(arpabet[pre], phonology_funcs.wordbreak(suf))]
-        return None
+
+        memo = {}
+        def segment(j):
+            # pronunciations of the suffix s[j:]
+            if j not in memo:
+                suf = s[j:]
+                memo[j] = arpabet[suf] if suf in arpabet else None
+                if memo[j] is None:
+                    middle = len(suf)/2
+                    for i in sorted(range(len(suf)), key=lambda x: (x-middle)**2-x):
+                        if suf[:i] in arpabet and segment(j + i) is not None:
+                            memo[j] = [x+y for x,y in iterprod(arpabet[suf[:i]], segment(j + i))]
+                            break
+            return memo[j]
+        return segment(0)
 
     def normalized_edit_distance(w1, w2):
         '''
@@ -186,23 +448,60 @@ class phonology_funcs:
         '''
         return round(1-nltk.edit_distance(w1,w2)/(max(len(w1), len(w2))),4)
 
-    def create_phonological_matrix(labels):
+    def create_phonological_matrix(labels, workers = None):
         '''
             Description:
-                Takes in a list of labels (size N) and returns a phonological similarity matrix (NxN np.array)
+                Takes in a list of labels (size N) and returns a phonological similarity matrix (NxN np.array).
+                The pronunciations are integer-encoded and the normalized edit distances of all pairs are computed
+                in vectorized batches on a process pool (see phonology.py), with the same scores as
+                normalized_edit_distance.
             Args:
                 (1) labels: a list of words matching the size of your search space (list of length N)
+                (2) workers (int): number of processes (default: all cores)
             Returns: 
                 (1) phonological_matrix: phonological similarity matrix (NxN np.array)
         '''
         labels = [re.sub('[^a-zA-Z]+', '', str(v)) for v in labels]
-        sim = np.zeros((len(labels), len(labels)))
-        for i in tqdm(range(len(labels))):
-            for j in range(i):
-                sim[i, j] = phonology_funcs.normalized_edit_distance(phonology_funcs.wordbreak(labels[i])[0], phonology_funcs.wordbreak(labels[j])[0])
-        sim = sim + sim.T
-        np.fill_diagonal(sim, 1)
-        return sim
+        phonemes = PhonemeCodes([phonology_funcs.wordbreak(label)[0] for label in labels])
+        return similarity_matrix(phonemes, workers)
+
+    def encode_pronunciations(labels):
+        '''
+            Description:
+                Encodes the first pronunciation of each label (letters only) into PhonemeCodes, as used by the
+                on-demand phonological similarity
+            Args:
+                (1) labels: a list of words matching the size of your search space (list of length N)
+            Returns:
+                (1) phonemes (PhonemeCodes)
+        '''
+        labels = [re.sub('[^a-zA-Z]+', '', str(v)) for v in labels]
+        return PhonemeCodes([phonology_funcs.wordbreak(label)[0] for label in labels])
+
+    def create_phonological_similarity(labels, k = None, path = None, workers = None, dtype = np.float64):
+        '''
+            Description:
+                Takes in a list of labels (size N) and returns an on-demand phonological similarity (see
+                phonology.py), for vocabularies too large for a dense NxN matrix. Rows are computed when they are
+                used; with a top-k matrix, they are read from the k nearest neighbors of each word instead.
+            Args:
+                (1) labels: a list of words matching the size of your search space (list of length N)
+                (2) k (int): number of neighbors per word of the sparse top-k matrix to build (optional)
+                (3) path (str): .npz file of the top-k matrix, loaded if it exists and otherwise written once
+                    built (optional)
+                (4) workers (int): number of processes used to build the top-k matrix (default: all cores)
+                (5) dtype (np.dtype): precision of the similarities
+            Returns: 
+                (1) phonological_similarity: PhonologicalSimilarity, indexed like the NxN matrix
+        '''
+        similarity = PhonologicalSimilarity(phonology_funcs.encode_pronunciations(labels), dtype = dtype)
+        if path is not None and os.path.exists(path):
+            similarity.load_topk(path)
+        elif k is not None:
+            similarity.build_topk(k, workers)
+            if path is not None:
+                similarity.save_topk(path)
+        return similarity
 
 
 ## SAMPLE USAGE ###
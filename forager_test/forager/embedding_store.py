@@ -0,0 +1,252 @@
+import os
+import json
+import hashlib
+import argparse
+import warnings
+import numpy as np
+import pandas as pd
+from forager.vocabulary import Vocabulary
+
+'''
+
+Binary embedding stores: word embeddings kept as one contiguous float32 .npy matrix (one row per word), which is
+    memory-mapped instead of being parsed, next to a plain-text vocabulary index (one word per line), so the
+    vocabulary of a domain is listed without touching the vectors. Stores replace the DxN CSV files whose columns
+    are words (USE_embeddings.csv, semantic_embeddings.csv); importers and exporters convert between the two.
+    Stores are only written by an explicit import (`import-embeddings <csv>`, or EmbeddingStore.from_csv); reading
+    embeddings never writes anything.
+
+    A store <name> is written as
+        <name>.npy: embeddings (N x D, float32)
+        <name>.vocab.txt: the N words, in the order of the rows
+        <name>.source.json: size, modification time and sha256 checksum of the imported .csv file (imports only)
+
+    Classes
+        (1) EmbeddingStore: memory-mapped embeddings and vocabulary index of a store
+    Functions
+        (1) store_path: name of the store that corresponds to a .csv file of embeddings
+        (2) read_csv: parses a .csv file of embeddings into an in-memory store
+        (3) source_entry, source_changed: size, modification time and checksum of a source file, to tell whether it
+            changed since it was read (also used by the sources of lexicon bundles)
+        (4) open_embeddings: opens the store of a .csv file if it was imported from it, and otherwise parses the .csv
+        (5) main: command line interface, `import-embeddings <csv>`
+'''
+
+
+class EmbeddingStore:
+    '''
+        Description:
+            Opens an embedding store. The vocabulary index and the vectors are read lazily and independently:
+            words only reads <name>.vocab.txt, and vectors memory-maps <name>.npy (read-only, zero-copy). A store
+            without a path holds its words and vectors in memory (see read_csv).
+        Args:
+            (1) path (str): name of the store, without extension (e.g. data/lexical_data/animals/USE_embeddings)
+    '''
+    def __init__(self, path):
+        self.path = path
+        self._words = None
+        self._vectors = None
+        self._vocabulary = None
+
+    @classmethod
+    def from_arrays(cls, words, vectors):
+        # in-memory store, nothing is written
+        store = cls(None)
+        store._words = [str(word) for word in words]
+        store._vectors = np.ascontiguousarray(vectors, dtype = np.float32)
+        return store
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(path + '.npy') and os.path.exists(path + '.vocab.txt')
+
+    @classmethod
+    def save(cls, path, words, vectors):
+        '''
+            Description:
+                Writes a store from words and their embeddings
+            Args:
+                (1) path (str): name of the store, without extension
+                (2) words: the N words (list of str)
+                (3) vectors: their embeddings (array-like, N x D)
+            Returns:
+                (1) store (EmbeddingStore)
+        '''
+        words = [str(word) for word in words]
+        vectors = np.ascontiguousarray(vectors, dtype = np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(words):
+            raise Exception("An embedding store needs one row of embeddings per word, got " + str(vectors.shape) + " for " + str(len(words)) + " words")
+        if any('\n' in word for word in words):
+            raise Exception("Words of an embedding store cannot contain line breaks")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+        np.save(path + '.npy', vectors)
+        with open(path + '.vocab.txt', 'w', encoding = 'utf-8') as f:
+            f.write(''.join(word + '\n' for word in words))
+        return cls(path)
+
+    @classmethod
+    def from_csv(cls, path_to_csv, path = None):
+        '''
+            Description:
+                Imports a .csv file of embeddings whose columns are words (DxN) into a store, recording the size,
+                modification time and checksum of the .csv so that open_embeddings can tell when it changed
+            Args:
+                (1) path_to_csv (str): path to the .csv file
+                (2) path (str): name of the store (default: the .csv path without its extension)
+            Returns:
+                (1) store (EmbeddingStore)
+        '''
+        data = read_csv(path_to_csv)
+        path = store_path(path_to_csv) if path is None else path
+        store = cls.save(path, data.words, data.vectors)
+        with open(path + '.source.json', 'w') as f:
+            json.dump(source_entry(path_to_csv, os.path.dirname(path_to_csv)), f, indent = 2)
+        return store
+
+    def changed(self, path_to_csv):
+        '''
+            Description:
+                Tells whether a .csv file differs from the one the store was imported from: its size differs, or
+                its modification time and checksum both differ. Stores that were not imported from a .csv
+                (e.g. written by USEembeddings) are never reported as changed.
+        '''
+        if self.path is None or not os.path.exists(self.path + '.source.json') or not os.path.exists(path_to_csv):
+            return False
+        with open(self.path + '.source.json') as f:
+            return source_changed(path_to_csv, json.load(f))
+
+    def to_csv(self, path_to_csv):
+        '''
+            Description:
+                Exports the store as a .csv file whose columns are words (DxN), as USE_embeddings.csv
+        '''
+        self.to_frame().to_csv(path_to_csv, index = False)
+
+    def to_frame(self):
+        # DxN DataFrame with one column per word
+        return pd.DataFrame(np.asarray(self.vectors).T, columns = self.words)
+
+    @property
+    def words(self):
+        if self._words is None:
+            with open(self.path + '.vocab.txt', encoding = 'utf-8') as f:
+                self._words = f.read().splitlines()
+        return self._words
+
+    @property
+    def vectors(self):
+        if self._vectors is None:
+            self._vectors = np.load(self.path + '.npy', mmap_mode = 'r')
+        return self._vectors
+
+    @property
+    def vocabulary(self):
+        if self._vocabulary is None:
+            self._vocabulary = Vocabulary(self.words, aliases = False)
+        return self._vocabulary
+
+    def __len__(self):
+        return len(self.words)
+
+    def __contains__(self, word):
+        return word in self.vocabulary
+
+    def __getitem__(self, word):
+        return self.vectors[self.vocabulary.index(word)]
+
+    def get(self, words):
+        '''
+            Description:
+                Returns the embeddings of a list of words, in its order
+            Args:
+                (1) words: list of size M
+            Returns:
+                (1) vectors (np.array, M x D)
+        '''
+        return self.vectors[self.vocabulary.encode(words)]
+
+    def __getstate__(self):
+        # worker processes reopen the memory map, in-memory stores are copied
+        state = self.__dict__.copy()
+        if self.path is not None:
+            state['_vectors'] = None
+        return state
+
+
+def store_path(path_to_csv):
+    return os.path.splitext(path_to_csv)[0]
+
+def checksum(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def source_entry(source, root):
+    # what is recorded of a source file (a .csv imported into a store, or a source of a lexicon bundle) to tell
+    # whether it changed since, see source_changed
+    return {'file': os.path.relpath(source, root), 'bytes': os.path.getsize(source), 'mtime': os.path.getmtime(source),
+            'sha256': checksum(source)}
+
+def source_changed(source, entry, verify = False):
+    '''
+        Description:
+            Tells whether a source file differs from its source_entry: its size differs, or its modification time
+            and its sha256 checksum both differ. With verify = True, the checksum is compared even if the
+            modification time is the same.
+        Args:
+            (1) source (str): path to the source file
+            (2) entry (dict): source_entry recorded when the file was read
+            (3) verify (bool): always compare the sha256 checksum
+        Returns:
+            (1) changed (bool)
+    '''
+    if os.path.getsize(source) != entry['bytes']:
+        return True
+    return (verify or os.path.getmtime(source) != entry['mtime']) and checksum(source) != entry['sha256']
+
+def read_csv(path_to_csv):
+    '''
+        Description:
+            Parses a .csv file of embeddings whose columns are words (DxN) into an in-memory store, without writing
+    '''
+    data = pd.read_csv(path_to_csv, encoding = "unicode-escape")
+    return EmbeddingStore.from_arrays(data.columns.to_list(), data.transpose().values)
+
+def open_embeddings(path):
+    '''
+        Description:
+            Opens the embeddings of a domain without writing anything. For a .csv file of embeddings, the store
+            next to it is opened if it was imported from that file (see import-embeddings) and the file has not
+            changed since; otherwise the .csv is parsed in memory, with a warning if the store is out of date.
+        Args:
+            (1) path (str): name of a store, or path to a .csv file of embeddings (DxN, columns are words)
+        Returns:
+            (1) store (EmbeddingStore)
+    '''
+    if not path.endswith('.csv'):
+        if not EmbeddingStore.exists(path):
+            raise Exception("No embedding store found at " + path)
+        return EmbeddingStore(path)
+    if EmbeddingStore.exists(store_path(path)):
+        store = EmbeddingStore(store_path(path))
+        if not store.changed(path):
+            return store
+        warnings.warn("The embedding store {store} is out of date, reading {csv} instead. Run import-embeddings {csv} again.".format(store = store.path, csv = path))
+    return read_csv(path)
+
+def main(args = None):
+    parser = argparse.ArgumentParser(prog = 'import-embeddings', description = 'Import a .csv file of embeddings (DxN, columns are words) into a binary embedding store.')
+    parser.add_argument('csv', type = str, help = 'path to the .csv file, e.g. data/lexical_data/animals/USE_embeddings.csv')
+    parser.add_argument('--store', type = str, default = None, help = 'name of the store, without extension (default: the .csv path without its extension)')
+    args = parser.parse_args(args)
+
+    store = EmbeddingStore.from_csv(args.csv, args.store)
+    print("Embeddings of {n} words written to {path}.npy and {path}.vocab.txt".format(n = len(store), path = store.path))
+
+
+if __name__ == '__main__':
+    main()
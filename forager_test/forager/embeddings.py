@@ -8,6 +8,7 @@ import gensim.downloader as api
 import os
 import os.path 
 import numpy as np
+from forager.embedding_store import EmbeddingStore
 
 # pip install alive-progress for progress bar 
 from alive_progress import alive_bar 
@@ -15,15 +16,16 @@ from alive_progress import alive_bar
 class embeddings:
     '''
         Description: 
-            Embeddings class contains functions that create the embeddings.csv file from a list of words
-            using gensim based on the fasttext model trained on Wiki News dataset.
+            Embeddings class contains functions that create the semantic_embeddings store from a list of words
+            using gensim based on the fasttext model trained on Wiki News dataset. Stores are written as a float32
+            .npy matrix and a .vocab.txt index (see embedding_store); EmbeddingStore.to_csv exports them as .csv.
             
         Functions: 
-            (1) __init__: creates embeddings.csv file
+            (1) __init__: creates the semantic_embeddings store
             (2) collect_words: preprocesses the list of words.
             (3) word_checker: checks if word is in PyMagnitude's vectors. If not, gets the most similar word.
-            (4) new_semantic_embeddings: creates a new semantic_embeddings.csv if it does not exist
-            (5) add_semantic_embeddings: add to semantic_embeddings.csv since it already exists
+            (4) new_semantic_embeddings: creates a new semantic_embeddings store if it does not exist
+            (5) add_semantic_embeddings: add to the semantic_embeddings store since it already exists
     
     '''
     def __init__(self, list_of_words, domain_name): 
@@ -51,7 +53,7 @@ class embeddings:
         self.non_vector_dict = {} 
 
         # make new semantic embeddings if file does not exists, add to semantic embeddings if exists. 
-        if os.path.exists(self.path + "/semantic_embeddings.csv"): 
+        if EmbeddingStore.exists(self.path + "/semantic_embeddings"): 
             print("test")
             self.add_semantic_embeddings()
         
@@ -65,20 +67,20 @@ class embeddings:
     def new_semantic_embeddings(self): 
         '''
             Description: 
-                Creates new semantic_embeddings.csv. This method is used when a semantic_embeddings.csv 
+                Creates a new semantic_embeddings store. This method is used when a semantic_embeddings store 
                 does not exist in the domain path. Uses the list of words from class constructor and 
                 separates the words to vector and non_vector words. Vector words are words that either 
                 are in fasttext model or have replacement in fasttext model, and Non Vector words are 
                 words that are not in fasttext model and does not have replacements. 
             
-                Function creates three csv files : 
-                                            1. semantic_embeddings.csv (combined known and unknown words)
-                                            2. non_vector_semantic_embeddings.csv (unknown words)
-                                            3. vector_semantic_embeddings.csv (known words) 
+                Function creates three stores : 
+                                            1. semantic_embeddings (combined known and unknown words)
+                                            2. non_vector_semantic_embeddings (unknown words)
+                                            3. vector_semantic_embeddings (known words) 
         
         '''    
         
-        # make two dictionaries for known and unknown words from list of words
+        # make two lists for known and unknown words from list of words
         # if known word, then get embeddings
         with alive_bar(len(self.words)) as bar:
             for word in self.words: 
@@ -91,58 +93,33 @@ class embeddings:
                     self.embeddings += [vector] 
                 bar()
         
-
-        # creating self.vector_dict with known words and embeddings as keys and values
-        i = 0
-        while i < len(self.vector_words): 
-            self.vector_dict[self.vector_words[i]] = self.embeddings[i]
-            i += 1
-        
-        # creating known word embedding dataframe 
-        self.vector_df = pd.DataFrame(self.vector_dict)
-        self.vector_df.to_csv(self.path + '/vector_semantic_embeddings.csv', index=False)
-        
-        # dedicating unknown word embeddings with mean of all known word embeddings
-        mean = np.mean(self.vector_df, axis = 1)
-        for word in self.non_vector_words: 
-            self.non_vector_dict[word] = mean.tolist()
-
-        # creating unknown word embedding dataframe 
-        self.non_vector_df = pd.DataFrame(self.non_vector_dict)
-        self.non_vector_df.to_csv(self.path + '/non_vector_semantic_embeddings.csv', index = False)
-        
-        # combining known and unknown word dataframe into single dataframe/csv
-        self.semantic_embeddings = pd.concat([self.vector_df, self.non_vector_df], axis = 1) 
-        self.semantic_embeddings.to_csv(self.path + '/semantic_embeddings.csv', index = False)
+        self.vector_dict = dict(zip(self.vector_words, self.embeddings))
+        self.write_semantic_embeddings(self.vector_words, np.reshape(self.embeddings, (len(self.vector_words), self.model.vector_size)), self.non_vector_words)
         
     def add_semantic_embeddings(self):
         '''
             Description: 
-                adds to previous semantic_embeddings.csv. This method is used when a semantic_embeddings.csv 
-                exists in the domain path. Uses the list of words from class constructor and separates the 
+                adds to the previous semantic_embeddings store. This method is used when a semantic_embeddings 
+                store exists in the domain path. Uses the list of words from class constructor and separates the 
                 words to vector and non_vector words. Vector words are words that either are in fasttext model 
                 or have replacement in fasttext model, and Non Vector words are words that are not in fasttext 
                 model and does not have replacements. 
             
-                Function creates three csv files : 
-                                            1. semantic_embeddings.csv (combined known and unknown words)
-                                            2. non_vector_semantic_embeddings.csv (unknown words)
-                                            3. vector_semantic_embeddings.csv (known words) 
+                Function creates three stores : 
+                                            1. semantic_embeddings (combined known and unknown words)
+                                            2. non_vector_semantic_embeddings (unknown words)
+                                            3. vector_semantic_embeddings (known words) 
         
         '''    
         
-        # read vector_semantic_embeddings & non_vector_semantic_embeddings and create dataframe
-        vector_df = pd.read_csv(self.path + '/vector_semantic_embeddings.csv')
-        non_vector_df = pd.read_csv(self.path + '/non_vector_semantic_embeddings.csv')
-        
-        # get lists of words from both vector words & non vector words dataframes
-        vector_df_words = list(vector_df.columns.values)
-        non_vector_df_words = list(non_vector_df.columns.values)
+        # read the vocabularies of the vector and non vector stores, without loading their embeddings
+        vector_store = EmbeddingStore(self.path + '/vector_semantic_embeddings')
+        non_vector_store = EmbeddingStore(self.path + '/non_vector_semantic_embeddings')
         
         # combined words from vector words and non vector words 
-        all_df_words = vector_df_words + non_vector_df_words
+        all_df_words = set(vector_store.words) | set(non_vector_store.words)
         
-        # make two dictionaries for known and unknown words from list of words
+        # make two lists for known and unknown words from list of words
         # if known word, then get embeddings
         with alive_bar(len(self.words)) as bar: 
             for word in self.words: 
@@ -157,30 +134,35 @@ class embeddings:
 
                 bar()
         
-        # creating self.vector_dict with known words and embeddings as keys and values
-        i = 0 
-        while i < len(self.vector_words): 
-            self.vector_dict[self.vector_words[i]] = self.embeddings[i]
-            i +=1 
+        self.vector_dict = dict(zip(self.vector_words, self.embeddings))
 
-        # combining old known word embedding dataframe with old known word embedding dataframe
-        vector_df = pd.concat([vector_df, pd.DataFrame(self.vector_dict)], axis = 1)
-        vector_df.to_csv(self.path + '/vector_semantic_embeddings.csv', index = False) 
+        # combining old known word embeddings with new known word embeddings
+        # (copied out of the memory map before the store is rewritten)
+        vectors = np.concatenate([vector_store.vectors, np.reshape(self.embeddings, (len(self.vector_words), self.model.vector_size))])
+        self.write_semantic_embeddings(vector_store.words + self.vector_words, vectors, non_vector_store.words + self.non_vector_words)
 
-        # dedicating unknown word embeddings with mean of all known word embedding
-        # (mean of combined old and new word embeddings) 
-        self.non_vector_words =  non_vector_df_words + self.non_vector_words 
-        mean = np.mean(vector_df, axis = 1) 
-        for word in self.non_vector_words: 
-            self.non_vector_dict[word] = mean.tolist()
-        
-        # creating unknown word embedding dataframe
-        self.non_vector_df = pd.DataFrame(self.non_vector_dict)
-        self.non_vector_df.to_csv(self.path + '/non_vector_semantic_embeddings.csv', index = False)
-        
-        # combining known and unknown word dataframe into single dataframe/csv 
-        self.semantic_embeddings = pd.concat([vector_df, self.non_vector_df], axis = 1)
-        self.semantic_embeddings.to_csv(self.path + '/semantic_embeddings.csv', index = False)
+    def write_semantic_embeddings(self, vector_words, vectors, non_vector_words):
+        '''
+            Description: 
+                Writes the vector, non vector and combined semantic_embeddings stores. Unknown words are 
+                dedicated the mean of all known word embeddings.
+            
+            Args: 
+                (1) vector_words: known words (list of size K)
+                (2) vectors: their embeddings (np.array, K x D)
+                (3) non_vector_words: unknown words (list of size U)
+        '''
+        self.non_vector_words = non_vector_words
+        EmbeddingStore.save(self.path + '/vector_semantic_embeddings', vector_words, vectors)
+
+        # dedicating unknown word embeddings with mean of all known word embeddings
+        mean = vectors.mean(axis = 0)
+        self.non_vector_dict = {word: mean.tolist() for word in non_vector_words}
+        non_vectors = np.tile(mean, (len(non_vector_words), 1))
+        EmbeddingStore.save(self.path + '/non_vector_semantic_embeddings', non_vector_words, non_vectors)
+
+        # combining known and unknown word embeddings into a single store
+        self.semantic_embeddings = EmbeddingStore.save(self.path + '/semantic_embeddings', vector_words + non_vector_words, np.concatenate([vectors, non_vectors]))
         
     
     
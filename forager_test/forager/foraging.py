@@ -1,4 +1,5 @@
 import numpy as np
+from forager.likelihood import CueStack
 
 
 class forage:
@@ -24,6 +25,10 @@ class forage:
         model_dynamic_phon: The phonological dynamic model is an extension of the dynamic model, where the phonological 
             similarity cue is included in the memory probe, in either solely local, global, or in both local and global
             transitions
+
+    All models are evaluated through likelihood.CueStack. For parameter fits, build the CueStack once and use
+    CueStack.nll_and_grad / CueStack.hessian (or CueStack.fit) with the cue terms of the model, obtained via
+    CueStack.terms, to fit with gradient-based optimizers.
     '''
 
     def model_static(beta, freql, freqh, siml, simh):
@@ -44,24 +49,9 @@ class forage:
             Returns: 
                 ct (np.float): negative log-likelihood to be minimized in parameter fit 
         '''
-        ct = 0
-
-        for k in range(0, len(freql)):
-            if k == 0:
-                # P of item based on frequency alone (freq of this item / freq of all items)
-                numrat = pow(freql[k],beta[0])
-                denrat = sum(pow(freqh[k],beta[0]))
-            
-            else:    
-                # if not first item then its probability is based on its similarity to prev item AND frequency
-                # P of item based on frequency and similarity
-                numrat = pow(freql[k],beta[0]) * pow(siml[k],beta[1])
-                denrat = sum(pow(freqh[k],beta[0]) * pow(simh[k],beta[1]))
-                
-            ct += - np.log(numrat/denrat)
+        stack = CueStack(freql, freqh, siml, simh)
+        return stack.nll(beta, stack.terms('static'))
 
-        return ct
-        
     def model_dynamic(beta, freql, freqh, siml, simh, switchvals):
         ''' 
         Dynamic Foraging Model based on Hills, T. T., Jones, M. N., & Todd, P. M. (2012).
@@ -83,28 +73,8 @@ class forage:
             Returns: 
                 ct (np.float): negative log-likelihood to be minimized in parameter fit 
         '''
-        ct = 0
-
-        for k in range(0, len(freql)):
-            if k == 0:
-                # P of item based on frequency alone (freq of this item / freq of all items)
-                numrat = pow(freql[k],beta[0])
-                denrat = sum(pow(freqh[k],beta[0]))
-            
-            elif switchvals[k]==1: ## "dip" based on sim-drop
-                # If similarity dips, P of item is based on frequency 
-                numrat = pow(freql[k],beta[0]) 
-                denrat = sum(pow(freqh[k],beta[0]))
-
-            else:    
-                # if not first item then its probability is based on its similarity to prev item AND frequency
-                # P of item based on frequency and similarity
-                numrat = pow(freql[k],beta[0]) * pow(siml[k],beta[1])
-                denrat = sum(pow(freqh[k],beta[0]) * pow(simh[k],beta[1]))
-                
-            ct += - np.log(numrat/denrat)
-
-        return ct
+        stack = CueStack(freql, freqh, siml, simh)
+        return stack.nll(beta, stack.terms('dynamic', switchvals))
 
     def model_static_phon(beta, freql, freqh, siml, simh, phonl, phonh):
         '''
@@ -123,20 +93,8 @@ class forage:
             Returns: 
                 ct (np.float): negative log-likelihood to be minimized in parameter fit 
         '''
-        ct = 0
-
-        for k in range(0, len(freql)):
-            if k == 0:
-                # P of item based on frequency alone (freq of this item / freq of all items)
-                numrat = pow(freql[k],beta[0])
-                denrat = sum(pow(freqh[k],beta[0]))            
-            else:    
-                numrat = pow(freql[k],beta[0]) * pow(phonl[k],beta[2]) * pow(siml[k],beta[1])
-                denrat = sum(pow(freqh[k],beta[0]) * pow(phonh[k],beta[2])* pow(simh[k],beta[1]))
-
-            ct += - np.log(numrat/denrat)
-
-        return ct
+        stack = CueStack(freql, freqh, siml, simh, phonl, phonh)
+        return stack.nll(beta, stack.terms('pstatic'))
 
     def model_dynamic_phon(beta, freql, freqh, siml, simh, phonl, phonh, switchvals, phoncue):
         '''
@@ -171,209 +129,73 @@ class forage:
         if phoncue not in ["global","local","switch"]:
             raise Exception("To use dynamic phonological cue, you must pass a valid parameter value from possible list of values: ['global','local','switch']")
 
-        ct = 0
-
-        for k in range(0, len(freql)):
-            if k == 0:
-                # P of item based on frequency alone (freq of this item / freq of all items)
-                numrat = pow(freql[k],beta[0])
-                denrat = sum(pow(freqh[k],beta[0]))
-            
-            elif switchvals[k]==1: # a switch has been detected
-                if phoncue in ["global","switch"]:
-                    numrat = pow(freql[k],beta[0]) * pow(phonl[k],beta[2]) 
-                    denrat = sum(pow(freqh[k],beta[0]) * pow(phonh[k],beta[2]) )
-                else:
-                    numrat = pow(freql[k],beta[0]) 
-                    denrat = sum(pow(freqh[k],beta[0]))
-
-            else:    
-                if phoncue in ["local","global"]:
-                    numrat = pow(freql[k],beta[0])*pow(phonl[k],beta[2])*pow(siml[k],beta[1])
-                    denrat = sum(pow(freqh[k],beta[0])*pow(phonh[k],beta[2])*pow(simh[k],beta[1]))
-                else:
-                    numrat = pow(freql[k],beta[0]) * pow(siml[k],beta[1])
-                    denrat = sum(pow(freqh[k],beta[0]) * pow(simh[k],beta[1]))
-                
-            ct += - np.log(numrat/denrat)
-
-        return ct
+        stack = CueStack(freql, freqh, siml, simh, phonl, phonh)
+        return stack.nll(beta, stack.terms('pdynamic', switchvals, phoncue))
 
 
 
     def model_static_report(beta, freql, freqh, siml, simh):
         '''
-        Static Foraging Model following proposed approach in Hills, T. T., Jones, M. N., & Todd, P. M. (2012).
-            Optimal Foraging in Semantic Memory.
-
-             
-            Args: 
-                beta (tuple, size: 2): saliency parameter(s) encoding (beta_frequency, beta_semantic).
-                freql (list, size: L): frequency list containing frequency value of corresponding items.
-                freqh (list, size: L): frequency history list of containing frequency value list up 
-                    to current point.
-                siml (list, size: L): similarity list containing frequency value of corresponding items
-                simh (list, size: L): similarity history list of containing similarity value list up 
-                    to current point.
-
-            Returns: 
-                ct (np.float): negative log-likelihood to be minimized in parameter fit 
+            Description:
+                Static Foraging Model (see model_static), also reporting the negative log-likelihood of each item.
+                Evaluated in a single pass through CueStack.report, which also provides the probability and rank
+                of each produced item.
+            Args:
+                see model_static
+            Returns:
+                ct (np.float): negative log-likelihood to be minimized in parameter fit
+                nll_vec (list, size: L): negative log-likelihood of each item in the fluency list
         '''
-        ct = 0
-        nll_vec = []
-        for k in range(0, len(freql)):
-            if k == 0:
-                # P of item based on frequency alone (freq of this item / freq of all items)
-                numrat = pow(freql[k],beta[0])
-                denrat = sum(pow(freqh[k],beta[0]))
-            
-            else:    
-                # if not first item then its probability is based on its similarity to prev item AND frequency
-                # P of item based on frequency and similarity
-                numrat = pow(freql[k],beta[0]) * pow(siml[k],beta[1])
-                denrat = sum(pow(freqh[k],beta[0]) * pow(simh[k],beta[1]))
-                
-            ct += - np.log(numrat/denrat)
-            nll_vec.append(- np.log(numrat/denrat))
+        stack = CueStack(freql, freqh, siml, simh)
+        ct, nll_vec, _, _ = stack.report(beta, stack.terms('static'))
+        return ct, nll_vec.tolist()
 
-        return ct, nll_vec
-        
     def model_dynamic_report(beta, freql, freqh, siml, simh, switchvals):
-        ''' 
-        Dynamic Foraging Model based on Hills, T. T., Jones, M. N., & Todd, P. M. (2012).
-            Optimal Foraging in Semantic Memory.
-
-            Description: This model computes the likelihood of each given item in the fluency list based 
-            on two cues: semantic similarity (local)  and frequency (global). The likelihood is computed
-            based on the product of semantic similarity and frequency until a switch is detected, at which 
-            point the likelihood is computed based on frequency (with the exception of the first item, whose 
-            likelihood is computed based on frequency).
-
-            Args: 
-                beta (tuple, size: 2): saliency parameter(s) encoding (beta_frequency, beta_semantic).
-                freql (list, size: L): frequency list obtained via create_history_variables
-                freqh (list, size: L arrays of size N): frequency history list obtained via create_history_variables
-                siml (list, size: L ): semantic similarity list obtained via create_history_variables
-                simh (list, size: L arrays of size N ): similarity history list obtained via create_history_variables
-                switchvals (list, size: L ): list of switch values for each item in the fluency list.
-            Returns: 
-                ct (np.float): negative log-likelihood to be minimized in parameter fit 
         '''
-        ct = 0
-        nll_vec = []
-        for k in range(0, len(freql)):
-            if k == 0:
-                # P of item based on frequency alone (freq of this item / freq of all items)
-                numrat = pow(freql[k],beta[0])
-                denrat = sum(pow(freqh[k],beta[0]))
-            
-            elif switchvals[k]==1: ## "dip" based on sim-drop
-                # If similarity dips, P of item is based on frequency 
-                numrat = pow(freql[k],beta[0]) 
-                denrat = sum(pow(freqh[k],beta[0]))
-
-            else:    
-                # if not first item then its probability is based on its similarity to prev item AND frequency
-                # P of item based on frequency and similarity
-                numrat = pow(freql[k],beta[0]) * pow(siml[k],beta[1])
-                denrat = sum(pow(freqh[k],beta[0]) * pow(simh[k],beta[1]))
-                
-            ct += - np.log(numrat/denrat)
-            nll_vec.append(- np.log(numrat/denrat))
-
-        return ct, nll_vec
+            Description:
+                Dynamic Foraging Model (see model_dynamic), also reporting the negative log-likelihood of each item.
+                Evaluated in a single pass through CueStack.report, which also provides the probability and rank
+                of each produced item.
+            Args:
+                see model_dynamic
+            Returns:
+                ct (np.float): negative log-likelihood to be minimized in parameter fit
+                nll_vec (list, size: L): negative log-likelihood of each item in the fluency list
+        '''
+        stack = CueStack(freql, freqh, siml, simh)
+        ct, nll_vec, _, _ = stack.report(beta, stack.terms('dynamic', switchvals))
+        return ct, nll_vec.tolist()
 
     def model_static_phon_report(beta, freql, freqh, siml, simh, phonl, phonh):
         '''
-            Description: 
-                This model is an adapted version of static foraging model proposed by Hills, T. T., Jones, M. N., & Todd, P. M. (2012)
-                that incorporates phonological similarity. This model computes the likelihood of each given item 
-                in the fluency list based on three cues: semantic similarity, phonological similarity, and frequency.             
-            Args: 
-                beta (tuple, size: 3): saliency parameter(s) encoding (beta_frequency, beta_semantic, beta_phon).
-                freql (list, size: L): frequency list containing frequency value of corresponding items.
-                freqh (list, size: L arrays of size N): frequency history list of containing frequency value list up to current point.
-                siml (list, size: L): semantic similarity list obtained via create_history_variables
-                simh (list, size: L arrays of size N): similarity history list obtained via create_history_variables
-                phonl (list, size: L): phonological similarity list obtained via create_history_variables
-                phonh (list, size: ): phonological cue history list obtained via create_history_variables
-            Returns: 
-                ct (np.float): negative log-likelihood to be minimized in parameter fit 
+            Description:
+                Phonological Static Foraging Model (see model_static_phon), also reporting the negative log-likelihood
+                of each item. Evaluated in a single pass through CueStack.report, which also provides the probability
+                and rank of each produced item.
+            Args:
+                see model_static_phon
+            Returns:
+                ct (np.float): negative log-likelihood to be minimized in parameter fit
+                nll_vec (list, size: L): negative log-likelihood of each item in the fluency list
         '''
-        ct = 0
-        nll_vec = []
-        for k in range(0, len(freql)):
-            if k == 0:
-                # P of item based on frequency alone (freq of this item / freq of all items)
-                numrat = pow(freql[k],beta[0])
-                denrat = sum(pow(freqh[k],beta[0]))            
-            else:    
-                numrat = pow(freql[k],beta[0]) * pow(phonl[k],beta[2]) * pow(siml[k],beta[1])
-                denrat = sum(pow(freqh[k],beta[0]) * pow(phonh[k],beta[2])* pow(simh[k],beta[1]))
-
-            ct += - np.log(numrat/denrat)
-            nll_vec.append(- np.log(numrat/denrat))
-
-        return ct, nll_vec
+        stack = CueStack(freql, freqh, siml, simh, phonl, phonh)
+        ct, nll_vec, _, _ = stack.report(beta, stack.terms('pstatic'))
+        return ct, nll_vec.tolist()
 
     def model_dynamic_phon_report(beta, freql, freqh, siml, simh, phonl, phonh, switchvals, phoncue):
         '''
-            Description: 
-                This model is an adapted version of dynamic foraging model proposed by Hills, T. T., Jones, M. N., & Todd, P. M. (2012)
-                that incorporates phonological similarity in three different ways. This model computes the likelihood of each given item 
-                in the fluency list based  on three cues: semantic similarity (local), phonological similarity (local/global/switch), and frequency (global). 
-                Depending on the value of phoncue, the likelihood is computed based on a combination of semantic similarity,
-                phonological similarity, and frequency. 
-                - If phoncue is "local", then the likelihood is computed based on semantic similarity, phonological similarity, and frequency 
-                    until a switch is detected at which point the likelihood is computed based on only frequency
-                - If phoncue is "global", then the likelihood is computed based on all three cues during both switch and non-switch transitions
-                - If phoncue is "switch", then the likelihood is computed based on phonological similarity and frequency during switch transitions
-                    and only based on semantic similarity and frequency during non-switch transitions
-            
-            Args: 
-                beta (tuple, size: 3): saliency parameter(s) encoding (beta_frequency, beta_semantic, beta_phon).
-                freql (list, size: L): frequency list containing frequency value of corresponding items.
-                freqh (list, size: L arrays of size N): frequency history list of containing frequency value list up to current point.
-                siml (list, size: L): semantic similarity list obtained via create_history_variables
-                simh (list, size: L arrays of size N): similarity history list obtained via create_history_variables
-                switchvals (list, size: L): list of switch values at given item in fluency list
-                phonl (list, size: L): phonological similarity list obtained via create_history_variables
-                phonh (list, size: ): phonological cue history list obtained via create_history_variables
-                phoncue (str): Determines how to use phonological cue: "global", "local", or "switch"
-            Returns: 
-                ct (np.float): negative log-likelihood to be minimized in parameter fit 
+            Description:
+                Phonological Dynamic Foraging Model (see model_dynamic_phon), also reporting the negative log-likelihood
+                of each item. Evaluated in a single pass through CueStack.report, which also provides the probability
+                and rank of each produced item.
+            Args:
+                see model_dynamic_phon
+            Returns:
+                ct (np.float): negative log-likelihood to be minimized in parameter fit
+                nll_vec (list, size: L): negative log-likelihood of each item in the fluency list
             Raises:
                 Exception: if phoncue is not one of the three options ("global", "local", or "switch")
         '''
-        if phoncue not in ["global","local","switch"]:
-            raise Exception("To use dynamic phonological cue, you must pass a valid parameter value from possible list of values: ['global','local','switch']")
-
-        ct = 0
-        nll_vec = []
-
-        for k in range(0, len(freql)):
-            if k == 0:
-                # P of item based on frequency alone (freq of this item / freq of all items)
-                numrat = pow(freql[k],beta[0])
-                denrat = sum(pow(freqh[k],beta[0]))
-            
-            elif switchvals[k]==1: # a switch has been detected
-                if phoncue in ["global","switch"]:
-                    numrat = pow(freql[k],beta[0]) * pow(phonl[k],beta[2]) 
-                    denrat = sum(pow(freqh[k],beta[0]) * pow(phonh[k],beta[2]) )
-                else:
-                    numrat = pow(freql[k],beta[0]) 
-                    denrat = sum(pow(freqh[k],beta[0]))
-
-            else:    
-                if phoncue in ["local","global"]:
-                    numrat = pow(freql[k],beta[0])*pow(phonl[k],beta[2])*pow(siml[k],beta[1])
-                    denrat = sum(pow(freqh[k],beta[0])*pow(phonh[k],beta[2])*pow(simh[k],beta[1]))
-                else:
-                    numrat = pow(freql[k],beta[0]) * pow(siml[k],beta[1])
-                    denrat = sum(pow(freqh[k],beta[0]) * pow(simh[k],beta[1]))
-                
-            ct += - np.log(numrat/denrat)
-            nll_vec.append(- np.log(numrat/denrat))
-
-        return ct, nll_vec
+        stack = CueStack(freql, freqh, siml, simh, phonl, phonh)
+        ct, nll_vec, _, _ = stack.report(beta, stack.terms('pdynamic', switchvals, phoncue))
+        return ct, nll_vec.tolist()
@@ -6,6 +6,7 @@ from tqdm import tqdm
 import numpy as np
 import re
 from wordfreq import zipf_frequency
+from forager.embedding_store import open_embeddings
 
 def get_frequencies(embeddings,path_for_lexical_data):
     '''
@@ -14,10 +15,10 @@ def get_frequencies(embeddings,path_for_lexical_data):
             The first column is the word, the second is the log count, and the third is the raw count.
             The resulting file is saved in the data/lexical data folder.
         Args:
-            (1) embeddings: path to the CSV file of semantic embeddings
+            (1) embeddings: embedding store of the semantic embeddings, or path to their CSV file. Only the
+            vocabulary index of the store is read.
     '''
-    data = pd.read_csv(embeddings) 
-    items = data.columns.to_list()
+    items = open_embeddings(embeddings).words
 
     items_and_counts = []
     for item in tqdm(items):
@@ -0,0 +1,108 @@
+import numpy as np
+from forager.vocabulary import Vocabulary
+from forager.norms import NormsIndex
+from forager.cues import create_history_variables, PhonologicalRowCache
+
+'''
+
+Lexical data of a domain, prepared once and shared read-only by every subject, switch method and model fit.
+
+    Classes
+        (1) LexicalSpace: labels, frequencies, clamped semantic/phonological matrices and norms of a domain
+'''
+
+
+class LexicalSpace:
+    '''
+        Description:
+            Holds the lexical data of a domain with the similarity floor applied once, so that cue histories are
+            built without re-scanning (and mutating) the NxN matrices for every subject. All arrays are marked
+            read-only, so one LexicalSpace can safely be shared across subjects and worker processes.
+        Args:
+            (1) labels: the space of words (Vocabulary, or list of length N)
+            (2) sim_matrix: semantic similarity matrix (NxN np.array, or an on-demand LowRankSimilarity)
+            (3) freq_matrix: frequencies array (Nx1 array)
+            (4) phon_matrix: phonological similarity matrix (NxN np.array, or an on-demand PhonologicalSimilarity, optional)
+            (5) norms: [animal norms, food norms] DataFrames used by the norms switch methods (optional)
+            (6) domain (str): name of the domain (optional)
+            (7) floor (float): value assigned to similarities <= 0
+            (8) clamped (bool): the floor has already been applied to the matrices (e.g. in a lexicon bundle)
+            (9) bundle (dict): for matrices memory-mapped from a lexicon bundle, the path of the .npy file of each
+                matrix, so that worker processes reopen the shared pages instead of receiving a copy
+    '''
+    def __init__(self, labels, sim_matrix, freq_matrix, phon_matrix = None, norms = None, domain = None, floor = .0001, clamped = False, bundle = None):
+        self.labels = labels if isinstance(labels, Vocabulary) else Vocabulary(labels)
+        # on-demand similarities (LowRankSimilarity, PhonologicalSimilarity) apply their floor themselves
+        self.sim_matrix = self.prepare(sim_matrix, floor, clamped)
+        self.phon_matrix = self.prepare(phon_matrix, floor, clamped)
+        self.freq_matrix = np.asarray(freq_matrix)
+        self.norms = norms
+        # category index of each norms file, shared by every fluency list
+        self.norms_index = None if norms is None else [NormsIndex(n) for n in norms]
+        self.domain = domain
+        self.floor = floor
+        self.bundle = bundle
+        # phonological rows of corrected words, shared by all subjects
+        self.phon_cache = None if self.phon_matrix is None else PhonologicalRowCache(self.labels, dtype = self.phon_matrix.dtype)
+        self.freeze()
+
+    @staticmethod
+    def clamp(matrix, floor):
+        '''
+            Description:
+                Sets all similarities <= 0 to floor, in place when the matrix is writeable and otherwise
+                (e.g. for a read-only memory map) in a copy that is only made if there is something to clamp
+        '''
+        matrix = np.asarray(matrix)
+        below = matrix <= 0
+        if below.any():
+            if not matrix.flags.writeable:
+                matrix = matrix.copy()
+            matrix[below] = floor
+        return matrix
+
+    @classmethod
+    def prepare(cls, matrix, floor, clamped):
+        if matrix is None or not hasattr(matrix, 'flags'):
+            return matrix
+        return np.asarray(matrix) if clamped else cls.clamp(matrix, floor)
+
+    def freeze(self):
+        for matrix in [self.sim_matrix, self.phon_matrix, self.freq_matrix]:
+            if isinstance(matrix, np.ndarray):
+                matrix.setflags(write = False)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.bundle is not None:
+            for key in self.bundle:
+                state[key] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.bundle is not None:
+            for key, path in self.bundle.items():
+                setattr(self, key, np.load(path, mmap_mode = 'r'))
+        # arrays are writeable again after unpickling in a worker process
+        self.freeze()
+
+    @property
+    def dtype(self):
+        return self.sim_matrix.dtype
+
+    def __len__(self):
+        return len(self.labels)
+
+    def history_variables(self, fluency_list, subject, corrections_df):
+        '''
+            Description:
+                Cue lists and histories of a fluency list, obtained via create_history_variables without clamping
+            Args:
+                (1) fluency_list: items produced by a participant (list of size L)
+                (2) subject: ID of the participant, used to look up its corrections
+                (3) corrections_df: corrected entries of all participants (DataFrame with SID, entry, final_word)
+            Returns:
+                (1) history (CueHistory)
+        '''
+        return create_history_variables(fluency_list, subject, corrections_df, self.labels, self.sim_matrix, self.freq_matrix, self.phon_matrix, clamp = False, phon_cache = self.phon_cache)
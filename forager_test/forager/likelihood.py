@@ -0,0 +1,769 @@
+import numpy as np
+from collections import OrderedDict
+from scipy.special import logsumexp
+from scipy.optimize import minimize
+
+'''
+Vectorized log-domain likelihood engine for the foraging models in foraging.py.
+
+    Every foraging model scores item k of a fluency list as
+
+        P(item_k) = prod_c cue_c(item_k)^beta_c / sum_j prod_c cue_c(j)^beta_c
+
+    where the active cues (frequency, semantic, phonological) depend on the model, the position in the list and,
+    for dynamic models, the switch vector. Rather than looping over positions, the cue lists and histories obtained
+    via create_history_variables are stacked once into (C x L) and (C x L x N) log-arrays. Each evaluation of the
+    negative log-likelihood is then one broadcasted beta * log-cue product and a row-wise logsumexp.
+
+    Since the likelihood is a softmax over log-cues, its gradient has a closed form: for each position, the
+    expected log-cue under the model's predictive distribution minus the produced item's log-cue. The Hessian is
+    the summed covariance of the log-cues under the same distribution, so fits can use quasi-Newton or
+    trust-region optimizers instead of Nelder-Mead.
+
+    The engine runs in the precision of its arrays (float64 by default, or float32 to halve memory traffic). The
+    row-wise logsumexp subtracts each row's maximum before exponentiating, and totals are accumulated in float64,
+    so float32 negative log-likelihoods stay within ~1e-6 relative error of the float64 path.
+
+    Optionally, items are sampled without replacement: items the participant already produced are removed from the
+    denominator of all later positions. Rather than re-summing the vocabulary, their utilities are masked out of
+    the stacked arrays, which costs O(L) per position.
+
+    Classes
+        (1) CueStack: log-domain stack of the cue lists/histories of a single fluency list
+        (2) PopulationStack: padded, masked batch of the CueStacks of all subjects, for joint population-level fits
+        (3) RowDenominatorCache: LRU memo of the denominators of vocabulary rows, shared across subjects
+'''
+
+# order of the cues along the first axis of a CueStack
+FREQUENCY, SEMANTIC, PHONOLOGICAL = 0, 1, 2
+
+model_names = ['static', 'dynamic', 'pstatic', 'pdynamic']
+phoncues = ['global', 'local', 'switch']
+hessian_methods = ['Newton-CG', 'dogleg', 'trust-ncg', 'trust-krylov', 'trust-exact', 'trust-constr']
+
+
+def model_terms(L, n_cues, model, switchvals = None, phoncue = None):
+    '''
+        Description:
+            Returns which cues enter the likelihood of each item in the list for a given model.
+            The first item is always scored on frequency alone.
+        Args:
+            L (int): length of the fluency list
+            n_cues (int): number of cues (2 without, 3 with the phonological cue)
+            model (str): one of 'static', 'dynamic', 'pstatic', 'pdynamic'
+            switchvals (list, size: L): switch values of each item, required for dynamic models
+            phoncue (str): "global", "local", or "switch", required for the 'pdynamic' model
+        Returns:
+            active (np.array, L x C, bool): active[k, c] is True if cue c is used for item k
+        Raises:
+            Exception: if model or phoncue are invalid, or the phonological cue is missing
+    '''
+    if model not in model_names:
+        raise Exception("Model must be one of the following: {models}".format(models = model_names))
+    if model in ['pstatic', 'pdynamic'] and n_cues <= PHONOLOGICAL:
+        raise Exception("Phonological models require phonological cue lists and histories")
+    if model == 'pdynamic' and phoncue not in phoncues:
+        raise Exception("To use dynamic phonological cue, you must pass a valid parameter value from possible list of values: ['global','local','switch']")
+
+    active = np.zeros((L, n_cues), dtype = bool)
+    active[:, FREQUENCY] = True
+    active[1:, SEMANTIC] = True
+    if model == 'pstatic':
+        active[1:, PHONOLOGICAL] = True
+
+    if model in ['dynamic', 'pdynamic']:
+        switch = np.asarray(switchvals) == 1
+        switch[0] = False
+        cluster = ~switch
+        cluster[0] = False
+        # a switch is scored without the semantic cue
+        active[switch, SEMANTIC] = False
+        if model == 'pdynamic':
+            if phoncue in ['global', 'switch']:
+                active[switch, PHONOLOGICAL] = True
+            if phoncue in ['global', 'local']:
+                active[cluster, PHONOLOGICAL] = True
+
+    return active
+
+
+def excluded_items(produced):
+    '''
+        Description:
+            Items to remove from the denominator of each position when sampling without replacement: every
+            item produced earlier in the list, except the current item itself, so that repeated items are
+            still scored. This is O(L^2) in the length of the list, independently of the vocabulary size.
+        Args:
+            produced (list, size: L): vocabulary index of each item in the fluency list
+        Returns:
+            excluded (tuple of np.array): (position, vocabulary index) pairs, usable as a fancy index into
+                an L x N array
+    '''
+    produced = np.asarray(produced)
+    k, j = np.tril_indices(len(produced), -1)
+    keep = produced[j] != produced[k]
+    return k[keep], produced[j[keep]]
+
+
+class CueStack:
+    '''
+        Description:
+            Stacks the cue lists and cue histories of one fluency list into log-domain arrays, so that the
+            foraging models can be evaluated without a Python loop over list positions.
+
+        Args:
+            freql (list, size: L): frequency list obtained via create_history_variables
+            freqh (list, size: L arrays of size N): frequency history list obtained via create_history_variables
+            siml (list, size: L): semantic similarity list obtained via create_history_variables
+            simh (list, size: L arrays of size N): similarity history list obtained via create_history_variables
+            phonl (list, size: L, optional): phonological similarity list obtained via create_history_variables
+            phonh (list, size: L arrays of size N, optional): phonological history list obtained via create_history_variables
+            produced (list, size: L, optional): vocabulary index of each item in the fluency list
+            replacement (bool): if False, items produced earlier in the list are removed from the denominator
+                ("without replacement"), which requires produced
+            dtype (np.dtype): precision of the stacked arrays and likelihood kernels, np.float64 or np.float32
+            overridden (list, optional): positions whose history rows are not rows of the lexical matrices, such
+                as the phonological rows of corrected items; a RowDenominatorCache does not serve these positions
+
+        Attributes:
+            log_l (np.array, C x L): log cue values of the produced items
+            log_h (np.array, C x L x N): log cue values of every vocabulary item at each position
+            overridden (np.array, L, bool): positions whose history rows are not rows of the lexical matrices
+    '''
+
+    def __init__(self, freql, freqh, siml, simh, phonl = None, phonh = None, produced = None, replacement = True, dtype = np.float64, overridden = None):
+        lists = [freql, siml]
+        histories = [freqh, simh]
+        if phonl is not None and phonh is not None:
+            lists.append(phonl)
+            histories.append(phonh)
+
+        self.dtype = np.dtype(dtype)
+        with np.errstate(divide = 'ignore'):
+            self.log_l = np.log(np.array(lists, dtype = self.dtype))
+            # compact histories (HistoryRows) are gathered in one fancy-index per cue
+            self.log_h = np.log(np.stack([np.asarray(history, dtype = self.dtype) for history in histories]))
+
+        self.n_cues, self.L, self.N = self.log_h.shape
+        # cues containing zeros have -inf log values, which must not be multiplied by a zero beta
+        self._has_zero = [bool(np.isneginf(self.log_h[c]).any() or np.isneginf(self.log_l[c]).any()) for c in range(self.n_cues)]
+
+        self.overridden = np.zeros(self.L, dtype = bool)
+        if overridden is not None:
+            self.overridden[np.asarray(list(overridden), dtype = np.intp)] = True
+
+        self.replacement = replacement
+        self.produced = None if produced is None else np.asarray(produced)
+        self._excluded = None
+        if not replacement:
+            if produced is None:
+                raise Exception("Sampling without replacement requires the vocabulary index of each produced item")
+            self._excluded = excluded_items(produced)
+
+    @classmethod
+    def from_history(cls, history, replacement = True, dtype = np.float64):
+        '''
+            Description:
+                Stacks the CueHistory of a fluency list, using its vocabulary ids as the produced items and
+                marking the positions with override rows (e.g. corrected items) as overridden
+            Args:
+                history (CueHistory): cue lists and histories obtained via create_history_variables
+                replacement (bool): if False, items produced earlier in the list are removed from the denominator
+                dtype (np.dtype): precision of the stacked arrays and likelihood kernels
+            Returns:
+                stack (CueStack)
+        '''
+        histories = [history.freq_history, history.sim_history, history.phon_history]
+        overridden = set(k for rows in histories for k in getattr(rows, 'overrides', {}))
+        return cls(history.freq_list, history.freq_history, history.sim_list, history.sim_history, history.phon_list, history.phon_history, history.ids, replacement, dtype, overridden)
+
+    def terms(self, model, switchvals = None, phoncue = None):
+        '''
+            Description:
+                Returns which cues enter the likelihood of each item in the list for a given model, see model_terms
+            Args:
+                model (str): one of 'static', 'dynamic', 'pstatic', 'pdynamic'
+                switchvals (list, size: L): switch values of each item, required for dynamic models
+                phoncue (str): "global", "local", or "switch", required for the 'pdynamic' model
+            Returns:
+                active (np.array, L x C, bool): active[k, c] is True if cue c is used for item k
+        '''
+        return model_terms(self.L, self.n_cues, model, switchvals, phoncue)
+
+    def utilities(self, beta, active):
+        '''
+            Description:
+                Computes log-utilities beta * log-cue of all vocabulary items and of the produced items
+            Args:
+                beta (tuple, size: 2 or 3): saliency parameter(s) (beta_frequency, beta_semantic[, beta_phon])
+                active (np.array, L x C, bool): active cues obtained via terms
+            Returns:
+                U (np.array, L x N): log-utility of every vocabulary item at each position
+                u (np.array, L): log-utility of the produced item at each position
+        '''
+        U = np.zeros((self.L, self.N), dtype = self.dtype)
+        u = np.zeros(self.L, dtype = self.dtype)
+        for c in range(min(len(beta), self.n_cues)):
+            w = (beta[c] * active[:, c]).astype(self.dtype)
+            if not w.any():
+                continue
+            if self._has_zero[c]:
+                # pow(0, 0) == 1, so a zero weight contributes nothing even where the cue is zero
+                with np.errstate(invalid = 'ignore'):
+                    U += np.where(w[:, None] != 0, w[:, None] * self.log_h[c], 0)
+                    u += np.where(w != 0, w * self.log_l[c], 0)
+            else:
+                U += w[:, None] * self.log_h[c]
+                u += w * self.log_l[c]
+        if self._excluded is not None:
+            U[self._excluded] = -np.inf
+        return U, u
+
+    def nll_vec(self, beta, active):
+        '''
+            Description:
+                Negative log-likelihood of each item in the list
+            Args:
+                beta (tuple, size: 2 or 3): saliency parameter(s) (beta_frequency, beta_semantic[, beta_phon])
+                active (np.array, L x C, bool): active cues obtained via terms
+            Returns:
+                nll_vec (np.array, L): negative log-likelihood of each item
+        '''
+        U, u = self.utilities(beta, active)
+        return logsumexp(U, axis = 1).astype(np.float64) - u
+
+    def nll(self, beta, active):
+        '''
+            Description:
+                Negative log-likelihood of the whole list, to be minimized in parameter fit
+            Args:
+                beta (tuple, size: 2 or 3): saliency parameter(s) (beta_frequency, beta_semantic[, beta_phon])
+                active (np.array, L x C, bool): active cues obtained via terms
+            Returns:
+                ct (np.float): negative log-likelihood
+        '''
+        return self.nll_vec(beta, active).sum()
+
+    def switch_terms(self, beta, model = 'dynamic', phoncue = None):
+        '''
+            Description:
+                For a dynamic model, the likelihood of each item only depends on the switch vector through whether
+                that item is a switch. Returns the negative log-likelihood of every item both ways, which do not
+                depend on the switch vector and can be shared by any number of switch vectors.
+            Args:
+                beta (tuple, size: 2 or 3): saliency parameter(s) (beta_frequency, beta_semantic[, beta_phon])
+                model (str): 'dynamic' or 'pdynamic'
+                phoncue (str): "global", "local", or "switch", required for the 'pdynamic' model
+            Returns:
+                switch_nll (np.array, L): negative log-likelihood of each item if it is a switch
+                cluster_nll (np.array, L): negative log-likelihood of each item if it is not a switch
+        '''
+        if model not in ['dynamic', 'pdynamic']:
+            raise Exception("Switch terms are only defined for the 'dynamic' and 'pdynamic' models")
+        switch_nll = self.nll_vec(beta, self.terms(model, np.ones(self.L), phoncue))
+        cluster_nll = self.nll_vec(beta, self.terms(model, np.zeros(self.L), phoncue))
+        return switch_nll, cluster_nll
+
+    def nll_switches(self, beta, switchvals, model = 'dynamic', phoncue = None):
+        '''
+            Description:
+                Negative log-likelihood of a dynamic model under each of a stack of switch vectors, at the cost of
+                evaluating a single one: the switch-invariant terms (see switch_terms) are computed once and
+                combined through one masked matrix-vector product.
+            Args:
+                beta (tuple, size: 2 or 3): saliency parameter(s) (beta_frequency, beta_semantic[, beta_phon])
+                switchvals (list, size: V lists of size L): switch vectors, e.g. obtained via calculate_switch
+                model (str): 'dynamic' or 'pdynamic'
+                phoncue (str): "global", "local", or "switch", required for the 'pdynamic' model
+            Returns:
+                nll (np.array, V): negative log-likelihood under each switch vector
+        '''
+        switch_nll, cluster_nll = self.switch_terms(beta, model, phoncue)
+        switches = np.asarray(switchvals).reshape(-1, self.L) == 1
+        # the first item is always scored on frequency alone
+        switches[:, 0] = False
+        return cluster_nll.sum() + switches @ (switch_nll - cluster_nll)
+
+    def report(self, beta, active):
+        '''
+            Description:
+                Item-level diagnostics of the list in a single vectorized pass: the total and per-item negative
+                log-likelihood, the probability of each produced item and its rank in the model's predictive
+                distribution. The rank counts the vocabulary items with a strictly higher utility, so it needs
+                no sorting of the vocabulary.
+            Args:
+                beta (tuple, size: 2 or 3): saliency parameter(s) (beta_frequency, beta_semantic[, beta_phon])
+                active (np.array, L x C, bool): active cues obtained via terms
+            Returns:
+                ct (np.float): negative log-likelihood of the whole list
+                nll_vec (np.array, L): negative log-likelihood of each item
+                prob (np.array, L): probability of each produced item
+                rank (np.array, L, int): rank of each produced item (1 = most likely item in the vocabulary)
+        '''
+        U, u = self.utilities(beta, active)
+        nll_vec = logsumexp(U, axis = 1).astype(np.float64) - u
+        rank = np.count_nonzero(U > u[:, None], axis = 1) + 1
+        return nll_vec.sum(), nll_vec, np.exp(-nll_vec), rank
+
+    def _predictive(self, beta, active):
+        # predictive distribution over the vocabulary at each position, along with the item-level NLL
+        U, u = self.utilities(beta, active)
+        lse = logsumexp(U, axis = 1)
+        P = np.exp(U - lse[:, None])
+        return P, lse.astype(np.float64) - u
+
+    def _centered(self, P, c):
+        # log-cue c centered on its expectation under P; zero cues have zero probability and are dropped
+        if self._has_zero[c]:
+            with np.errstate(invalid = 'ignore'):
+                expected = np.where(P > 0, P * self.log_h[c], 0).sum(axis = 1)
+                return expected, np.where(P > 0, self.log_h[c] - expected[:, None], 0)
+        expected = np.einsum('ln,ln->l', P, self.log_h[c])
+        return expected, self.log_h[c] - expected[:, None]
+
+    def nll_and_grad(self, beta, active):
+        '''
+            Description:
+                Negative log-likelihood of the whole list and its analytic gradient with respect to beta.
+                For each cue, the gradient sums (expected log-cue - produced item's log-cue) over the
+                positions in which the cue is active.
+            Args:
+                beta (tuple, size: 2 or 3): saliency parameter(s) (beta_frequency, beta_semantic[, beta_phon])
+                active (np.array, L x C, bool): active cues obtained via terms
+            Returns:
+                ct (np.float): negative log-likelihood
+                grad (np.array, size: len(beta)): gradient of ct with respect to beta
+        '''
+        P, nll_vec = self._predictive(beta, active)
+        grad = np.zeros(len(beta))
+        for c in range(min(len(beta), self.n_cues)):
+            if not active[:, c].any():
+                continue
+            expected, _ = self._centered(P, c)
+            grad[c] = (expected - self.log_l[c])[active[:, c]].sum(dtype = np.float64)
+        return nll_vec.sum(), grad
+
+    def hessian(self, beta, active):
+        '''
+            Description:
+                Analytic Hessian of the negative log-likelihood with respect to beta, i.e. the covariance
+                of the active log-cues under the predictive distribution summed over positions
+            Args:
+                beta (tuple, size: 2 or 3): saliency parameter(s) (beta_frequency, beta_semantic[, beta_phon])
+                active (np.array, L x C, bool): active cues obtained via terms
+            Returns:
+                H (np.array, len(beta) x len(beta)): Hessian of the negative log-likelihood
+        '''
+        P, _ = self._predictive(beta, active)
+        n = min(len(beta), self.n_cues)
+        centered = [self._centered(P, c)[1] * active[:, c, None] for c in range(n)]
+        H = np.zeros((len(beta), len(beta)))
+        for c in range(n):
+            for d in range(c, n):
+                H[c, d] = H[d, c] = np.einsum('ln,ln,ln->l', P, centered[c], centered[d]).sum(dtype = np.float64)
+        return H
+
+    def nll_grid(self, betas, active, max_bytes = 2**24):
+        '''
+            Description:
+                Negative log-likelihood of the list at every row of a grid of betas, evaluated as one broadcasted
+                (G x L x N) pass. The grid is split into chunks so that the intermediate arrays stay within
+                max_bytes.
+            Args:
+                betas (np.array, G x 2 or G x 3): one set of saliency parameter(s) per row
+                active (np.array, L x C, bool): active cues obtained via terms
+                max_bytes (int): memory budget of the intermediate (L x chunk x N) utilities
+            Returns:
+                nll (np.array, G): negative log-likelihood at each row of betas
+        '''
+        betas = np.atleast_2d(np.asarray(betas, dtype = np.float64))
+        n = min(betas.shape[1], self.n_cues)
+        # every position weights the cues by its own active betas: (G x C) @ (C x N) per position
+        H = self.log_h[:n].transpose(1, 0, 2)
+        h = self.log_l[:n].T
+        zero = [c for c in range(n) if self._has_zero[c]]
+        chunk = max(1, int(max_bytes // (self.L * self.N * self.dtype.itemsize)))
+        nll = np.empty(len(betas))
+        for start in range(0, len(betas), chunk):
+            B = betas[start:start + chunk, :n]
+            W = (B[None, :, :] * active[:, None, :n]).astype(self.dtype)
+            if zero:
+                # pow(0, 0) == 1: zero cues are only included where their weight is nonzero
+                with np.errstate(invalid = 'ignore'):
+                    U = np.zeros((self.L, len(B), self.N), dtype = self.dtype)
+                    u = np.zeros((self.L, len(B)), dtype = self.dtype)
+                    for c in range(n):
+                        U += np.where(W[:, :, c, None] != 0, W[:, :, c, None] * H[:, None, c], 0)
+                        u += np.where(W[:, :, c] != 0, W[:, :, c] * h[:, None, c], 0)
+            else:
+                U = np.matmul(W, H)
+                u = np.einsum('lgc,lc->lg', W, h)
+            if self._excluded is not None:
+                U[self._excluded[0], :, self._excluded[1]] = -np.inf
+            # row-wise logsumexp, in place to stay within the memory budget
+            m = U.max(axis = 2)
+            U -= m[:, :, None]
+            np.exp(U, out = U)
+            nll[start:start + chunk] = (m + np.log(U.sum(axis = 2)) - u).sum(axis = 0, dtype = np.float64)
+        return nll
+
+    def nll_surface(self, axes, active, max_bytes = 2**24):
+        '''
+            Description:
+                Negative log-likelihood surface over the Cartesian grid spanned by one axis of values per beta,
+                e.g. for profile plots, identifiability checks or picking a starting point for fit.
+            Args:
+                axes (list, size: 2 or 3): grid values of (beta_frequency, beta_semantic[, beta_phon])
+                active (np.array, L x C, bool): active cues obtained via terms
+                max_bytes (int): memory budget of the intermediate arrays, see nll_grid
+            Returns:
+                surface (np.array, len(axes[0]) x len(axes[1]) [x len(axes[2])]): negative log-likelihood
+                    at each grid point
+        '''
+        mesh = np.meshgrid(*axes, indexing = 'ij')
+        betas = np.stack([m.ravel() for m in mesh], axis = 1)
+        return self.nll_grid(betas, active, max_bytes).reshape(mesh[0].shape)
+
+    def grid_start(self, axes, active, max_bytes = 2**24):
+        '''
+            Description:
+                Returns the grid point of nll_surface with the lowest negative log-likelihood, to warm-start fit
+            Args:
+                axes (list, size: 2 or 3): grid values of (beta_frequency, beta_semantic[, beta_phon])
+                active (np.array, L x C, bool): active cues obtained via terms
+                max_bytes (int): memory budget of the intermediate arrays, see nll_grid
+            Returns:
+                beta0 (np.array, size: len(axes)): best saliency parameter(s) on the grid
+        '''
+        surface = self.nll_surface(axes, active, max_bytes)
+        best = np.unravel_index(np.nanargmin(surface), surface.shape)
+        return np.array([axis[i] for axis, i in zip(axes, best)], dtype = np.float64)
+
+    def fit(self, beta0, active, method = 'L-BFGS-B', **kwargs):
+        '''
+            Description:
+                Fits beta by minimizing the negative log-likelihood with scipy.optimize.minimize, using the
+                analytic gradient (and the analytic Hessian for Newton/trust-region methods)
+            Args:
+                beta0 (tuple, size: 2 or 3): starting values of the saliency parameter(s)
+                active (np.array, L x C, bool): active cues obtained via terms
+                method (str): any gradient-based method accepted by scipy.optimize.minimize
+                kwargs: additional keyword arguments passed on to scipy.optimize.minimize
+            Returns:
+                res (scipy.optimize.OptimizeResult): optimization result, with the fitted beta in res.x
+        '''
+        hess = self.hessian if method in hessian_methods else None
+        return minimize(self.nll_and_grad, np.asarray(beta0, dtype = np.float64), args = (active,), jac = True, hess = hess, method = method, **kwargs)
+
+
+class PopulationStack:
+    '''
+        Description:
+            Pads the CueStacks of all subjects into one masked batch, so that group-level betas can be fit by
+            minimizing the summed negative log-likelihood of every list, evaluated in a single batched pass.
+            Optionally, the fit is hierarchical: each subject gets its own deviation from the group betas,
+            with a Gaussian prior (standard deviation sigma) shrinking the deviations towards zero.
+
+        Args:
+            stacks (list, size: S): CueStack of each subject, all with the same cues and vocabulary
+
+        Attributes:
+            log_l (np.array, C x S x Lmax): log cue values of the produced items, padded with zeros
+            log_h (np.array, C x S x Lmax x N): log cue values of every vocabulary item, padded with zeros
+            mask (np.array, S x Lmax, bool): True for positions that hold an item of the fluency list
+            overridden (np.array, S x Lmax, bool): positions whose history rows are not rows of the lexical matrices
+    '''
+
+    def __init__(self, stacks):
+        if len(set((stack.n_cues, stack.N) for stack in stacks)) != 1:
+            raise Exception("All CueStacks must have the same cues and vocabulary size")
+
+        self.n_cues, self.N = stacks[0].n_cues, stacks[0].N
+        self.dtype = stacks[0].dtype
+        self.S = len(stacks)
+        self.lengths = np.array([stack.L for stack in stacks])
+        self.Lmax = self.lengths.max()
+        self.mask = np.arange(self.Lmax)[None, :] < self.lengths[:, None]
+        self.overridden = np.zeros((self.S, self.Lmax), dtype = bool)
+
+        self.log_l = np.zeros((self.n_cues, self.S, self.Lmax), dtype = self.dtype)
+        self.log_h = np.zeros((self.n_cues, self.S, self.Lmax, self.N), dtype = self.dtype)
+        for s, stack in enumerate(stacks):
+            self.log_l[:, s, :stack.L] = stack.log_l
+            self.log_h[:, s, :stack.L] = stack.log_h
+            self.overridden[s, :stack.L] = stack.overridden
+        self._has_zero = [any(stack._has_zero[c] for stack in stacks) for c in range(self.n_cues)]
+
+        # vocabulary index of the previous item at each position, -1 for first items and padding
+        self.prev_ids = None
+        if all(stack.produced is not None for stack in stacks):
+            self.prev_ids = np.full((self.S, self.Lmax), -1)
+            for s, stack in enumerate(stacks):
+                self.prev_ids[s, 1:stack.L] = stack.produced[:-1]
+
+        # (subject, position, item) of the items removed from the denominator of lists without replacement
+        excluded = [(np.full(len(stack._excluded[0]), s), ) + stack._excluded for s, stack in enumerate(stacks) if stack._excluded is not None]
+        self._excluded = tuple(np.concatenate(idx) for idx in zip(*excluded)) if excluded else None
+
+    def terms(self, model, switchvals = None, phoncue = None):
+        '''
+            Description:
+                Returns the active cues of every item of every subject for a given model, see model_terms
+            Args:
+                model (str): one of 'static', 'dynamic', 'pstatic', 'pdynamic'
+                switchvals (list, size: S): switch vector of each subject, required for dynamic models
+                phoncue (str): "global", "local", or "switch", required for the 'pdynamic' model
+            Returns:
+                active (np.array, S x Lmax x C, bool): active cues, False at padded positions
+        '''
+        active = np.zeros((self.S, self.Lmax, self.n_cues), dtype = bool)
+        for s, L in enumerate(self.lengths):
+            vec = switchvals[s] if switchvals is not None else None
+            active[s, :L] = model_terms(L, self.n_cues, model, vec, phoncue)
+        return active
+
+    def _predictive(self, betas, active):
+        # betas holds one row of saliency parameters per subject (S x len(beta))
+        U = np.zeros((self.S, self.Lmax, self.N), dtype = self.dtype)
+        u = np.zeros((self.S, self.Lmax), dtype = self.dtype)
+        for c in range(min(betas.shape[1], self.n_cues)):
+            w = (betas[:, c, None] * active[:, :, c]).astype(self.dtype)
+            if not w.any():
+                continue
+            if self._has_zero[c]:
+                with np.errstate(invalid = 'ignore'):
+                    U += np.where(w[:, :, None] != 0, w[:, :, None] * self.log_h[c], 0)
+                    u += np.where(w != 0, w * self.log_l[c], 0)
+            else:
+                U += w[:, :, None] * self.log_h[c]
+                u += w * self.log_l[c]
+        if self._excluded is not None:
+            U[self._excluded] = -np.inf
+        lse = logsumexp(U, axis = 2)
+        P = np.exp(U - lse[:, :, None])
+        return P, np.where(self.mask, lse.astype(np.float64) - u, 0)
+
+    def subject_nll_and_grad(self, betas, active):
+        '''
+            Description:
+                Negative log-likelihood of each subject's list and its gradient, evaluated in one batched pass
+            Args:
+                betas (np.array, S x 2 or S x 3): saliency parameter(s) of each subject
+                active (np.array, S x Lmax x C, bool): active cues obtained via terms
+            Returns:
+                nll (np.array, S): negative log-likelihood of each subject
+                grad (np.array, S x len(beta)): gradient of each subject's negative log-likelihood
+        '''
+        betas = np.atleast_2d(betas)
+        P, nll_vec = self._predictive(betas, active)
+        grad = np.zeros(betas.shape)
+        for c in range(min(betas.shape[1], self.n_cues)):
+            if not active[:, :, c].any():
+                continue
+            if self._has_zero[c]:
+                with np.errstate(invalid = 'ignore'):
+                    expected = np.where(P > 0, P * self.log_h[c], 0).sum(axis = 2)
+            else:
+                expected = np.einsum('sln,sln->sl', P, self.log_h[c])
+            with np.errstate(invalid = 'ignore'):
+                grad[:, c] = np.where(active[:, :, c], expected - self.log_l[c], 0).sum(axis = 1, dtype = np.float64)
+        return nll_vec.sum(axis = 1), grad
+
+    def nll_and_grad(self, beta, active, cache = None):
+        '''
+            Description:
+                Summed negative log-likelihood of all subjects under shared group betas, and its gradient.
+                With a RowDenominatorCache, the denominator of each unique (previous item, active cues) row is
+                computed once and shared by every subject and position in which it occurs. Positions with
+                overridden history rows (e.g. the phonological rows of corrected items) are not rows of the
+                lexical matrices, so their denominators are computed from the stacked histories instead.
+            Args:
+                beta (tuple, size: 2 or 3): group-level saliency parameter(s)
+                active (np.array, S x Lmax x C, bool): active cues obtained via terms
+                cache (RowDenominatorCache, optional): shared row-denominator cache, which requires CueStacks
+                    built with the produced items and with replacement
+            Returns:
+                ct (np.float): summed negative log-likelihood
+                grad (np.array, size: len(beta)): gradient of ct with respect to beta
+        '''
+        if cache is not None:
+            if self.prev_ids is None or self._excluded is not None:
+                raise Exception("A row-denominator cache requires CueStacks built with the produced items and with replacement")
+            n = min(len(beta), self.n_cues)
+            overridden = self.overridden[self.mask]
+            lse = np.empty(len(overridden))
+            expected = np.empty((len(overridden), n))
+            lse[~overridden], expected[~overridden] = cache.lookup(beta, self.prev_ids[self.mask][~overridden], active[self.mask][~overridden])
+            if overridden.any():
+                s, l = np.nonzero(self.mask & self.overridden)
+                lse[overridden], expected[overridden] = self._row_denominators(beta[:n], s, l, active[s, l, :n])
+            w = (np.asarray(beta[:n], dtype = np.float64) * active[self.mask][:, :n]).astype(self.dtype)
+            log_l = self.log_l[:n, self.mask].T
+            with np.errstate(invalid = 'ignore'):
+                u = np.where(w != 0, w * log_l, 0).sum(axis = 1)
+                grad = np.where(active[self.mask][:, :n], expected - log_l, 0).sum(axis = 0, dtype = np.float64)
+            return (lse - u).sum(dtype = np.float64), np.concatenate([grad, np.zeros(len(beta) - n)])
+        betas = np.tile(np.asarray(beta, dtype = np.float64), (self.S, 1))
+        nll, grad = self.subject_nll_and_grad(betas, active)
+        return nll.sum(), grad.sum(axis = 0)
+
+    def _row_denominators(self, beta, s, l, active):
+        # log-denominators and expected log-cues of the positions (s, l), from their stacked history rows
+        logs = self.log_h[:len(beta), s, l]
+        U = np.zeros(logs.shape[1:], dtype = self.dtype)
+        for c, b in enumerate(beta):
+            w = (b * active[:, c]).astype(self.dtype)
+            with np.errstate(invalid = 'ignore'):
+                U += np.where(w[:, None] != 0, w[:, None] * logs[c], 0)
+        lse = logsumexp(U, axis = 1)
+        P = np.exp(U - lse[:, None])
+        with np.errstate(invalid = 'ignore'):
+            expected = np.stack([np.where(P > 0, P * logs[c], 0).sum(axis = 1) for c in range(len(beta))], axis = 1)
+        return lse, expected
+
+    def _hierarchical_nll_and_grad(self, params, active, n_betas, sigma):
+        # params holds the group betas followed by the flattened per-subject deviations
+        beta = params[:n_betas]
+        deviations = params[n_betas:].reshape(self.S, n_betas)
+        nll, grad = self.subject_nll_and_grad(beta + deviations, active)
+        penalty = (deviations ** 2).sum() / (2 * sigma ** 2)
+        grad_deviations = grad + deviations / sigma ** 2
+        return nll.sum() + penalty, np.concatenate([grad.sum(axis = 0), grad_deviations.ravel()])
+
+    def nll_grid(self, betas, active, cache = None):
+        '''
+            Description:
+                Summed negative log-likelihood of all subjects at every row of a grid of group betas. With a
+                RowDenominatorCache, the work per grid point scales with the number of unique transitions.
+            Args:
+                betas (np.array, G x 2 or G x 3): one set of group-level saliency parameter(s) per row
+                active (np.array, S x Lmax x C, bool): active cues obtained via terms
+                cache (RowDenominatorCache, optional): shared row-denominator cache, see nll_and_grad
+            Returns:
+                nll (np.array, G): summed negative log-likelihood at each row of betas
+        '''
+        return np.array([self.nll_and_grad(beta, active, cache)[0] for beta in np.atleast_2d(betas)])
+
+    def fit(self, beta0, active, hierarchical = False, sigma = 1.0, method = 'L-BFGS-B', cache = None, **kwargs):
+        '''
+            Description:
+                Fits group-level betas to all subjects at once. With hierarchical = True, per-subject
+                deviations from the group betas are fit jointly, penalized by a Gaussian prior N(0, sigma^2).
+            Args:
+                beta0 (tuple, size: 2 or 3): starting values of the group-level saliency parameter(s)
+                active (np.array, S x Lmax x C, bool): active cues obtained via terms
+                hierarchical (bool): whether to fit per-subject deviations from the group betas
+                sigma (float): standard deviation of the prior on the per-subject deviations
+                method (str): any gradient-based method accepted by scipy.optimize.minimize
+                cache (RowDenominatorCache, optional): shared row-denominator cache for group-level fits,
+                    see nll_and_grad
+                kwargs: additional keyword arguments passed on to scipy.optimize.minimize
+            Returns:
+                res (scipy.optimize.OptimizeResult): optimization result, with the group betas in res.beta
+                    and the betas of each subject (S x len(beta)) in res.subject_betas
+        '''
+        beta0 = np.asarray(beta0, dtype = np.float64)
+        n_betas = len(beta0)
+        if hierarchical:
+            x0 = np.concatenate([beta0, np.zeros(self.S * n_betas)])
+            res = minimize(self._hierarchical_nll_and_grad, x0, args = (active, n_betas, sigma), jac = True, method = method, **kwargs)
+            res.beta = res.x[:n_betas]
+            res.subject_betas = res.beta + res.x[n_betas:].reshape(self.S, n_betas)
+        else:
+            res = minimize(self.nll_and_grad, beta0, args = (active, cache), jac = True, method = method, **kwargs)
+            res.beta = res.x
+            res.subject_betas = np.tile(res.x, (self.S, 1))
+        return res
+
+
+class RowDenominatorCache:
+    '''
+        Description:
+            Memoizes the log-denominator of the foraging models for each vocabulary row, i.e.
+            log sum_j freq_j^b0 * sim[prev, j]^b1 [* phon[prev, j]^b2], along with the expected log-cues
+            under the same distribution (for gradients). Entries are keyed by (previous item, active cues, beta),
+            so rows of common previous items ("dog", "cat") are computed once per beta and reused across every
+            subject and position. Rows in which only frequency is active do not depend on the previous item and
+            share a single entry. The cache holds at most maxsize entries, evicting the least recently used.
+
+            Rows are taken from the lexical matrices, so cached denominators match CueStacks whose histories are
+            rows of the same matrices, sampled with replacement. Positions whose history rows are overrides (see
+            CueStack.overridden, e.g. the phonological rows of corrected items) are never looked up in the cache.
+
+        Args:
+            freq_matrix (np.array, N): frequencies of all words in the vocabulary
+            sim_matrix (np.array, N x N): semantic similarity matrix
+            phon_matrix (np.array, N x N, optional): phonological similarity matrix
+            maxsize (int): maximum number of cached rows
+
+        Attributes:
+            hits (int): number of row lookups served from the cache
+            misses (int): number of rows computed
+    '''
+
+    def __init__(self, freq_matrix, sim_matrix, phon_matrix = None, maxsize = 65536):
+        self.matrices = [np.asarray(freq_matrix), sim_matrix] + ([phon_matrix] if phon_matrix is not None else [])
+        self.n_cues = len(self.matrices)
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._rows = OrderedDict()
+
+    def _compute(self, beta, prev, patterns):
+        # log-utilities of the requested rows, one (previous item, active cue pattern) per row
+        with np.errstate(divide = 'ignore'):
+            logs = [np.log(self.matrices[FREQUENCY])[None, :]] + [np.log(self.matrices[c][np.maximum(prev, 0)]) for c in range(1, len(beta))]
+        U = np.zeros((len(prev), len(logs[0][0])), dtype = logs[0].dtype)
+        for c, b in enumerate(beta):
+            w = (b * ((patterns >> c) & 1)).astype(U.dtype)
+            with np.errstate(invalid = 'ignore'):
+                U += np.where(w[:, None] != 0, w[:, None] * logs[c], 0)
+        lse = logsumexp(U, axis = 1)
+        P = np.exp(U - lse[:, None])
+        with np.errstate(invalid = 'ignore'):
+            expected = np.stack([np.where(P > 0, P * logs[c], 0).sum(axis = 1) for c in range(len(beta))], axis = 1)
+        return lse, expected
+
+    def lookup(self, beta, prev_ids, active):
+        '''
+            Description:
+                Log-denominators and expected log-cues of a batch of transitions, computing only the rows that
+                are not cached yet
+            Args:
+                beta (tuple, size: 2 or 3): saliency parameter(s) (beta_frequency, beta_semantic[, beta_phon])
+                prev_ids (np.array, M): vocabulary index of the previous item of each transition
+                active (np.array, M x C, bool): active cues of each transition
+            Returns:
+                lse (np.array, M): log-denominator of each transition
+                expected (np.array, M x len(beta)): expected log-cues of each transition
+        '''
+        n = min(len(beta), self.n_cues)
+        beta = tuple(float(b) for b in beta[:n])
+        patterns = (np.asarray(active)[:, :n] << np.arange(n)).sum(axis = 1)
+        # rows with frequency alone do not depend on the previous item
+        prev = np.where(patterns > 1, prev_ids, -1)
+        keys, inverse = np.unique(np.stack([prev, patterns], axis = 1), axis = 0, return_inverse = True)
+        inverse = inverse.ravel()
+
+        lse = np.empty(len(keys))
+        expected = np.empty((len(keys), n))
+        missing = []
+        for i, (p, pattern) in enumerate(keys):
+            key = (int(p), int(pattern), beta)
+            if key in self._rows:
+                self._rows.move_to_end(key)
+                lse[i], expected[i] = self._rows[key]
+            else:
+                missing.append(i)
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            missing = np.array(missing)
+            lse[missing], expected[missing] = self._compute(beta, keys[missing, 0], keys[missing, 1])
+            for i in missing:
+                self._rows[(int(keys[i, 0]), int(keys[i, 1]), beta)] = (lse[i], expected[i].copy())
+            while len(self._rows) > self.maxsize:
+                self._rows.popitem(last = False)
+
+        return lse[inverse], expected[inverse]
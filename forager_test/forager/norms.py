@@ -0,0 +1,93 @@
+import difflib
+import numpy as np
+
+'''
+
+Category index of a norms file, built once and shared by every fluency list. Each norms item is mapped to a
+    bitmask of its categories, and each produced word to its closest norms item once (memoized), so that the
+    associative norms switches of a whole list are one bitwise AND over consecutive items instead of difflib
+    searches and DataFrame scans per transition.
+
+    Classes
+        (1) NormsIndex: item -> category bitmask index of a norms DataFrame, with memoized resolution of words
+'''
+
+
+class NormsIndex:
+    '''
+        Description:
+            Indexes a norms DataFrame (Item, Category pairs). Categories are numbered 0..C-1, and the categories of
+            each item are stored as a bitmask of C bits, packed into ceil(C/64) uint64 words. Words are resolved to
+            their closest norms item as in switch_norms: the best match of difflib.get_close_matches, or no item if
+            there is none, in which case the word has no category.
+        Args:
+            (1) norms (DataFrame): norms data matching items to a categorical classification, with columns Item and Category
+        Attributes:
+            items (list, size I): distinct norms items
+            categories (list, size C): distinct categories
+            masks (np.array of uint64, size (I+1) x ceil(C/64)): category bitmask of each item; the last row is
+                the empty mask of words that are not in the norms
+    '''
+    def __init__(self, norms):
+        item_list = norms['Item'].values.tolist()
+        category_list = norms['Category'].values.tolist()
+        self.items = list(dict.fromkeys(item_list))
+        self.categories = list(dict.fromkeys(category_list))
+        self.ids = {item: i for i, item in enumerate(self.items)}
+        category_ids = {category: c for c, category in enumerate(self.categories)}
+
+        self.masks = np.zeros((len(self.items) + 1, max((len(self.categories) + 63) // 64, 1)), dtype = np.uint64)
+        for item, category in zip(item_list, category_list):
+            c = category_ids[category]
+            self.masks[self.ids[item], c // 64] |= np.uint64(1) << np.uint64(c % 64)
+        self._resolved = {}
+
+    def __len__(self):
+        return len(self.items)
+
+    def resolve(self, word):
+        '''
+            Description:
+                Returns the id of the norms item closest to a word (e.g., grapes -> grape), or -1 if there is no
+                close match. Resolutions are memoized, so each distinct word is searched once.
+        '''
+        i = self._resolved.get(word)
+        if i is None:
+            if word in self.ids:
+                # an exact match is always the closest one
+                i = self.ids[word]
+            else:
+                match = difflib.get_close_matches(word, self.items, n = 1)
+                i = self.ids[match[0]] if len(match) > 0 else -1
+            self._resolved[word] = i
+        return i
+
+    def encode(self, fluency_list):
+        '''
+            Description:
+                Resolves a fluency list into norms item ids
+            Args:
+                (1) fluency_list: items produced by a participant (list of size L)
+            Returns:
+                (1) ids (np.array of int64, size L): norms item of each word, or -1
+        '''
+        return np.fromiter((self.resolve(word) for word in fluency_list), dtype = np.int64, count = len(fluency_list))
+
+    def category_names(self, word):
+        # categories of the norms item closest to word
+        mask = self.masks[self.resolve(word)]
+        return [category for c, category in enumerate(self.categories) if int(mask[c // 64]) >> (c % 64) & 1]
+
+    def associative_switches(self, fluency_list):
+        '''
+            Description:
+                Predicts a switch between consecutive items that share no category (see switch_norms)
+            Args:
+                (1) fluency_list: items produced by a participant (list of size L)
+            Returns:
+                (1) switches (np.array of int8, size L), where 0 = no switch, 1 = switch, 2 = boundary case
+        '''
+        masks = self.masks[self.encode(fluency_list)]
+        switches = np.full(len(fluency_list), 2, dtype = np.int8)
+        switches[1:] = ~(masks[1:] & masks[:-1]).any(axis = 1)
+        return switches
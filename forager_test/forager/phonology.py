@@ -0,0 +1,315 @@
+import numpy as np
+import scipy.sparse
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+
+'''
+
+Batched phoneme edit distances. Pronunciations are integer-encoded into one padded array, and the Levenshtein
+    distances of many pairs are computed at once, one vectorized DP row per phoneme of the first sequences, instead
+    of one pure-Python nltk.edit_distance run per pair. Similarities are the normalized scores of
+    phonology_funcs.normalized_edit_distance, bit for bit.
+
+    Classes
+        (1) PhonemeCodes: integer-encoded, padded pronunciations
+        (2) PhonologicalSimilarity: on-demand (optionally sparse top-k) stand-in for the dense NxN matrix
+    Functions
+        (1) edit_distance: Levenshtein distances of a batch of pairs of encoded sequences
+        (2) normalized_similarity: round(1 - distance/max length, 4) of a batch of pairs
+        (3) similarity_matrix: NxN phonological similarity matrix, computed in chunks on a process pool
+        (4) topk_matrix: sparse matrix of the k most similar words of each word, computed in chunks on a process pool
+'''
+
+
+class PhonemeCodes:
+    '''
+        Description:
+            Encodes the pronunciations of N words (lists of phonemes) into an N x Lmax int16 array, padded with -1
+        Args:
+            (1) pronunciations: one list of phonemes per word (list of length N)
+            (2) alphabet (dict): phoneme -> code to extend, so that several PhonemeCodes share their codes (optional)
+        Attributes:
+            codes (np.array, N x Lmax, int16): phoneme codes of each word
+            lengths (np.array, N, int64): number of phonemes of each word
+    '''
+    def __init__(self, pronunciations, alphabet = None):
+        self.alphabet = {} if alphabet is None else alphabet
+        self.lengths = np.array([len(pronunciation) for pronunciation in pronunciations], dtype = np.int64)
+        self.codes = np.full((len(self.lengths), max(self.lengths.max(initial = 0), 1)), -1, dtype = np.int16)
+        for i, pronunciation in enumerate(pronunciations):
+            self.codes[i, :len(pronunciation)] = [self.alphabet.setdefault(phoneme, len(self.alphabet)) for phoneme in pronunciation]
+
+    @classmethod
+    def from_arrays(cls, codes, lengths, alphabet = None):
+        # codes and lengths that were already encoded, e.g. memory-mapped from a lexicon bundle
+        phonemes = cls([], alphabet)
+        phonemes.codes, phonemes.lengths = codes, lengths
+        return phonemes
+
+    def __len__(self):
+        return len(self.lengths)
+
+
+def edit_distance(a, a_len, b, b_len):
+    '''
+        Description:
+            Levenshtein distances (unit costs, as nltk.edit_distance) of P pairs of encoded sequences. The DP table
+            is filled one row at a time for all pairs; within a row, insertions are resolved by a running minimum.
+        Args:
+            (1) a, b (np.array, P x La and P x Lb): padded codes of the first and second sequence of each pair
+            (2) a_len, b_len (np.array, P): lengths of the sequences
+        Returns:
+            (1) distance (np.array, P, int64)
+    '''
+    P, Lb = b.shape
+    steps = np.arange(Lb + 1, dtype = np.int16)
+    row = np.broadcast_to(steps, (P, Lb + 1)).copy()
+    distance = np.zeros(P, dtype = np.int64)
+    done = a_len == 0
+    distance[done] = b_len[done]
+    for i in range(1, a_len.max(initial = 0) + 1):
+        cost = row[:, :-1] + (a[:, i-1, None] != b)
+        np.minimum(cost, row[:, 1:] + 1, out = row[:, 1:])
+        row[:, 0] = i
+        # insertions: row[j] = min over k <= j of row[k] + (j - k)
+        row -= steps
+        np.minimum.accumulate(row, axis = 1, out = row)
+        row += steps
+        ends = np.flatnonzero(a_len == i)
+        distance[ends] = row[ends, b_len[ends]]
+    return distance
+
+def normalized_similarity(distance, a_len, b_len):
+    '''
+        Description:
+            Returns round(1 - distance/max(a_len, b_len), 4) of each pair, looked up in a table filled with Python's
+            round, so the scores are identical to phonology_funcs.normalized_edit_distance
+        Args:
+            (1) distance (np.array, P): edit distances
+            (2) a_len, b_len (np.array, P): lengths of the sequences
+        Returns:
+            (1) similarity (np.array, P)
+    '''
+    longest = np.maximum(a_len, b_len)
+    M = int(longest.max(initial = 1))
+    table = np.array([[round(1 - d/m, 4) if m > 0 else np.nan for m in range(M + 1)] for d in range(M + 1)])
+    return table[distance, longest]
+
+def pair_similarity(phonemes, rows, cols, other = None):
+    '''
+        Description:
+            Normalized similarities of the pairs (phonemes[rows[p]], other[cols[p]]), computed in one batch
+        Args:
+            (1) phonemes (PhonemeCodes)
+            (2) rows, cols (np.array, P): word of each pair in phonemes and in other
+            (3) other (PhonemeCodes): second words of the pairs, sharing the alphabet of phonemes (default: phonemes)
+        Returns:
+            (1) similarity (np.array, P)
+    '''
+    other = phonemes if other is None else other
+    a_len, b_len = phonemes.lengths[rows], other.lengths[cols]
+    if len(rows) == 0:
+        return np.zeros(0)
+    a = phonemes.codes[rows, :a_len.max()]
+    b = other.codes[cols, :max(b_len.max(), 1)]
+    return normalized_similarity(edit_distance(a, a_len, b, b_len), a_len, b_len)
+
+
+def init_similarity_worker(phonemes):
+    global worker_phonemes
+    worker_phonemes = phonemes
+
+def lower_triangle(start, stop):
+    # (row, col) pairs of the lower triangle in rows start..stop-1
+    rows = np.repeat(np.arange(start, stop), np.arange(start, stop))
+    cols = np.arange(len(rows)) - np.repeat(np.cumsum(np.arange(start, stop)) - np.arange(start, stop), np.arange(start, stop))
+    return rows, cols
+
+def similarity_chunk(bounds):
+    rows, cols = lower_triangle(*bounds)
+    return pair_similarity(worker_phonemes, rows, cols)
+
+def similarity_matrix(phonemes, workers = None, max_pairs = 2**18):
+    '''
+        Description:
+            Computes the NxN phonological similarity matrix of N encoded pronunciations. The lower triangle is
+            split into blocks of rows of about max_pairs pairs each, which are computed on a process pool.
+        Args:
+            (1) phonemes (PhonemeCodes): pronunciations of the N words
+            (2) workers (int): number of processes (1 computes in this process; default: all cores)
+            (3) max_pairs (int): number of pairs per block
+        Returns:
+            (1) sim (np.array, NxN): similarity matrix with a diagonal of 1
+    '''
+    N = len(phonemes)
+    # row i holds i pairs; block boundaries are placed every max_pairs pairs
+    pairs_before = np.arange(N + 1) * np.arange(-1, N) // 2
+    bounds = np.unique(np.concatenate([[0], np.searchsorted(pairs_before, np.arange(max_pairs, pairs_before[-1], max_pairs)), [N]]))
+    chunks = list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+    if workers == 1:
+        init_similarity_worker(phonemes)
+        results = [similarity_chunk(chunk) for chunk in tqdm(chunks)]
+    else:
+        with ProcessPoolExecutor(max_workers = workers, initializer = init_similarity_worker, initargs = (phonemes,)) as executor:
+            results = list(tqdm(executor.map(similarity_chunk, chunks), total = len(chunks)))
+
+    sim = np.zeros((N, N))
+    for (start, stop), values in zip(chunks, results):
+        rows, cols = lower_triangle(start, stop)
+        sim[rows, cols] = values
+    sim = sim + sim.T
+    np.fill_diagonal(sim, 1)
+    return sim
+
+def topk_chunk(job):
+    start, stop, k = job
+    N = len(worker_phonemes)
+    rows = np.repeat(np.arange(start, stop), N)
+    sims = pair_similarity(worker_phonemes, rows, np.tile(np.arange(N), stop - start)).reshape(stop - start, N)
+    cols = np.argpartition(-sims, k - 1, axis = 1)[:, :k]
+    return cols, np.take_along_axis(sims, cols, axis = 1)
+
+def topk_matrix(phonemes, k, workers = None, max_pairs = 2**18):
+    '''
+        Description:
+            Computes the k largest similarities of every word without ever holding the dense NxN matrix
+        Args:
+            (1) phonemes (PhonemeCodes): pronunciations of the N words
+            (2) k (int): number of neighbors kept per word (including the word itself)
+            (3) workers (int): number of processes (1 computes in this process; default: all cores)
+            (4) max_pairs (int): number of pairs per block of rows
+        Returns:
+            (1) topk (scipy.sparse.csr_matrix, NxN): k entries per row
+    '''
+    N = len(phonemes)
+    k = min(k, N)
+    block = max(max_pairs // max(N, 1), 1)
+    jobs = [(start, min(start + block, N), k) for start in range(0, N, block)]
+    if workers == 1:
+        init_similarity_worker(phonemes)
+        results = [topk_chunk(job) for job in tqdm(jobs)]
+    else:
+        with ProcessPoolExecutor(max_workers = workers, initializer = init_similarity_worker, initargs = (phonemes,)) as executor:
+            results = list(tqdm(executor.map(topk_chunk, jobs), total = len(jobs)))
+    cols = np.concatenate([c for c, v in results]).ravel() if results else np.zeros(0, dtype = np.int64)
+    values = np.concatenate([v for c, v in results]).ravel() if results else np.zeros(0)
+    return scipy.sparse.csr_matrix((values, cols, np.arange(0, N * k + 1, k)), shape = (N, N))
+
+
+class PhonologicalSimilarity:
+    '''
+        Description:
+            Phonological similarity of N words that is used in place of the dense NxN matrix when the vocabulary is
+            too large to hold it. It supports the indexing the foraging code uses on the dense matrix:
+                sim[i] or sim[i, :] (one row), sim[ids] (one row per id) and sim[rows, cols] (pairs)
+            Rows are computed on demand from the encoded pronunciations with the batched edit-distance engine and
+            kept in a bounded LRU cache; pairs are computed directly. If a sparse top-k neighbor matrix is attached
+            (build_topk, load_topk), rows and pairs are read from it instead, and similarities outside the top k
+            of a row take the floor value, which approximates the dense matrix while keeping O(N*k) memory.
+            As in the dense matrices, similarities <= 0 are set to the floor.
+        Args:
+            (1) phonemes (PhonemeCodes): pronunciations of the N words
+            (2) floor (float): value assigned to similarities <= 0 (and outside the top k)
+            (3) maxsize (int): maximum number of cached rows
+            (4) dtype (np.dtype): precision of the returned similarities
+            (5) topk (scipy.sparse matrix, NxN): sparse top-k neighbor matrix (optional)
+        Attributes:
+            hits (int): number of rows served from the cache
+            misses (int): number of rows computed
+    '''
+    ndim = 2
+
+    def __init__(self, phonemes, floor = .0001, maxsize = 1024, dtype = np.float64, topk = None):
+        self.phonemes = phonemes
+        self.floor = floor
+        self.maxsize = maxsize
+        self.dtype = np.dtype(dtype)
+        self.topk = None if topk is None else scipy.sparse.csr_matrix(topk)
+        self.hits = 0
+        self.misses = 0
+        self._rows = OrderedDict()
+
+    @property
+    def shape(self):
+        return (len(self.phonemes), len(self.phonemes))
+
+    def __len__(self):
+        return len(self.phonemes)
+
+    def clamp(self, values):
+        return np.where(values <= 0, self.floor, values).astype(self.dtype)
+
+    def row(self, i):
+        '''
+            Description:
+                Returns the similarity of word i with every word (read-only np.array, size N)
+        '''
+        i = int(i)
+        if i in self._rows:
+            self._rows.move_to_end(i)
+            self.hits += 1
+            return self._rows[i]
+        self.misses += 1
+        N = len(self.phonemes)
+        if self.topk is not None:
+            values = np.zeros(N)
+            start, stop = self.topk.indptr[i], self.topk.indptr[i+1]
+            values[self.topk.indices[start:stop]] = self.topk.data[start:stop]
+        else:
+            values = pair_similarity(self.phonemes, np.full(N, i), np.arange(N))
+        row = self.clamp(values)
+        row.setflags(write = False)
+        self._rows[i] = row
+        if len(self._rows) > self.maxsize:
+            self._rows.popitem(last = False)
+        return row
+
+    def pairs(self, rows, cols):
+        '''
+            Description:
+                Returns the similarities of the pairs (rows[p], cols[p]) (np.array, P)
+        '''
+        rows, cols = np.broadcast_arrays(np.asarray(rows, dtype = np.int64), np.asarray(cols, dtype = np.int64))
+        if self.topk is not None:
+            values = np.asarray(self.topk[rows.ravel(), cols.ravel()]).ravel()
+        else:
+            values = pair_similarity(self.phonemes, rows.ravel(), cols.ravel())
+        return self.clamp(values).reshape(rows.shape)
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            rows, cols = key
+            if isinstance(cols, slice) and cols == slice(None):
+                return self[rows]
+            values = self.pairs(rows, cols)
+            return values if values.ndim else values[()]
+        if np.ndim(key) == 0:
+            return self.row(key)
+        ids = np.asarray(key)
+        rows = np.empty(ids.shape + (len(self.phonemes),), dtype = self.dtype)
+        for index, i in np.ndenumerate(ids):
+            rows[index] = self.row(i)
+        return rows
+
+    def __array__(self, dtype = None, copy = None):
+        # materializes the dense matrix, only sensible for small vocabularies
+        return self[np.arange(len(self.phonemes))].astype(self.dtype if dtype is None else dtype, copy = False)
+
+    def build_topk(self, k, workers = None):
+        '''
+            Description:
+                Computes and attaches the sparse top-k neighbor matrix (see topk_matrix)
+        '''
+        self.topk = topk_matrix(self.phonemes, k, workers)
+        self._rows.clear()
+        return self.topk
+
+    def save_topk(self, path):
+        scipy.sparse.save_npz(path, self.topk)
+
+    def load_topk(self, path):
+        self.topk = scipy.sparse.load_npz(path).tocsr()
+        self._rows.clear()
+        return self.topk
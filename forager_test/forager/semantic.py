@@ -0,0 +1,156 @@
+import numpy as np
+
+'''
+
+Blocked cosine similarities of word embeddings. The embeddings are L2-normalized once, and the semantic similarity
+    matrix is computed a block of rows at a time with one BLAS matrix multiply per block, instead of one float64
+    cdist over all N^2 pairs. Blocks can be written straight into a memory-mapped .npy file, so that the full NxN
+    matrix is never held in memory.
+
+    Classes
+        (1) LowRankSimilarity: on-demand stand-in for the dense NxN matrix, holding only the NxD normalized embeddings
+    Functions
+        (1) normalize_embeddings: L2-normalized rows of an embedding matrix
+        (2) similarity_matrix: NxN cosine similarity matrix, computed in row blocks, optionally into a .npy file
+'''
+
+
+def normalize_embeddings(embeddings, dtype = np.float32):
+    '''
+        Description:
+            Divides each embedding by its L2 norm. Norms are computed in float64; embeddings of norm 0 stay 0,
+            so that their similarity with every word is 0.
+        Args:
+            (1) embeddings (np.array, N x D): one embedding per word
+            (2) dtype (np.dtype): precision of the normalized embeddings
+        Returns:
+            (1) normalized (np.array, N x D)
+    '''
+    embeddings = np.asarray(embeddings)
+    norms = np.linalg.norm(embeddings.astype(np.float64, copy = False), axis = 1, keepdims = True)
+    norms[norms == 0] = 1
+    return (embeddings / norms).astype(dtype, copy = False)
+
+def similarity_matrix(embeddings, path = None, dtype = np.float32, max_entries = 2**24):
+    '''
+        Description:
+            Computes the cosine similarity of every pair of words, max_entries similarities (a block of rows) at
+            a time. Each block is one matrix multiply of the normalized embeddings, which runs on all BLAS threads.
+            The similarity of a word with itself is 1.
+        Args:
+            (1) embeddings (np.array, N x D): one embedding per word
+            (2) path (str): .npy file that the matrix is written to as a memory map (optional; by default the
+                matrix is returned in memory)
+            (3) dtype (np.dtype): precision of the normalized embeddings and of the matrix
+            (4) max_entries (int): number of similarities per block, which bounds the memory used besides the output
+        Returns:
+            (1) semantic_matrix (NxN np.array, or np.memmap of path)
+    '''
+    normalized = normalize_embeddings(embeddings, dtype)
+    N = len(normalized)
+    if path is None:
+        semantic_matrix = np.empty((N, N), dtype = dtype)
+    else:
+        semantic_matrix = np.lib.format.open_memmap(path, mode = 'w+', dtype = dtype, shape = (N, N))
+    nonzero = normalized.any(axis = 1)
+    block = max(max_entries // max(N, 1), 1)
+    for start in range(0, N, block):
+        stop = min(start + block, N)
+        rows = normalized[start:stop] @ normalized.T
+        diagonal = np.arange(start, stop)
+        rows[diagonal - start, diagonal] = np.where(nonzero[start:stop], 1, 0)
+        semantic_matrix[start:stop] = rows
+    if path is not None:
+        semantic_matrix.flush()
+    return semantic_matrix
+
+
+class LowRankSimilarity:
+    '''
+        Description:
+            Semantic similarity of N words that is used in place of the dense NxN matrix: the matrix is the cosine
+            Gram matrix of the embeddings, so only the NxD normalized embeddings E are stored (O(N*D) memory instead
+            of O(N^2)) and similarities are computed when they are indexed, as the dense matrix is:
+                sim[i] or sim[i, :] (one row, E[i] @ E.T), sim[ids] (one row per id, computed for a whole fluency
+                list with one matrix multiply) and sim[rows, cols] (pairs)
+            As in the dense matrices, the similarity of a word with itself is 1 and similarities <= 0 are set to
+            the floor. Words are added with extend, without rebuilding anything.
+        Args:
+            (1) embeddings (np.array, N x D): one embedding per word, in the order of the vocabulary
+            (2) floor (float): value assigned to similarities <= 0
+            (3) dtype (np.dtype): precision of the normalized embeddings and of the returned similarities
+    '''
+    ndim = 2
+
+    def __init__(self, embeddings, floor = .0001, dtype = np.float64):
+        self.floor = floor
+        self.dtype = np.dtype(dtype)
+        self.embeddings = normalize_embeddings(embeddings, self.dtype)
+        self.nonzero = self.embeddings.any(axis = 1)
+
+    @property
+    def shape(self):
+        return (len(self.embeddings), len(self.embeddings))
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    def clamp(self, values):
+        values[values <= 0] = self.floor
+        return values
+
+    def rows(self, ids):
+        '''
+            Description:
+                Returns the similarity of each word of ids with every word
+            Args:
+                (1) ids: vocabulary ids (array-like of size L)
+            Returns:
+                (1) rows (np.array, L x N)
+        '''
+        ids = np.asarray(ids, dtype = np.intp).ravel()
+        rows = self.embeddings[ids] @ self.embeddings.T
+        rows[np.arange(len(ids)), ids] = self.nonzero[ids]
+        return self.clamp(rows)
+
+    def pairs(self, rows, cols):
+        '''
+            Description:
+                Returns the similarities of the pairs (rows[p], cols[p]) (np.array, P)
+        '''
+        rows, cols = np.broadcast_arrays(np.asarray(rows, dtype = np.intp), np.asarray(cols, dtype = np.intp))
+        values = np.einsum('ij,ij->i', self.embeddings[rows.ravel()], self.embeddings[cols.ravel()])
+        same = rows.ravel() == cols.ravel()
+        values[same] = self.nonzero[rows.ravel()[same]]
+        return self.clamp(values).reshape(rows.shape)
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            rows, cols = key
+            if isinstance(cols, slice) and cols == slice(None):
+                return self[rows]
+            values = self.pairs(rows, cols)
+            return values if values.ndim else values[()]
+        if np.ndim(key) == 0:
+            return self.rows([key])[0]
+        ids = np.asarray(key)
+        return self.rows(ids).reshape(ids.shape + (len(self),))
+
+    def __array__(self, dtype = None, copy = None):
+        # materializes the dense matrix, only sensible for small vocabularies
+        return self.rows(np.arange(len(self))).astype(self.dtype if dtype is None else dtype, copy = False)
+
+    def extend(self, embeddings):
+        '''
+            Description:
+                Adds the embeddings of new words after the existing ones
+            Args:
+                (1) embeddings (np.array, M x D)
+            Returns:
+                (1) ids (np.array, M): vocabulary ids of the new words
+        '''
+        normalized = normalize_embeddings(np.atleast_2d(embeddings), self.dtype)
+        ids = np.arange(len(self), len(self) + len(normalized))
+        self.embeddings = np.concatenate([self.embeddings, normalized])
+        self.nonzero = np.concatenate([self.nonzero, normalized.any(axis = 1)])
+        return ids
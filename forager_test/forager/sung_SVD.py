@@ -2,6 +2,7 @@ import numpy as np
 from sklearn.decomposition import TruncatedSVD
 import pandas as pd
 from sklearn.metrics.pairwise import cosine_similarity
+from forager.vocabulary import Vocabulary
 
 
 def calculate_svd_clusters(participant_data, cosine_threshold=0.9):
@@ -16,10 +17,10 @@ def calculate_svd_clusters(participant_data, cosine_threshold=0.9):
     unique_participants = participant_data[column_names[0]].unique()
     word_participant_matrix = np.zeros((len(unique_words), len(unique_participants)))
 
-    for i, row in participant_data.iterrows():
-        word_index = np.where(unique_words == row[column_names[1]])[0][0]
-        participant_index = np.where(unique_participants == row[column_names[0]])[0][0]
-        word_participant_matrix[word_index, participant_index] = 1
+    # encode every row into (word, participant) ids in one pass
+    word_index = Vocabulary(unique_words, aliases = False).encode(participant_data[column_names[1]].tolist())
+    participant_index = Vocabulary(unique_participants, aliases = False).encode(participant_data[column_names[0]].tolist())
+    word_participant_matrix[word_index, participant_index] = 1
 
     # Apply SVD for clustering
     svd = TruncatedSVD(n_components=5, random_state=0)
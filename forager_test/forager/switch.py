@@ -6,6 +6,7 @@ import difflib
 import pandas as pd
 from forager.sung_SVD import calculate_svd_clusters, gtom_clusters
 from forager.cues import create_history_variables
+from forager.norms import NormsIndex
 
 
 '''
@@ -17,11 +18,13 @@ Methods for calculating switches in Semantic Foraging methods.
         (2) Troyer Norms: Switch Method based on Categorization Norms developed in Troyer, AK, Moscovitch, M, & Winocur, G (1997).
             Switches are predicted when moving from one category from the "Troyer Norms" to another.
 
-        (3) Multimodal Simdrop: An extension of the Similarity Drop Method to include phonological similarity in the heuristic
+        (3) Multimodal Simdrop: An extension of the Similarity Drop Method to include phonological similarity in the heuristic.
+            switch_multimodal_batch evaluates a whole grid of alpha values in one call
 
         (4) Delta Similarity: A method for predicting switches proposed by Nancy Lundin in her dissertation to bypass limitations
             of simdrop model, and allow for consecutive switches, and accounts for small dips in similarity that simdrop may
-            deem a switch, which may actually be due to "noise" 
+            deem a switch, which may actually be due to "noise". switch_delta_batch and switch_multimodaldelta_batch
+            evaluate the whole (alpha, rise, fall) parameter grid in one call
 
     Output Format: 
         Each switch method should preserve the same length/general format for returing switch values, 
@@ -36,6 +39,25 @@ Methods for calculating switches in Semantic Foraging methods.
 '''
 
 
+def local_minima(similarity):
+    '''
+        Marks the items at which similarity drops: a switch is predicted at item k if the similarity before it,
+        similarity[k-1], and the similarity after it, similarity[k+1], are both greater than similarity[k].
+        Computed with shifted-array comparisons over the last axis, so a whole batch of lists is marked at once.
+
+        Args:
+            similarity (np.array, size = ... x L): similarities between consecutive items in a fluency list
+
+        Returns:
+            switches (np.array of int8, size = ... x L), where 0 = no switch, 1 = switch, 2 = boundary case
+    '''
+    similarity = np.asarray(similarity)
+    switches = np.full(similarity.shape, 2, dtype = np.int8)
+    if similarity.shape[-1] > 2:
+        current = similarity[..., 1:-1]
+        switches[..., 1:-1] = (similarity[..., 2:] > current) & (similarity[..., :-2] > current)
+    return switches
+
 def switch_simdrop(fluency_list, semantic_similarity):
     '''
         Similarity Drop Switch Method from Hills TT, Jones MN, Todd (2012).
@@ -47,20 +69,7 @@ def switch_simdrop(fluency_list, semantic_similarity):
         Returns:
             a list, size L, of switches, where 0 = no switch, 1 = switch, 2 = boundary case
     '''
-    simdrop = []
-    for k in range(len(fluency_list)):
-        if (k > 0 and k < (len(fluency_list)-1)): 
-            # simdrop
-            if (semantic_similarity[k+1] > semantic_similarity[k]) and (semantic_similarity[k-1] > semantic_similarity[k]):
-                simdrop.append(1)
-            
-            else:
-                simdrop.append(0)
-
-        else:
-            simdrop.append(2)
-
-    return simdrop
+    return local_minima(np.asarray(semantic_similarity)[:len(fluency_list)]).tolist()
 
 def switch_norms_categorical(fluency_list,norms):
     '''
@@ -139,42 +148,21 @@ def switch_norms(fluency_list,norms):
     '''
         Switch Method Based on Troyer Norms from Troyer, A. K., Moscovitch, M., & Winocur, G. (1997).
 
+        Each item is matched to its closest item in norms: often, this will be an exact match, but if not, the
+        category of the closest match is assigned to the item (e.g., grapes -> grape). If difflib finds no close
+        match, the item has no category. A switch is predicted when consecutive items share no category.
+
         Args:
             fluency_list (list, size = L): fluency list to predict switches on
-            norms (dataframe, size = L x 2): dataframe of norms data matching animals to a categorical classification
+            norms (NormsIndex, or dataframe, size = L x 2): norms data matching animals to a categorical classification.
+                A NormsIndex built once per norms file (see LexicalSpace.norms_index) is reused across lists
 
         Returns:
             troyer (list, size = L): a list of switches, where 0 = no switch, 1 = switch, 2 = boundary case
     '''
-    norm_designation = []
-
-    for k in range(len(fluency_list)):
-        if k > 0:
-            item1 = fluency_list[k]
-            item2 = fluency_list[k-1]
-            items_in_norms = norms['Item'].values.tolist()
-            # find closest match to item1 and item2 in norms
-            # often, this will be an exact match, but if not, we want to find the closest match
-            # so that we can assign the category of the closest match to item1 and item2
-            # e.g., grapes -> grape
-            # if difflib returns an empty list, then there is no close match, and we just use the original item
-            
-            item1 = difflib.get_close_matches(item1, items_in_norms, n=1)[0] if len(difflib.get_close_matches(item1, items_in_norms, n = 1)) > 0 else item1
-            item2 = difflib.get_close_matches(item2, items_in_norms, n=1)[0] if len(difflib.get_close_matches(item2, items_in_norms, n = 1)) > 0 else item2
-
-            category1 = norms[norms['Item'] == item1]['Category'].values.tolist()
-            category2 = norms[norms['Item'] == item2]['Category'].values.tolist()
-
-            if len(list(set(category1) & set(category2)))== 0:
-                norm_designation.append(1)
-
-            else:
-                norm_designation.append(0)
-
-        else:
-            norm_designation.append(2)
-    
-    return norm_designation
+    if not isinstance(norms, NormsIndex):
+        norms = NormsIndex(norms)
+    return norms.associative_switches(fluency_list).tolist()
 
 def switch_multimodal(fluency_list,semantic_similarity,phonological_similarity,alpha):
     '''
@@ -190,24 +178,81 @@ def switch_multimodal(fluency_list,semantic_similarity,phonological_similarity,a
         Raises:
             Exception: if alpha is not between 0 and 1
     '''    
-    #Check if alpha is between 0 and 1
-    
-    if alpha > 1 or alpha < 0:
+    return switch_multimodal_batch(fluency_list, semantic_similarity, phonological_similarity, [alpha])[0].tolist()
+
+def switch_multimodal_batch(fluency_list, semantic_similarity, phonological_similarity, alphas):
+    '''
+        Multimodal Similarity Drop for a whole grid of alpha values at once. The combined similarities of all alphas
+        are computed as one (n_alpha x L) array, and their drops are marked with shifted-array comparisons
+        (local_minima). Row i equals switch_multimodal(..., alphas[i]); alpha = 1 gives switch_simdrop.
+        Args:
+            fluency_list (list, size = L): fluency list to predict switches on
+            semantic_similarity (list, size = L): a list of semantic similarities between items in the fluency list, obtained via create_history_variables
+            phonological_similarity (list, size = L): a list of phonological similarities between items in the fluency list obtained via create_history_variables
+            alphas (list, size = n_alpha): alpha parameters that dictate the weight of semantic vs. phonological cue, between 0 and 1
+        Returns:
+            switches (np.array of int8, size = n_alpha x L), where 0 = no switch, 1 = switch, 2 = boundary case
+        
+        Raises:
+            Exception: if an alpha is not between 0 and 1
+    '''
+    alphas = np.asarray(alphas, dtype = np.float64).reshape(-1, 1)
+    if np.any(alphas > 1) or np.any(alphas < 0):
         raise Exception("Alpha parameter must be within range [0,1]")
-    simphon = alpha * np.array(semantic_similarity) + (1 - alpha) * np.array(phonological_similarity)
-    multimodalsimdrop = []
+    L = len(fluency_list)
+    semantic = np.asarray(semantic_similarity, dtype = np.float64)[:L]
+    phonological = np.asarray(phonological_similarity, dtype = np.float64)[:L]
+    simphon = alphas * semantic + (1 - alphas) * phonological
+    return local_minima(simphon)
 
-    for k in range(len(fluency_list)):
-        if (k > 0 and k < (len(fluency_list) - 1)): 
-            if (simphon[k + 1] > simphon[k]) and (simphon[k - 1] > simphon[k]):
-                multimodalsimdrop.append(1)
-            else:
-                multimodalsimdrop.append(0)
+def delta_switches(similarity, rise_thresh, fall_thresh):
+    '''
+        Delta Similarity state machine of Nancy Lundin & Peter Todd, advanced for a whole grid of thresholds at once.
+        The similarities of each list are z-scored once; then, at each position, the cluster/switch state of every
+        (list, rise_thresh, fall_thresh) combination is updated with one vectorized comparison, so the only loop
+        is over the positions of the list.
 
-        else:
-            multimodalsimdrop.append(2)
+        Args:
+            similarity (np.array, size = n x L): n lists of similarities between consecutive items (e.g. one per alpha)
+            rise_thresh (list, size = R): after a switch occurs, thresholds that the increase in z-scored similarity must exceed to be a cluster
+            fall_thresh (list, size = F): while in a cluster, thresholds that the decrease in z-scored similarity must exceed to be a switch
 
-    return multimodalsimdrop
+        Returns:
+            switches (np.array of int8, size = n x R x F x L), where 0 = no switch, 1 = switch, 2 = boundary case
+    '''
+    similarity = np.asarray(similarity, dtype = np.float64)
+    rise_thresh = np.asarray(rise_thresh, dtype = np.float64).reshape(1, -1, 1)
+    fall_thresh = np.asarray(fall_thresh, dtype = np.float64).reshape(1, 1, -1)
+    n, L = similarity.shape
+    switches = np.full((n, rise_thresh.shape[1], fall_thresh.shape[2], L), 2, dtype = np.int8)
+
+    # z-score similarities within each list; the first item has no preceding similarity
+    similaritiesZ = np.full((n, L), np.nan)
+    switch = np.zeros(n, dtype = bool)
+    for i in range(n):
+        similaritiesZ[i, 1:] = stats.zscore(similarity[i, 1:])
+        # for second item, if similarity < median (subject level threshold), then switch, else cluster
+        switch[i] = similaritiesZ[i, 1] < statistics.median(similaritiesZ[i, 1:])
+
+    state = np.broadcast_to(switch[:, None, None], switches.shape[:3])
+    if L > 1:
+        switches[..., 1] = state
+    for k in range(1, L - 1):
+        # consider k-1, k, k+1 items
+        fall = (similaritiesZ[:, k] - similaritiesZ[:, k + 1])[:, None, None]
+        rise = (similaritiesZ[:, k + 1] - similaritiesZ[:, k])[:, None, None]
+        # a cluster becomes a switch if similarity fell more than fall_thresh,
+        # a switch stays a switch unless similarity rose more than rise_thresh
+        state = np.where(state, ~(rise_thresh < rise), fall_thresh < fall)
+        switches[..., k + 1] = state
+    return switches
+
+def check_thresholds(rise_thresh, fall_thresh):
+    if np.any(np.asarray(rise_thresh) > 1) or np.any(np.asarray(rise_thresh) < 0):
+        raise Exception("Rise Threshold parameter must be within range [0,1]")
+
+    if np.any(np.asarray(fall_thresh) > 1) or np.any(np.asarray(fall_thresh) < 0):
+        raise Exception("Fall Threshold parameter must be within range [0,1]")
 
 def switch_multimodaldelta(fluency_list, semantic_similarity, phonological_similarity, rise_thresh, fall_thresh, alpha):
     '''
@@ -222,60 +267,31 @@ def switch_multimodaldelta(fluency_list, semantic_similarity, phonological_simil
         Returns:
             a list, size L, of switches, where 0 = no switch, 1 = switch, 2 = boundary case
     '''
-    if rise_thresh > 1 or rise_thresh < 0:
-        raise Exception("Rise Threshold parameter must be within range [0,1]")
+    return switch_multimodaldelta_batch(fluency_list, semantic_similarity, phonological_similarity, [rise_thresh], [fall_thresh], [alpha])[0, 0, 0].tolist()
 
-    if fall_thresh > 1 or fall_thresh < 0:
-        raise Exception("Fall Threshold parameter must be within range [0,1]")
-    
-    if alpha > 1 or alpha < 0:
-        raise Exception("Alpha parameter must be within range [0,1]")
-    
-    simphon = alpha * np.array(semantic_similarity) + (1 - alpha) * np.array(phonological_similarity)
-
-    switchVector = [2] # first item designated with 2
-
-    # obtain consecutive semantic similarities b/w responses
-    # z-score similarities within participant
-    similaritiesZ = stats.zscore(simphon[1:])
-    medianSim = statistics.median(similaritiesZ)
-    meanSim = 0
-    similaritiesZ = np.concatenate(([np.nan], similaritiesZ))
-
-    # define subject level threshold = median (zscored similarities)
-    # firstSwitchSimThreshold = meanSim
-    firstSwitchSimThreshold = medianSim
-    # for second item, if similarity < median, then switch, else cluster
-    if similaritiesZ[1] < firstSwitchSimThreshold:
-        switchVector.append(1)
-    else:
-        switchVector.append(0)
-
-    currentState = switchVector[1]
-    previousState = currentState
-
-    # for all other items:
-    for n in range(1,len(fluency_list)-1):
-    #   consider n-1, n, n+1 items
-        
-        simPrecedingToCurrentWord = similaritiesZ[n]
+def switch_multimodaldelta_batch(fluency_list, semantic_similarity, phonological_similarity, rise_thresh, fall_thresh, alphas):
+    '''
+        Delta Similarity Switch Method on multimodal similarities, for the whole (alpha, rise, fall) parameter grid at
+        once (see delta_switches). Entry [i, j, k] equals switch_multimodaldelta(..., rise_thresh[j], fall_thresh[k], alphas[i]).
         
-        simCurrentToNextWord = similaritiesZ[n+1]
-        if previousState == 0: #if previous state was a cluster
-            if fall_thresh < (simPrecedingToCurrentWord - simCurrentToNextWord): # similarity diff fell more than threshold
-                currentState = 1 # switch
-            else:
-                currentState = 0 # cluster
-        else: # previous state was a switch
-            if rise_thresh < (simCurrentToNextWord - simPrecedingToCurrentWord): # similarity diff is greater than our rise threshold
-                currentState = 0 # cluster
-            else:
-                currentState = 1 # switch
-
-        switchVector.append(currentState)
-        previousState = currentState
+        Args:
+            fluency_list (list, size = L): fluency list to predict switches on
+            semantic_similarity (list, size = L): a list of semantic similarities between items in the fluency list, obtained via create_history_variables
+            phonological_similarity (list, size = L): a list of phonological similarities between items in the fluency list obtained via create_history_variables
+            rise_thresh (list, size = R): rise thresholds, between 0 and 1
+            fall_thresh (list, size = F): fall thresholds, between 0 and 1
+            alphas (list, size = n_alpha): weights of semantic vs. phonological cue, between 0 and 1
 
-    return switchVector
+        Returns:
+            switches (np.array of int8, size = n_alpha x R x F x L), where 0 = no switch, 1 = switch, 2 = boundary case
+    '''
+    check_thresholds(rise_thresh, fall_thresh)
+    alphas = np.asarray(alphas, dtype = np.float64).reshape(-1, 1)
+    if np.any(alphas > 1) or np.any(alphas < 0):
+        raise Exception("Alpha parameter must be within range [0,1]")
+    L = len(fluency_list)
+    simphon = alphas * np.asarray(semantic_similarity, dtype = np.float64)[:L] + (1 - alphas) * np.asarray(phonological_similarity, dtype = np.float64)[:L]
+    return delta_switches(simphon, rise_thresh, fall_thresh)
 
 
 def switch_delta(fluency_list, semantic_similarity, rise_thresh, fall_thresh):
@@ -291,64 +307,24 @@ def switch_delta(fluency_list, semantic_similarity, rise_thresh, fall_thresh):
         Returns:
             a list, size L, of switches, where 0 = no switch, 1 = switch, 2 = boundary case
     '''
-    if rise_thresh > 1 or rise_thresh < 0:
-        raise Exception("Rise Threshold parameter must be within range [0,1]")
+    return switch_delta_batch(fluency_list, semantic_similarity, [rise_thresh], [fall_thresh])[0, 0].tolist()
 
-    if fall_thresh > 1 or fall_thresh < 0:
-        raise Exception("Fall Threshold parameter must be within range [0,1]")
-
-    switchVector = [2] # first item designated with 2
-
-    # obtain consecutive semantic similarities b/w responses
-    # z-score similarities within participant
-    #print("semantic_similarity: ", semantic_similarity)
-    similaritiesZ = stats.zscore(semantic_similarity[1:])
-    #print("similaritiesZ: ", similaritiesZ)
-    medianSim = statistics.median(similaritiesZ)
-    #print("medianSim: ", medianSim)
-    meanSim = 0
-    similaritiesZ = np.concatenate(([np.nan], similaritiesZ))
-
-    # define subject level threshold = median (zscored similarities)
-    # firstSwitchSimThreshold = meanSim
-    firstSwitchSimThreshold = medianSim
-    # for second item, if similarity < median, then switch, else cluster
-    if similaritiesZ[1] < firstSwitchSimThreshold:
-        switchVector.append(1)
-        #print(f"{fluency_list[1]} is a switch")
-    else:
-        switchVector.append(0)
-        #print(f"{fluency_list[1]} is a cluster")
-
-    currentState = switchVector[1]
-    previousState = currentState
-
-    # for all other items:
-    for n in range(1,len(fluency_list)-1):
-    #   consider n-1, n, n+1 items
-        
-        simPrecedingToCurrentWord = similaritiesZ[n]
-        #print(f"similarity of {fluency_list[n]} to {fluency_list[n+1]}: {simPrecedingToCurrentWord}")
+def switch_delta_batch(fluency_list, semantic_similarity, rise_thresh, fall_thresh):
+    '''
+        Delta Similarity Switch Method for the whole (rise, fall) parameter grid at once (see delta_switches).
+        Entry [j, k] equals switch_delta(..., rise_thresh[j], fall_thresh[k]).
         
-        simCurrentToNextWord = similaritiesZ[n+1]
-        #print(f"similarity of {fluency_list[n+1]} to {fluency_list[n+2]}: {simCurrentToNextWord}")
-        if previousState == 0: #if previous state was a cluster
-            if fall_thresh < (simPrecedingToCurrentWord - simCurrentToNextWord): # similarity diff fell more than threshold
-                currentState = 1 # switch
-            else:
-                currentState = 0 # cluster
-            #print(f"current state: {currentState}")
-        else: # previous state was a switch
-            if rise_thresh < (simCurrentToNextWord - simPrecedingToCurrentWord): # similarity diff is greater than our rise threshold
-                currentState = 0 # cluster
-            else:
-                currentState = 1 # switch
-            #print(f"current state: {currentState}")
-
-        switchVector.append(currentState)
-        previousState = currentState
+        Args:
+            fluency_list (list, size = L): fluency list to predict switches on
+            semantic_similarity (list, size = L): a list of semantic similarities between items in the fluency list, obtained via create_history_variables
+            rise_thresh (list, size = R): rise thresholds, between 0 and 1
+            fall_thresh (list, size = F): fall thresholds, between 0 and 1
 
-    return switchVector
+        Returns:
+            switches (np.array of int8, size = R x F x L), where 0 = no switch, 1 = switch, 2 = boundary case
+    '''
+    check_thresholds(rise_thresh, fall_thresh)
+    return delta_switches(np.asarray(semantic_similarity, dtype = np.float64)[None, :len(fluency_list)], rise_thresh, fall_thresh)[0]
 
 def switch_svd_gtom(fluency_list, svd_clusters, gtom_threshold):
     """
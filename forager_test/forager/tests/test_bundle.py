@@ -0,0 +1,136 @@
+import os
+import pickle
+import pytest
+import numpy as np
+import pandas as pd
+from forager import cues
+from forager.bundle import build_lexicon, load_lexicon, source_paths, changed_sources, read_manifest, main, arpabet_path
+from forager.cues import phonology_funcs, PronunciationStore, PackedArpabet
+from forager.semantic import LowRankSimilarity
+from forager.embedding_store import EmbeddingStore
+from forager.phonology import PhonologicalSimilarity
+
+'''
+Builds a lexicon bundle from toy CSV lexical data and checks that the memory-mapped LexicalSpace holds the same
+data as the CSVs, with dense matrices or with the on-demand similarities of domains without them.
+'''
+
+rng = np.random.default_rng(0)
+labels = ['ant', 'bee', 'cat', 'dog', 'eel']
+sim_matrix = rng.uniform(-0.5, 1, (5, 5))
+phon_matrix = rng.uniform(0, 1, (5, 5))
+frequencies = rng.uniform(1, 5, 5)
+
+@pytest.fixture
+def root(tmp_path):
+    sources = source_paths('toy', str(tmp_path))
+    os.makedirs(os.path.dirname(sources['semantic']))
+    os.makedirs(os.path.dirname(sources['norms_animals']))
+    np.savetxt(sources['semantic'], sim_matrix, delimiter = ',')
+    np.savetxt(sources['phonological'], phon_matrix, delimiter = ',')
+    pd.DataFrame({0: labels, 1: frequencies}).to_csv(sources['frequencies'], header = False, index = False)
+    for name in ['norms_animals', 'norms_foods']:
+        pd.DataFrame({'Category': ['a', 'b'], 'Item': ['ant', 'bee']}).to_csv(sources[name], index = False)
+    return str(tmp_path)
+
+def test_build_and_load(root):
+    build_lexicon('toy', root)
+    lexicon = load_lexicon('toy', root, verify = True)
+    # the matrices are views of the memory-mapped files, not copies
+    assert not lexicon.sim_matrix.flags.owndata and not lexicon.sim_matrix.flags.writeable
+    assert np.allclose(lexicon.sim_matrix, np.where(sim_matrix <= 0, .0001, sim_matrix))
+    assert np.allclose(lexicon.phon_matrix, phon_matrix) and np.allclose(lexicon.freq_matrix, frequencies)
+    assert list(lexicon.labels) == labels and lexicon.norms[0]['Item'].tolist() == ['ant', 'bee']
+    # workers reopen the memory map instead of receiving a copy of the matrices
+    assert isinstance(pickle.loads(pickle.dumps(lexicon)).sim_matrix, np.memmap)
+    assert lexicon.__getstate__()['sim_matrix'] is None
+    assert load_lexicon('toy', root, dtype = np.float32).sim_matrix.dtype == np.float32
+
+def test_corrupted_bundle(root):
+    build_lexicon('toy', root)
+    with open(os.path.join(root, 'lexical_data', 'toy', 'bundle', 'semantic.npy'), 'r+b') as f:
+        f.seek(-1, os.SEEK_END)
+        f.write(b'\x01')
+    with pytest.raises(Exception):
+        load_lexicon('toy', root, verify = True)
+    with pytest.raises(Exception):
+        load_lexicon('missing', root)
+
+def test_changed_sources(root):
+    build_lexicon('toy', root)
+    frequencies_path = source_paths('toy', root)['frequencies']
+    # the same contents written again are not a change
+    os.utime(frequencies_path, (0, 0))
+    assert changed_sources(read_manifest('toy', root), root) == []
+    pd.DataFrame({0: labels, 1: frequencies + 1}).to_csv(frequencies_path, header = False, index = False)
+    assert changed_sources(read_manifest('toy', root), root) == [os.path.join('lexical_data', 'toy', 'USE_frequencies.csv')]
+    with pytest.warns(UserWarning):
+        load_lexicon('toy', root)
+    with pytest.raises(Exception):
+        main(['toy', '--root', root, '--verify'])
+    build_lexicon('toy', root)
+    assert np.allclose(load_lexicon('toy', root, verify = True).freq_matrix, frequencies + 1)
+
+def test_build_from_other_names(tmp_path):
+    # the layout of occupations: frequencies.csv with log and raw counts, phonmatrix.csv, and embeddings
+    # instead of a semantic matrix
+    root = str(tmp_path)
+    lexical_path = os.path.join(root, 'lexical_data', 'toy')
+    os.makedirs(lexical_path)
+    os.makedirs(os.path.join(root, 'norms'))
+    embeddings = rng.normal(size = (8, 5))
+    pd.DataFrame(embeddings[:, ::-1], columns = labels[::-1]).to_csv(os.path.join(lexical_path, 'semantic_embeddings.csv'), index = False)
+    np.savetxt(os.path.join(lexical_path, 'phonmatrix.csv'), phon_matrix, delimiter = ',')
+    pd.DataFrame({0: labels, 1: frequencies, 2: np.exp(frequencies)}).to_csv(os.path.join(lexical_path, 'frequencies.csv'), header = False, index = False)
+    for name in ['animals', 'foods']:
+        pd.DataFrame({'Category': ['a'], 'Item': ['ant']}).to_csv(os.path.join(root, 'norms', name + '_snafu_scheme_vocab.csv'), index = False)
+
+    manifest = build_lexicon('toy', root)
+    assert sorted(entry['file'] for entry in manifest['sources'].values() if entry['file'].startswith('lexical_data')) == \
+        [os.path.join('lexical_data', 'toy', name) for name in ['frequencies.csv', 'phonmatrix.csv', 'semantic_embeddings.csv']]
+    lexicon = load_lexicon('toy', root, verify = True)
+    # no dense semantic matrix is built from the embeddings
+    assert 'semantic' not in manifest['files'] and isinstance(lexicon.sim_matrix, LowRankSimilarity)
+    normalized = embeddings.T / np.linalg.norm(embeddings.T, axis = 1, keepdims = True)
+    cosine = normalized @ normalized.T
+    assert np.allclose(lexicon.sim_matrix, np.where(cosine <= 0, .0001, cosine), atol = 1e-6)
+    assert np.allclose(lexicon.phon_matrix, phon_matrix) and np.allclose(lexicon.freq_matrix, frequencies)
+
+    # imported embeddings are read from their store, not from the CSV
+    store = EmbeddingStore.from_csv(os.path.join(lexical_path, 'semantic_embeddings.csv'))
+    EmbeddingStore.save(store.path, labels, np.eye(5, 8))
+    build_lexicon('toy', root)
+    assert np.allclose(load_lexicon('toy', root).sim_matrix, np.where(np.eye(5) > 0, 1, .0001))
+
+    # file names given on the command line replace the resolved ones
+    os.rename(os.path.join(lexical_path, 'frequencies.csv'), os.path.join(lexical_path, 'counts.csv'))
+    with pytest.raises(Exception):
+        build_lexicon('toy', root)
+    main(['toy', '--root', root, '--frequencies', 'counts.csv'])
+    assert list(load_lexicon('toy', root, verify = True).labels) == labels
+
+def test_build_on_demand(root, monkeypatch):
+    # a domain without a phonological matrix stores the encoded pronunciations (and the top-k matrix) instead
+    sources = source_paths('toy', root)
+    os.remove(sources['phonological'])
+    arpabet = {'ant': [['AE1', 'N', 'T']], 'bee': [['B', 'IY1']], 'cat': [['K', 'AE1', 'T']], 'dog': [['D', 'AO1', 'G']],
+               'eel': [['IY1', 'L']]}
+    PackedArpabet.save(arpabet_path(root), arpabet)
+    monkeypatch.setattr(cues, 'pronunciations', PronunciationStore())
+    phonology_funcs.wordbreak.cache_clear()
+
+    manifest = build_lexicon('toy', root)
+    assert 'phonological' not in manifest['files'] and 'phonemes' in manifest['files']
+    expected = phonology_funcs.create_phonological_similarity(labels)
+    lexicon = pickle.loads(pickle.dumps(load_lexicon('toy', root, verify = True)))
+    assert isinstance(lexicon.phon_matrix, PhonologicalSimilarity)
+    assert np.array_equal(np.array(lexicon.phon_matrix), np.array(expected))
+
+    expected.build_topk(2, workers = 1)
+    expected.save_topk(source_paths('toy', root)['phonological_topk'])
+    manifest = build_lexicon('toy', root)
+    assert 'phonological_topk' in manifest['sources'] and 'topk_data' in manifest['files']
+    lexicon = load_lexicon('toy', root, dtype = np.float32)
+    assert lexicon.phon_matrix.topk is not None and lexicon.phon_matrix[1].dtype == np.float32
+    assert np.allclose(np.array(lexicon.phon_matrix), np.array(expected))
+    phonology_funcs.wordbreak.cache_clear()
@@ -0,0 +1,57 @@
+import os
+import pytest
+import numpy as np
+import pandas as pd
+from forager.embedding_store import EmbeddingStore, open_embeddings, main
+from forager.cues import create_semantic_matrix
+
+'''
+Imports a toy DxN embeddings CSV into a binary embedding store and checks that the memory-mapped store holds the
+same words and vectors, and exports them back. Opening a CSV that was not imported parses it without writing.
+'''
+
+rng = np.random.default_rng(0)
+words = ['ant', 'bee', 'sea lion', 'dog', 'eel']
+vectors = rng.normal(size = (5, 8)).astype(np.float32)
+
+@pytest.fixture
+def csv(tmp_path):
+    path = str(tmp_path / 'USE_embeddings.csv')
+    pd.DataFrame(vectors.T, columns = words).to_csv(path, index = False)
+    return path
+
+def test_import_export(csv, tmp_path):
+    main([csv])
+    store = open_embeddings(csv)
+    assert store.path == csv[:-4] and EmbeddingStore.exists(store.path)
+    # the vocabulary is listed without opening the vectors
+    reopened = EmbeddingStore(store.path)
+    assert reopened.words == words and reopened._vectors is None
+    assert isinstance(reopened.vectors, np.memmap) and reopened.vectors.dtype == np.float32
+    assert np.array_equal(reopened.vectors, vectors) and np.array_equal(reopened['dog'], vectors[3])
+    assert np.array_equal(reopened.get(['eel', 'ant']), vectors[[4, 0]]) and 'sea lion' in reopened and 'cat' not in reopened
+
+    # the store is reused until the contents of the CSV change, then the CSV is read instead
+    os.utime(csv, (0, 0))
+    assert open_embeddings(csv).path == store.path
+    pd.DataFrame(2 * vectors.T, columns = words).to_csv(csv, index = False)
+    with pytest.warns(UserWarning):
+        changed = open_embeddings(csv)
+    assert changed.path is None and np.allclose(changed['dog'], 2 * vectors[3])
+    exported = str(tmp_path / 'exported.csv')
+    reopened.to_csv(exported)
+    assert np.array_equal(EmbeddingStore.from_csv(exported, str(tmp_path / 'copy')).vectors, vectors)
+    with pytest.raises(Exception):
+        EmbeddingStore.save(str(tmp_path / 'bad'), words, vectors[:3])
+
+def test_open_without_import(csv, tmp_path):
+    store = open_embeddings(csv)
+    assert store.path is None and store.words == words and np.allclose(store.get(['eel', 'ant']), vectors[[4, 0]])
+    assert os.listdir(str(tmp_path)) == ['USE_embeddings.csv']
+    with pytest.raises(Exception):
+        open_embeddings(csv[:-4])
+
+def test_semantic_matrix_from_store(csv):
+    store = EmbeddingStore.from_csv(csv)
+    normalized = vectors / np.linalg.norm(vectors.astype(np.float64), axis = 1, keepdims = True)
+    assert np.allclose(create_semantic_matrix(store.path), normalized @ normalized.T, atol = 1e-6)
@@ -0,0 +1,85 @@
+import pickle
+import pytest
+import numpy as np
+import pandas as pd
+from forager.lexical import LexicalSpace
+from forager.transitions import TransitionTable
+from forager.cues import create_history_variables, phonology_funcs
+
+'''
+Checks that a LexicalSpace clamps its matrices once, stays read-only and yields the same cue histories as
+create_history_variables on the raw matrices, computing the phonological rows of corrected words once, and that
+histories detached from the matrices are reattached unchanged.
+'''
+
+rng = np.random.default_rng(0)
+labels = ['ant', 'bee', 'cat', 'dog', 'eel']
+sim_matrix = rng.uniform(-0.5, 1, (5, 5))
+phon_matrix = rng.uniform(-0.5, 1, (5, 5))
+freq_matrix = rng.uniform(1, 5, 5)
+corrections_df = pd.DataFrame({'SID': [], 'entry': [], 'final_word': []})
+
+def test_clamped_once_and_read_only():
+    lexicon = LexicalSpace(labels, sim_matrix.copy(), freq_matrix.copy(), phon_matrix.copy())
+    assert lexicon.sim_matrix.min() > 0 and lexicon.phon_matrix.min() > 0
+    assert np.array_equal(lexicon.sim_matrix, np.where(sim_matrix <= 0, .0001, sim_matrix))
+    with pytest.raises(ValueError):
+        lexicon.sim_matrix[0, 0] = 1
+    # read-only inputs are clamped in a copy
+    frozen = sim_matrix.copy()
+    frozen.setflags(write = False)
+    assert LexicalSpace(labels, frozen, freq_matrix).sim_matrix.min() > 0 and frozen.min() <= 0
+    assert not pickle.loads(pickle.dumps(lexicon)).sim_matrix.flags.writeable
+
+def test_history_variables():
+    lexicon = LexicalSpace(labels, sim_matrix.copy(), freq_matrix.copy(), phon_matrix.copy())
+    fluency_list = ['dog', 'ant', 'eel', 'bee']
+    history = lexicon.history_variables(fluency_list, 1, corrections_df)
+    expected = create_history_variables(fluency_list, 1, corrections_df, labels, sim_matrix.copy(), freq_matrix, phon_matrix.copy())
+    for value, expected_value in zip(history, expected):
+        assert np.array_equal(np.array(value), np.array(expected_value))
+
+def test_phonological_rows_of_corrections(monkeypatch):
+    # spell out words letter by letter instead of looking up their CMU pronunciations
+    monkeypatch.setattr(phonology_funcs, 'wordbreak', lambda s: [list(s.lower())])
+    lexicon = LexicalSpace(labels, sim_matrix.copy(), freq_matrix.copy(), phon_matrix.copy())
+    corrections = pd.DataFrame({'SID': [1], 'entry': ['kat'], 'final_word': ['cat']})
+    fluency_list = ['dog', 'cat', 'eel', 'cat', 'ant']
+    for subject in [1, 1]:
+        history = lexicon.history_variables(fluency_list, subject, corrections)
+    assert lexicon.phon_cache.misses == 2 and lexicon.phon_cache.hits == 2
+
+    expected = [phonology_funcs.normalized_edit_distance(list('eel'), list(label)) for label in labels]
+    assert np.allclose(history.phon_history[3], expected) and np.allclose(np.array(history.phon_history)[3], expected)
+    assert history.phon_list[3] == phonology_funcs.normalized_edit_distance(list('eel'), list('kat'))
+    assert np.array_equal(history.phon_history[4], lexicon.phon_matrix[2])
+
+def test_transition_table(monkeypatch):
+    monkeypatch.setattr(phonology_funcs, 'wordbreak', lambda s: [list(s.lower())])
+    lexicon = LexicalSpace(labels, sim_matrix.copy(), freq_matrix.copy(), phon_matrix.copy())
+    corrections = pd.DataFrame({'SID': [2], 'entry': ['kat'], 'final_word': ['cat']})
+    data = [(1, ['dog', 'cat', 'eel']), (2, ['bee', 'cat', 'ant', 'cat']), (3, ['eel'])]
+    table = TransitionTable(lexicon, data, corrections)
+    lexical_results = table.lexical_results()
+    assert lexical_results['Subject'].tolist() == [1, 1, 1, 2, 2, 2, 2, 3] and table.position.tolist() == [0, 1, 2, 0, 1, 2, 3, 0]
+
+    for k, (subj, fl_list) in enumerate(data):
+        expected = lexicon.history_variables(fl_list, subj, corrections)
+        rows = lexical_results[lexical_results['Subject'] == subj]
+        assert np.array_equal(rows['Semantic_Similarity'], expected[0]) and np.array_equal(rows['Frequency_Value'], expected[2])
+        assert np.array_equal(rows['Phonological_Similarity'], expected[4])
+        for value, expected_value in zip(table.history(k), expected):
+            assert np.array_equal(np.array(value), np.array(expected_value))
+
+def test_detached_history(monkeypatch):
+    # histories sent to worker processes carry row ids and override rows, not the matrices
+    monkeypatch.setattr(phonology_funcs, 'wordbreak', lambda s: [list(s.lower())])
+    lexicon = LexicalSpace(labels, sim_matrix.copy(), freq_matrix.copy(), phon_matrix.copy())
+    corrections = pd.DataFrame({'SID': [1], 'entry': ['kat'], 'final_word': ['cat']})
+    history = TransitionTable(lexicon, [(1, ['dog', 'cat', 'eel', 'ant'])], corrections).history(0)
+    detached = pickle.loads(pickle.dumps(history.detach()))
+    assert detached.sim_history.matrix is None and detached.phon_history.matrix is None
+    assert len(history.phon_history.overrides) > 0 and detached.phon_history.overrides.keys() == history.phon_history.overrides.keys()
+    attached = detached.attach(lexicon.sim_matrix, lexicon.freq_matrix, lexicon.phon_matrix)
+    for value, expected_value in zip(attached, history):
+        assert np.array_equal(np.array(value), np.array(expected_value))
@@ -0,0 +1,214 @@
+import pytest
+import numpy as np
+from forager.foraging import forage
+from forager.likelihood import CueStack, PopulationStack, RowDenominatorCache
+
+'''
+Checks the vectorized likelihood engine against the original position-by-position foraging loop, on a toy
+lexicon so that no lexical data files are required.
+'''
+
+rng = np.random.default_rng(0)
+N, L = 40, 12
+freq_matrix = rng.uniform(0.5, 6, N)
+sim_matrix = rng.uniform(0.0001, 1, (N, N))
+phon_matrix = rng.uniform(0.0001, 1, (N, N))
+ids = rng.choice(N, L, replace = False)
+
+freql = [freq_matrix[i] for i in ids]
+freqh = [freq_matrix for i in ids]
+siml = [0.0001] + [sim_matrix[ids[k-1], ids[k]] for k in range(1, L)]
+simh = [sim_matrix[ids[0]]] + [sim_matrix[ids[k-1]] for k in range(1, L)]
+phonl = [0.0001] + [phon_matrix[ids[k-1], ids[k]] for k in range(1, L)]
+phonh = [phon_matrix[ids[0]]] + [phon_matrix[ids[k-1]] for k in range(1, L)]
+switchvals = [2] + list(rng.integers(0, 2, L - 2)) + [2]
+
+
+def loop_nll(beta, switchvals = None, phoncue = None):
+    # original implementation of the foraging models, one position at a time
+    ct = 0
+    for k in range(L):
+        f = pow(freql[k], beta[0])
+        fh = pow(freqh[k], beta[0])
+        s, sh = pow(siml[k], beta[1]), pow(simh[k], beta[1])
+        p, ph = (pow(phonl[k], beta[2]), pow(phonh[k], beta[2])) if len(beta) > 2 else (1, 1)
+        switch = switchvals is not None and switchvals[k] == 1
+        if k == 0 or (switch and phoncue in [None, 'local']):
+            numrat, denrat = f, sum(fh)
+        elif switch:
+            numrat, denrat = f * p, sum(fh * ph)
+        elif phoncue == 'switch':
+            numrat, denrat = f * s, sum(fh * sh)
+        else:
+            numrat, denrat = f * s * p, sum(fh * sh * ph)
+        ct += - np.log(numrat/denrat)
+    return ct
+
+@pytest.mark.parametrize("beta", [[0, 0], [0.7, 1.3], [-1.2, 4.5]])
+def test_static_and_dynamic(beta):
+    assert forage.model_static(beta, freql, freqh, siml, simh) == pytest.approx(loop_nll(beta))
+    assert forage.model_dynamic(beta, freql, freqh, siml, simh, switchvals) == pytest.approx(loop_nll(beta, switchvals))
+
+@pytest.mark.parametrize("beta", [[0, 0, 0], [0.7, 1.3, 2.1]])
+def test_phonological_models(beta):
+    assert forage.model_static_phon(beta, freql, freqh, siml, simh, phonl, phonh) == pytest.approx(loop_nll(beta, None, 'global'))
+    for phoncue in ['global', 'local', 'switch']:
+        nll = forage.model_dynamic_phon(beta, freql, freqh, siml, simh, phonl, phonh, switchvals, phoncue)
+        assert nll == pytest.approx(loop_nll(beta, switchvals, phoncue))
+
+def test_invalid_phoncue():
+    with pytest.raises(Exception):
+        forage.model_dynamic_phon([1, 1, 1], freql, freqh, siml, simh, phonl, phonh, switchvals, 'none')
+
+def test_zero_cue_with_zero_beta():
+    # a zero phonological similarity has no effect when its beta is zero, as with pow(0, 0) == 1
+    zero_phonh = [np.where(np.arange(N) == 3, 0, row) for row in phonh]
+    stack = CueStack(freql, freqh, siml, simh, phonl, zero_phonh)
+    assert np.isfinite(stack.nll([0.5, 0.5, 0], stack.terms('pstatic')))
+
+@pytest.mark.parametrize("model, beta", [('static', [0.7, 1.3]), ('dynamic', [0.7, 1.3]), ('pdynamic', [0.4, 1.1, 2.0])])
+def test_gradient_and_hessian(model, beta):
+    stack = CueStack(freql, freqh, siml, simh, phonl, phonh)
+    active = stack.terms(model, switchvals, 'global')
+    nll, grad = stack.nll_and_grad(beta, active)
+    assert nll == pytest.approx(stack.nll(beta, active))
+
+    eps = 1e-6
+    for c in range(len(beta)):
+        step = np.eye(len(beta))[c] * eps
+        fd = (stack.nll(beta + step, active) - stack.nll(beta - step, active)) / (2 * eps)
+        assert grad[c] == pytest.approx(fd, rel = 1e-5, abs = 1e-6)
+        fd_grad = (stack.nll_and_grad(beta + step, active)[1] - stack.nll_and_grad(beta - step, active)[1]) / (2 * eps)
+        assert stack.hessian(beta, active)[c] == pytest.approx(fd_grad, rel = 1e-4, abs = 1e-5)
+
+def test_fit():
+    stack = CueStack(freql, freqh, siml, simh)
+    active = stack.terms('dynamic', switchvals)
+    res = stack.fit([0, 0], active)
+    newton = stack.fit([0, 0], active, method = 'trust-exact')
+    assert res.success and newton.success
+    assert np.allclose(res.x, newton.x, atol = 1e-3)
+    assert np.allclose(stack.nll_and_grad(res.x, active)[1], 0, atol = 1e-3)
+
+def test_population_stack():
+    # the second subject produces the first half of the list, so the batch holds lists of different lengths
+    stacks = [CueStack(freql, freqh, siml, simh), CueStack(freql[:6], freqh[:6], siml[:6], simh[:6])]
+    vecs = [switchvals, switchvals[:6]]
+    population = PopulationStack(stacks)
+    active = population.terms('dynamic', vecs)
+    beta = [0.7, 1.3]
+
+    nll, grad = population.nll_and_grad(beta, active)
+    singles = [stack.nll_and_grad(beta, stack.terms('dynamic', vec)) for stack, vec in zip(stacks, vecs)]
+    assert nll == pytest.approx(sum(single[0] for single in singles))
+    assert np.allclose(grad, sum(single[1] for single in singles))
+
+    res = population.fit([0, 0], active, hierarchical = True, sigma = 0.5)
+    assert res.success and res.subject_betas.shape == (2, 2)
+
+def test_nll_surface():
+    stack = CueStack(freql, freqh, siml, simh, phonl, phonh)
+    active = stack.terms('pdynamic', switchvals, 'local')
+    axes = [np.linspace(-1, 1, 3), np.linspace(0, 2, 4), np.linspace(-1, 1, 2)]
+    # a tiny memory budget forces one grid point per chunk
+    surface = stack.nll_surface(axes, active, max_bytes = 1)
+    assert surface.shape == (3, 4, 2)
+    for i, j, k in np.ndindex(surface.shape):
+        assert surface[i, j, k] == pytest.approx(stack.nll([axes[0][i], axes[1][j], axes[2][k]], active))
+    assert stack.nll(stack.grid_start(axes, active), active) == pytest.approx(surface.min())
+
+def test_report():
+    beta = [0.4, 1.1, 2.0]
+    ct, nll_vec = forage.model_dynamic_phon_report(beta, freql, freqh, siml, simh, phonl, phonh, switchvals, 'switch')
+    assert ct == pytest.approx(loop_nll(beta, switchvals, 'switch')) and ct == pytest.approx(sum(nll_vec))
+
+    stack = CueStack(freql, freqh, siml, simh)
+    active = stack.terms('static')
+    _, nll_vec, prob, rank = stack.report(beta[:2], active)
+    U, _ = stack.utilities(beta[:2], active)
+    assert np.allclose(prob, np.exp(-nll_vec))
+    # rank of the produced item in the full sort of each row
+    order = np.argsort(-U, axis = 1, kind = 'stable')
+    assert np.array_equal(rank, [list(row).index(i) + 1 for row, i in zip(order, ids)])
+
+def test_nll_switches():
+    stack = CueStack(freql, freqh, siml, simh, phonl, phonh)
+    vecs = [switchvals, [2] * L, [2] + [1] * (L - 1)] + [[2] + list(rng.integers(0, 2, L - 1)) for i in range(5)]
+    for model, beta, phoncue in [('dynamic', [0.7, 1.3], None), ('pdynamic', [0.4, 1.1, 2.0], 'global'), ('pdynamic', [0.4, 1.1, 2.0], 'switch')]:
+        nll = stack.nll_switches(beta, vecs, model, phoncue)
+        assert np.allclose(nll, [stack.nll(beta, stack.terms(model, vec, phoncue)) for vec in vecs])
+
+def test_without_replacement():
+    # the item at position 2 is repeated at the end of the list
+    produced = list(ids) + [ids[2]]
+    lists = [freql + [freql[2]], freqh + [freq_matrix], siml + [sim_matrix[ids[-1], ids[2]]], simh + [sim_matrix[ids[-1]]]]
+    stack = CueStack(*lists, produced = produced, replacement = False)
+    beta = [0.7, 1.3]
+
+    expected = 0
+    for k in range(L + 1):
+        keep = np.ones(N, dtype = bool)
+        keep[[i for i in produced[:k] if i != produced[k]]] = False
+        s, sh = (pow(lists[2][k], beta[1]), pow(lists[3][k], beta[1])) if k > 0 else (1, 1)
+        numrat = pow(lists[0][k], beta[0]) * s
+        denrat = sum((pow(lists[1][k], beta[0]) * sh)[keep])
+        expected += - np.log(numrat/denrat)
+
+    active = stack.terms('static')
+    assert stack.nll(beta, active) == pytest.approx(expected)
+    assert stack.nll_grid([beta], active)[0] == pytest.approx(expected)
+    assert PopulationStack([stack]).nll_and_grad(beta, PopulationStack([stack]).terms('static'))[0] == pytest.approx(expected)
+    with pytest.raises(Exception):
+        CueStack(freql, freqh, siml, simh, replacement = False)
+
+def test_row_denominator_cache():
+    # two lists that share their transitions, so half of the rows are reused
+    stacks = [CueStack(freql, freqh, siml, simh, phonl, phonh, produced = ids) for i in range(2)]
+    population = PopulationStack(stacks)
+    cache = RowDenominatorCache(freq_matrix, sim_matrix, phon_matrix, maxsize = 8)
+    for model, beta in [('dynamic', [0.7, 1.3]), ('pdynamic', [0.4, 1.1, 2.0])]:
+        active = population.terms(model, [switchvals, switchvals], 'global')
+        nll, grad = population.nll_and_grad(beta, active)
+        cached_nll, cached_grad = population.nll_and_grad(beta, active, cache)
+        assert cached_nll == pytest.approx(nll) and np.allclose(cached_grad, grad)
+        assert population.nll_grid([beta, beta], active, cache) == pytest.approx([nll, nll])
+    assert cache.hits > 0 and len(cache._rows) <= 8
+
+def test_float32():
+    # single precision agrees with the float64 path to within 1e-6 relative error
+    stack64 = CueStack(freql, freqh, siml, simh, phonl, phonh)
+    stack32 = CueStack(freql, freqh, siml, simh, phonl, phonh, dtype = np.float32)
+    assert stack32.log_h.dtype == np.float32
+    for model, beta in [('static', [0.7, 1.3]), ('pdynamic', [0.4, 1.1, 2.0])]:
+        active = stack64.terms(model, switchvals, 'local')
+        assert stack32.nll(beta, active) == pytest.approx(stack64.nll(beta, active), rel = 1e-6)
+        assert stack32.nll_grid([beta], active)[0] == pytest.approx(stack64.nll(beta, active), rel = 1e-6)
+        assert np.allclose(stack32.nll_and_grad(beta, active)[1], stack64.nll_and_grad(beta, active)[1], rtol = 1e-4)
+
+def test_from_history():
+    # a compact CueHistory stacks to the same arrays as the lists of rows
+    from forager.cues import HistoryRows, CueHistory
+    prev_ids = np.concatenate([ids[:1], ids[:-1]])
+    history = CueHistory(ids, prev_ids, np.array(siml), HistoryRows(sim_matrix, prev_ids), np.array(freql), HistoryRows(freq_matrix, ids),
+                         np.array(phonl), HistoryRows(phon_matrix, prev_ids, {3: phonh[3] * 0.5}))
+    stack = CueStack.from_history(history)
+    expected = CueStack(freql, freqh, siml, simh, phonl, [row * 0.5 if k == 3 else row for k, row in enumerate(phonh)], produced = ids)
+    assert np.array_equal(stack.log_h, expected.log_h) and np.array_equal(stack.log_l, expected.log_l)
+    assert np.array_equal(stack.produced, ids)
+
+def test_row_denominator_cache_overrides():
+    # a corrected item takes an override phonological row, which the cache must not replace by the matrix row
+    from forager.cues import HistoryRows, CueHistory
+    prev_ids = np.concatenate([ids[:1], ids[:-1]])
+    history = CueHistory(ids, prev_ids, np.array(siml), HistoryRows(sim_matrix, prev_ids), np.array(freql), HistoryRows(freq_matrix, ids),
+                         np.array(phonl), HistoryRows(phon_matrix, prev_ids, {3: phonh[3] * 0.5}))
+    stack = CueStack.from_history(history)
+    assert stack.overridden.tolist() == [k == 3 for k in range(L)]
+    population = PopulationStack([stack, CueStack.from_history(history)])
+    cache = RowDenominatorCache(freq_matrix, sim_matrix, phon_matrix)
+    for model, beta in [('pstatic', [0.4, 1.1, 2.0]), ('pdynamic', [0.7, 1.3, 0.5])]:
+        active = population.terms(model, [switchvals, switchvals], 'global')
+        nll, grad = population.nll_and_grad(beta, active)
+        cached_nll, cached_grad = population.nll_and_grad(beta, active, cache)
+        assert cached_nll == pytest.approx(nll) and np.allclose(cached_grad, grad)
+        assert cached_nll == pytest.approx(2 * stack.nll(beta, stack.terms(model, switchvals, 'global')))
@@ -0,0 +1,114 @@
+import pytest
+import numpy as np
+from itertools import product as iterprod
+from forager import cues
+from forager.cues import phonology_funcs, PronunciationStore, PackedArpabet
+from forager.phonology import PhonemeCodes, PhonologicalSimilarity, similarity_matrix
+
+'''
+Checks the segmentation of words into pronunciations against the original recursive search, on a toy arpabet
+dictionary so that the NLTK CMU dictionary is not required.
+'''
+
+arpabet = {'sea': [['S', 'IY1']], 'lion': [['L', 'AY1', 'AH0', 'N']], 'horse': [['HH', 'AO1', 'R', 'S']],
+           'sea horse': [['S', 'IY1', 'HH', 'AO1', 'R', 'S']], 'cat': [['K', 'AE1', 'T']], 'fish': [['F', 'IH1', 'SH']],
+           'catfish': [['K', 'AE1', 'T', 'F', 'IH2', 'SH']], 'a': [['AH0'], ['EY1']], 'an': [['AE1', 'N'], ['AH0', 'N']],
+           't': [['T']], 'ant': [['AE1', 'N', 'T']], 'eater': [['IY1', 'T', 'ER0']], 'eat': [['IY1', 'T']], 'er': [['ER0']]}
+
+def original_wordbreak(s):
+    s = s.lower()
+    if s in arpabet:
+        return arpabet[s]
+    middle = len(s)/2
+    partition = sorted(list(range(len(s))), key=lambda x: (x-middle)**2-x)
+    for i in partition:
+        pre, suf = (s[:i], s[i:])
+        if pre in arpabet and original_wordbreak(suf) is not None:
+            return [x+y for x,y in iterprod(arpabet[pre], original_wordbreak(suf))]
+    return None
+
+@pytest.fixture
+def store(monkeypatch):
+    monkeypatch.setattr(cues, 'pronunciations', PronunciationStore(arpabet = arpabet))
+    phonology_funcs.wordbreak.cache_clear()
+    yield
+    phonology_funcs.wordbreak.cache_clear()
+
+@pytest.mark.parametrize("word", ['Cat', 'sealion', 'anteater', 'catfishhorse', 'aaant', 'seahorsecat', 'zebra', 'antz'])
+def test_wordbreak(store, word):
+    assert phonology_funcs.wordbreak(word) == original_wordbreak(word)
+
+def test_packed_arpabet(tmp_path):
+    path = str(tmp_path / 'arpabet.npz')
+    PackedArpabet.save(path, arpabet)
+    packed = PronunciationStore(path).arpabet
+    assert isinstance(packed, PackedArpabet)
+    assert all(packed[word] == arpabet[word] for word in arpabet) and 'zebra' not in packed
+
+def test_arpabet_written_only_on_build(tmp_path, monkeypatch):
+    monkeypatch.setattr(cues, 'cmudict', lambda: arpabet)
+    monkeypatch.setattr(cues, 'pronunciations', PronunciationStore())
+    path = str(tmp_path / 'arpabet.npz')
+    # a missing binary file is not written on lookup, the dictionary is read in memory
+    assert phonology_funcs.load_arpabet(path).arpabet is arpabet and list(tmp_path.iterdir()) == []
+    assert isinstance(phonology_funcs.build_arpabet(path).arpabet, PackedArpabet)
+    assert phonology_funcs.wordbreak('catfish') == arpabet['catfish']
+    phonology_funcs.wordbreak.cache_clear()
+
+def test_similarity_matrix():
+    # random pronunciations of 1 to 9 phonemes over a small alphabet, so that many pairs share phonemes
+    rng = np.random.default_rng(0)
+    pronunciations = [list(rng.choice(['AA', 'B', 'K', 'IY1', 'T'], rng.integers(1, 10))) for i in range(40)]
+    phonemes = PhonemeCodes(pronunciations)
+    expected = np.array([[phonology_funcs.normalized_edit_distance(p, q) if i != j else 1 for j, q in enumerate(pronunciations)] for i, p in enumerate(pronunciations)])
+    for workers in [1, 2]:
+        # a tiny block size spreads the lower triangle over many chunks
+        assert np.array_equal(similarity_matrix(phonemes, workers, max_pairs = 50), expected)
+
+def test_create_phonological_matrix(store):
+    labels = ['cat', 'sea lion', 'anteater', 'catfish', 'horse']
+    sim = phonology_funcs.create_phonological_matrix(labels, workers = 1)
+    for i, j in np.ndindex(sim.shape):
+        if i != j:
+            assert sim[i, j] == phonology_funcs.normalized_edit_distance(original_wordbreak(labels[i].replace(' ', ''))[0], original_wordbreak(labels[j].replace(' ', ''))[0])
+
+def test_phonological_similarity(tmp_path):
+    rng = np.random.default_rng(1)
+    pronunciations = [list(rng.choice(['AA', 'B', 'K', 'IY1', 'T'], rng.integers(1, 10))) for i in range(30)]
+    phonemes = PhonemeCodes(pronunciations)
+    dense = similarity_matrix(phonemes, workers = 1)
+    dense[dense <= 0] = .0001
+    sim = PhonologicalSimilarity(phonemes, maxsize = 4)
+    ids = np.array([3, 0, 3, 29])
+    assert np.array_equal(sim[ids], dense[ids]) and np.array_equal(sim[5, :], dense[5])
+    assert np.array_equal(sim[ids[1:], ids[:-1]], dense[ids[1:], ids[:-1]]) and sim[2, 7] == dense[2, 7]
+    assert np.array_equal(np.asarray(sim), dense) and len(sim._rows) == 4
+
+    # rows of the top-k matrix keep the k largest similarities and take the floor elsewhere
+    k = 5
+    sim.build_topk(k, workers = 1)
+    path = str(tmp_path / 'topk.npz')
+    sim.save_topk(path)
+    loaded = PhonologicalSimilarity(phonemes)
+    loaded.load_topk(path)
+    for i in range(len(pronunciations)):
+        row = loaded[i]
+        kept = row > .0001
+        assert kept.sum() <= k and np.array_equal(row[kept], dense[i][kept])
+        assert np.sort(dense[i])[-k] <= row.max() and np.sort(row)[-k:].tolist() == np.sort(dense[i])[-k:].tolist()
+    assert np.array_equal(loaded[ids[1:], ids[:-1]], np.array([loaded[i][j] for i, j in zip(ids[1:], ids[:-1])]))
+
+def test_on_demand_history(store, monkeypatch):
+    from forager.lexical import LexicalSpace
+    from forager.likelihood import CueStack
+    import pandas as pd
+    labels = ['cat', 'sea lion', 'anteater', 'catfish', 'horse']
+    sim = np.random.default_rng(2).random((5, 5))
+    freq = np.arange(1, 6, dtype = float)
+    dense = LexicalSpace(labels, sim, freq, phonology_funcs.create_phonological_matrix(labels, workers = 1))
+    on_demand = LexicalSpace(labels, sim, freq, phonology_funcs.create_phonological_similarity(labels))
+    corrections = pd.DataFrame({'SID': [], 'entry': [], 'final_word': []})
+    fluency_list = ['horse', 'cat', 'catfish', 'sea lion']
+    expected = CueStack.from_history(dense.history_variables(fluency_list, 1, corrections))
+    stack = CueStack.from_history(on_demand.history_variables(fluency_list, 1, corrections))
+    assert np.allclose(stack.log_h, expected.log_h) and np.allclose(stack.log_l, expected.log_l)
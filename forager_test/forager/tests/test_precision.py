@@ -0,0 +1,60 @@
+import os
+import numpy as np
+import pandas as pd
+from forager.bundle import source_paths
+from forager.lexical import LexicalSpace
+from forager.semantic import similarity_matrix
+from forager.likelihood import CueStack, phoncues
+from forager.switch import switch_simdrop
+
+'''
+Fits every model to the 60 reed_occupations lists (occupations lexicon) in float64 and in float32, and checks how
+far the single precision fits are from the double precision ones. Out-of-vocabulary items are excluded from the
+lists, as with the 'e' choice of prepareData.
+
+Measured: the optimized negative log-likelihoods agree to within 1.2e-7 relative error, and the fitted betas to
+within 4.3e-3 (absolute, largest on Beta_Frequency).
+'''
+
+data_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data')
+
+def load_occupations(dtype):
+    sources = source_paths('occupations', data_path)
+    frequencies = pd.read_csv(sources['frequencies'], header = None, encoding = "unicode-escape")
+    labels = frequencies[0].astype(str).tolist()
+    embeddings = pd.read_csv(sources['embeddings'], encoding = "unicode-escape")
+    # the semantic matrix is computed in float64 and rounded, as a float32 bundle stores it
+    sim_matrix = similarity_matrix(embeddings[labels].transpose().values, dtype = np.float64).astype(dtype)
+    phon_matrix = np.loadtxt(sources['phonological'], delimiter = ',', dtype = dtype)
+    return LexicalSpace(labels, sim_matrix, np.asarray(frequencies[1], dtype = dtype), phon_matrix, domain = 'occupations')
+
+def fit_lists(lexicon, lists):
+    # betas (NaN-padded to 3) and optimized negative log-likelihood of every model fit of every list
+    corrections_df = pd.DataFrame(columns = ['SID', 'entry', 'final_word'])
+    results = []
+    for subj, fl_list in lists:
+        history = lexicon.history_variables(fl_list, subj, corrections_df)
+        stack = CueStack.from_history(history, True, lexicon.dtype)
+        switch_vec = switch_simdrop(fl_list, history.sim_list)
+        fits = [(2, stack.terms('static')), (2, stack.terms('dynamic', switch_vec)), (3, stack.terms('pstatic'))]
+        fits += [(3, stack.terms('pdynamic', switch_vec, cue)) for cue in phoncues]
+        for n_betas, active in fits:
+            res = stack.fit(np.zeros(n_betas), active)
+            results.append(np.concatenate([res.x, np.full(3 - n_betas, np.nan), [res.fun]]))
+    return np.array(results)
+
+def test_float32_fits():
+    lexicon64 = load_occupations(np.float64)
+    lexicon32 = load_occupations(np.float32)
+    assert lexicon32.dtype == np.float32
+
+    data = pd.read_csv(os.path.join(data_path, 'fluency_lists', 'reed_occupations.txt'), sep = '\t', header = None, names = ['SID', 'entry'])
+    lists = [(subj, [word for word in group['entry'] if word in lexicon64.labels]) for subj, group in data.groupby('SID', sort = True)]
+    assert len(lists) == 60
+
+    fits64 = fit_lists(lexicon64, lists)
+    fits32 = fit_lists(lexicon32, lists)
+    nll_error = np.abs(fits32[:, 3] - fits64[:, 3]) / fits64[:, 3]
+    beta_error = np.nanmax(np.abs(fits32[:, :3] - fits64[:, :3]))
+    assert nll_error.max() < 5e-7
+    assert beta_error < 1e-2
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import scipy.spatial
+from forager.cues import create_semantic_matrix
+from forager.semantic import similarity_matrix
+
+'''
+Checks the blocked cosine similarity matrix against scipy's cdist, in memory and streamed to a memory-mapped file.
+'''
+
+rng = np.random.default_rng(0)
+embeddings = rng.normal(size = (50, 16))
+expected = 1 - scipy.spatial.distance.cdist(embeddings, embeddings, 'cosine')
+
+def test_similarity_matrix(tmp_path):
+    for dtype, tolerance in [(np.float64, 1e-12), (np.float32, 1e-6)]:
+        # a tiny block size spreads the rows over many blocks
+        sim = similarity_matrix(embeddings, dtype = dtype, max_entries = 120)
+        assert sim.dtype == dtype and np.allclose(sim, expected, atol = tolerance) and np.all(np.diag(sim) == 1)
+    path = str(tmp_path / 'semantic.npy')
+    similarity_matrix(embeddings, path, max_entries = 120)
+    mapped = np.load(path, mmap_mode = 'r')
+    assert mapped.dtype == np.float32 and np.allclose(mapped, expected, atol = 1e-6)
+
+def test_create_semantic_matrix(tmp_path):
+    words = ['w' + str(i) for i in range(len(embeddings))]
+    path = str(tmp_path / 'embeddings.csv')
+    pd.DataFrame(embeddings.T, columns = words).to_csv(path, index = False)
+    zero = np.zeros((1, 16))
+    assert np.allclose(create_semantic_matrix(path), expected, atol = 1e-6)
+    assert np.array_equal(similarity_matrix(np.vstack([embeddings[:2], zero]))[2], [0, 0, 0])
+
+def test_low_rank_similarity():
+    from forager.semantic import LowRankSimilarity
+    from forager.lexical import LexicalSpace
+    from forager.likelihood import CueStack
+    sim = LowRankSimilarity(embeddings[:40])
+    dense = similarity_matrix(embeddings[:40], dtype = np.float64)
+    dense[dense <= 0] = .0001
+    ids = np.array([3, 0, 3, 39])
+    assert np.allclose(sim[ids], dense[ids]) and np.allclose(sim[5, :], dense[5]) and np.allclose(np.asarray(sim), dense)
+    assert np.allclose(sim[ids[1:], ids[:-1]], dense[ids[1:], ids[:-1]]) and sim[2, 2] == 1
+    # new words are appended without rebuilding the existing rows
+    assert np.array_equal(sim.extend(embeddings[40:]), np.arange(40, 50)) and sim.shape == (50, 50)
+    assert np.allclose(np.asarray(sim), np.maximum(expected, .0001), atol = 1e-12)
+
+    labels = ['w' + str(i) for i in range(50)]
+    freq = np.arange(1, 51, dtype = float)
+    corrections = pd.DataFrame({'SID': [], 'entry': [], 'final_word': []})
+    fluency_list = ['w4', 'w17', 'w4', 'w42', 'w0']
+    histories = [LexicalSpace(labels, matrix, freq).history_variables(fluency_list, 1, corrections) for matrix in [sim, np.asarray(sim)]]
+    stacks = [CueStack.from_history(history) for history in histories]
+    assert np.allclose(histories[0][0], histories[1][0]) and np.allclose(stacks[0].log_h, stacks[1].log_h)
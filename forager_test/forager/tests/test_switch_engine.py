@@ -0,0 +1,110 @@
+import pytest
+import difflib
+import statistics
+import numpy as np
+import pandas as pd
+from scipy import stats
+from forager.switch import switch_simdrop, switch_multimodal, switch_multimodal_batch
+from forager.switch import switch_delta, switch_multimodaldelta, switch_delta_batch, switch_multimodaldelta_batch, switch_norms
+from forager.norms import NormsIndex
+
+'''
+Checks the batched switch engines and the norms index against the position-by-position switch methods they
+replace, on random similarity lists with ties and toy norms.
+'''
+
+rng = np.random.default_rng(0)
+# similarities rounded to one decimal, so that many consecutive values are equal
+lists = [(rng.integers(0, 10, L) / 10, rng.integers(0, 10, L) / 10) for L in [0, 1, 2, 3, 5, 12, 40]]
+alphas = np.arange(0, 1.1, 0.1)
+
+def original_multimodal(fluency_list, semantic_similarity, phonological_similarity, alpha):
+    simphon = alpha * np.array(semantic_similarity) + (1 - alpha) * np.array(phonological_similarity)
+    multimodalsimdrop = []
+    for k in range(len(fluency_list)):
+        if (k > 0 and k < (len(fluency_list) - 1)):
+            if (simphon[k + 1] > simphon[k]) and (simphon[k - 1] > simphon[k]):
+                multimodalsimdrop.append(1)
+            else:
+                multimodalsimdrop.append(0)
+        else:
+            multimodalsimdrop.append(2)
+    return multimodalsimdrop
+
+@pytest.mark.parametrize("semantic, phonological", lists)
+def test_multimodal_batch(semantic, phonological):
+    fluency_list = ['w'] * len(semantic)
+    switches = switch_multimodal_batch(fluency_list, semantic, phonological, alphas)
+    assert switches.dtype == np.int8 and switches.shape == (len(alphas), len(semantic))
+    for i, a in enumerate(alphas):
+        expected = original_multimodal(fluency_list, semantic, phonological, a)
+        assert switches[i].tolist() == expected == switch_multimodal(fluency_list, semantic.tolist(), phonological.tolist(), a)
+    # simdrop is the multimodal method with alpha = 1
+    assert switch_simdrop(fluency_list, semantic.tolist()) == switches[-1].tolist() == original_multimodal(fluency_list, semantic, phonological, 1)
+
+def test_alpha_range():
+    with pytest.raises(Exception):
+        switch_multimodal_batch(['a', 'b'], [1, 1], [1, 1], [0.5, 1.1])
+
+def original_delta(fluency_list, similarity, rise_thresh, fall_thresh):
+    switchVector = [2]
+    similaritiesZ = stats.zscore(similarity[1:])
+    medianSim = statistics.median(similaritiesZ)
+    similaritiesZ = np.concatenate(([np.nan], similaritiesZ))
+    switchVector.append(1 if similaritiesZ[1] < medianSim else 0)
+    previousState = switchVector[1]
+    for n in range(1, len(fluency_list) - 1):
+        if previousState == 0:
+            currentState = 1 if fall_thresh < (similaritiesZ[n] - similaritiesZ[n+1]) else 0
+        else:
+            currentState = 0 if rise_thresh < (similaritiesZ[n+1] - similaritiesZ[n]) else 1
+        switchVector.append(currentState)
+        previousState = currentState
+    return switchVector
+
+@pytest.mark.parametrize("semantic, phonological", lists[2:] + [(np.ones(6), np.ones(6))])
+def test_delta_batch(semantic, phonological):
+    fluency_list = ['w'] * len(semantic)
+    rise = fall = np.arange(0, 1.1, 0.1)
+    delta = switch_delta_batch(fluency_list, semantic, rise, fall)
+    multimodaldelta = switch_multimodaldelta_batch(fluency_list, semantic, phonological, rise, fall, alphas)
+    assert delta.dtype == multimodaldelta.dtype == np.int8
+    assert delta.shape == (len(rise), len(fall), len(semantic)) and multimodaldelta.shape == (len(alphas),) + delta.shape
+    for j, r in enumerate(rise):
+        for k, f in enumerate(fall):
+            assert delta[j, k].tolist() == original_delta(fluency_list, semantic, r, f)
+            for i, a in enumerate(alphas):
+                assert multimodaldelta[i, j, k].tolist() == original_delta(fluency_list, a * semantic + (1 - a) * phonological, r, f)
+    assert switch_delta(fluency_list, semantic.tolist(), rise[2], fall[5]) == delta[2, 5].tolist()
+    assert switch_multimodaldelta(fluency_list, semantic, phonological, rise[2], fall[5], alphas[3]) == multimodaldelta[3, 2, 5].tolist()
+
+def test_threshold_range():
+    with pytest.raises(Exception):
+        switch_delta_batch(['a', 'b', 'c'], [1, 2, 3], [0, 1.5], [0])
+    with pytest.raises(Exception):
+        switch_multimodaldelta_batch(['a', 'b', 'c'], [1, 2, 3], [1, 2, 3], [0], [-1], [0])
+
+def original_norms(fluency_list, norms):
+    norm_designation = [2]
+    items_in_norms = norms['Item'].values.tolist()
+    for k in range(1, len(fluency_list)):
+        item1 = difflib.get_close_matches(fluency_list[k], items_in_norms, n=1)
+        item2 = difflib.get_close_matches(fluency_list[k-1], items_in_norms, n=1)
+        item1 = item1[0] if len(item1) > 0 else fluency_list[k]
+        item2 = item2[0] if len(item2) > 0 else fluency_list[k-1]
+        category1 = norms[norms['Item'] == item1]['Category'].values.tolist()
+        category2 = norms[norms['Item'] == item2]['Category'].values.tolist()
+        norm_designation.append(1 if len(set(category1) & set(category2)) == 0 else 0)
+    return norm_designation
+
+def test_norms_index():
+    # 70 categories, so that the bitmasks span two words
+    norms = pd.DataFrame({'Item': ['cat', 'dog', 'lion', 'tiger', 'shark', 'whale', 'grape', 'eel'] + ['item' + str(c) for c in range(70)],
+                          'Category': ['pet', 'pet', 'africa', 'asia', 'fish', 'sea', 'fruit', 'sea'] + ['c' + str(c) for c in range(70)]})
+    norms = pd.concat([norms, pd.DataFrame({'Item': ['lion', 'tiger', 'whale', 'eel', 'item3', 'item69'], 'Category': ['cat', 'cat', 'mammal', 'fish', 'c69', 'c3']})], ignore_index = True)
+    index = NormsIndex(norms)
+    assert index.masks.shape == (len(index) + 1, 2) and sorted(index.category_names('grapes')) == ['fruit']
+    fluency_list = ['dog', 'cat', 'lion', 'tigers', 'grapes', 'xyzzy', 'qwerty', 'shark', 'eel', 'whale', 'item3', 'item69', 'item68', 'dog']
+    assert switch_norms(fluency_list, index) == original_norms(fluency_list, norms) == switch_norms(fluency_list, norms)
+    assert switch_norms([], index) == [] and switch_norms(['cat'], index) == [2]
+    assert index.resolve('tigers') == index.ids['tiger'] and index.resolve('xyzzy') == -1
@@ -0,0 +1,59 @@
+import pytest
+import numpy as np
+import pandas as pd
+from forager.vocabulary import Vocabulary
+from forager.cues import create_history_variables
+
+'''
+Checks that the Vocabulary index encodes fluency lists exactly as list.index over the labels did, and that
+the compact cue histories built from the encoded ids hold the same values as the original lists of rows.
+'''
+
+labels = ['aardvark', 'Bear', 'cat', 'dog', 'sea lion', 'cat']
+
+def test_encode_matches_list_index():
+    vocab = Vocabulary(labels)
+    fluency_list = ['dog', 'cat', 'sea lion', 'aardvark', 'Bear', 'dog']
+    ids = vocab.encode(fluency_list)
+    assert ids.dtype == np.int32
+    assert ids.tolist() == [labels.index(word) for word in fluency_list]
+    assert vocab.decode(ids) == fluency_list
+    assert len(vocab) == len(labels) and list(vocab) == labels
+
+def test_aliases(tmp_path):
+    vocab = Vocabulary(labels, aliases = True)
+    assert vocab.index('bear') == 1 and vocab.index(' Sea Lion ') == 4 and 'DOG' in vocab
+    # words are matched exactly by default, as list.index did
+    with pytest.raises(Exception):
+        Vocabulary(labels).index('bear')
+    frequencies = str(tmp_path / 'USE_frequencies.csv')
+    pd.DataFrame({0: labels, 1: np.ones(len(labels))}).to_csv(frequencies, header = False, index = False)
+    assert 'DOG' not in Vocabulary(labels) and 'bear' not in Vocabulary.from_frequencies(frequencies)
+    assert 'bear' in Vocabulary.from_frequencies(frequencies, aliases = True)
+    # an ambiguous case-folded form is not an alias
+    assert 'ab' not in Vocabulary(['AB', 'Ab'], aliases = True)
+    assert Vocabulary(['cat', 'dog'], aliases = True).index('DOG') == 1
+    with pytest.raises(Exception):
+        vocab.encode(['dog', 'unicorn'])
+
+def test_history_variables():
+    rng = np.random.default_rng(0)
+    sim_matrix = rng.uniform(0.1, 1, (len(labels), len(labels)))
+    phon_matrix = rng.uniform(0.1, 1, (len(labels), len(labels)))
+    freq_matrix = rng.uniform(1, 5, len(labels))
+    corrections_df = pd.DataFrame({'SID': [], 'entry': [], 'final_word': []})
+    fluency_list = ['dog', 'cat', 'Bear']
+    from_list = create_history_variables(fluency_list, 1, corrections_df, labels, sim_matrix, freq_matrix, phon_matrix)
+    history = create_history_variables(fluency_list, 1, corrections_df, Vocabulary(labels), sim_matrix, freq_matrix, phon_matrix)
+    sim_list, sim_history, freq_list, freq_history, phon_list, phon_history = history
+    assert np.array_equal(from_list[0], sim_list) and np.allclose(sim_list, [0.0001, sim_matrix[3, 2], sim_matrix[2, 1]])
+    assert np.array_equal(freq_list, freq_matrix[[3, 2, 1]]) and np.allclose(phon_list, [0.0001, phon_matrix[3, 2], phon_matrix[2, 1]])
+
+    # rows are zero-copy views of the shared matrices, gathered in one fancy-index
+    assert np.shares_memory(sim_history[1], sim_matrix) and freq_history[2] is freq_matrix
+    assert np.array_equal(np.array(sim_history), sim_matrix[[3, 3, 2]])
+    assert np.array_equal(np.array(phon_history), phon_matrix[[3, 3, 2]])
+    assert np.array_equal(np.array(freq_history), [freq_matrix] * 3)
+    assert [list(row) for row in sim_history[-2:]] == [list(sim_matrix[3]), list(sim_matrix[2])]
+    assert history.ids.tolist() == [3, 2, 1]
+    assert create_history_variables(fluency_list, 1, corrections_df, labels, sim_matrix, freq_matrix).phon_history is None
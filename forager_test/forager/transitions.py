@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+from forager.cues import CueHistory, HistoryRows, phonology_funcs
+
+'''
+
+Transitions of a whole dataset of fluency lists, encoded and looked up in a few vectorized operations instead of
+    one create_history_variables call (and one small DataFrame) per subject.
+
+    Classes
+        (1) TransitionTable: (list, position, prev_id, cur_id) arrays of every item in the dataset, with their
+        semantic, frequency and phonological values
+'''
+
+
+class TransitionTable:
+    '''
+        Description:
+            Encodes all fluency lists of a dataset into flat arrays of vocabulary ids, and gathers the semantic,
+            phonological and frequency value of every transition with one fancy-index per cue. The values are
+            the ones of create_history_variables: the first item of a list has similarities of .0001, and items in
+            the corrections file take the phonological similarity of their original entry.
+        Args:
+            (1) lexicon (LexicalSpace): lexical data of the domain
+            (2) data: fluency lists of the dataset (list of (subject, fluency list) pairs), obtained via prepareData
+            (3) corrections_df: corrected entries of all participants (DataFrame with SID, entry, final_word)
+        Attributes:
+            subjects (np.array, size T): subject of each item
+            words (np.array, size T): each item as produced
+            offsets (np.array, size S+1): items of the k-th list are offsets[k]:offsets[k+1]
+            position (int32 np.array, size T): position of each item in its list
+            prev_ids, cur_ids (int32 np.array, size T): vocabulary id of the history row of each item (the
+                preceding item, or the item itself at the first position) and of the item
+            semantic, frequency, phonological (np.array, size T): cue value of each transition
+            corrected (np.array, size T, bool): items whose phonological values come from the corrections file
+    '''
+    def __init__(self, lexicon, data, corrections_df):
+        self.lexicon = lexicon
+        lengths = np.array([len(fl_list) for subj, fl_list in data], dtype = np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(lengths)])
+        self.subjects = np.repeat(np.array([subj for subj, fl_list in data], dtype = object), lengths)
+        self.words = np.array([word for subj, fl_list in data for word in fl_list], dtype = object)
+        T = len(self.words)
+        first = np.zeros(T, dtype = bool)
+        first[self.offsets[:-1][lengths > 0]] = True
+        self.position = (np.arange(T) - np.repeat(self.offsets[:-1], lengths)).astype(np.int32)
+
+        self.cur_ids = lexicon.labels.encode(self.words)
+        self.prev_ids = np.where(first, self.cur_ids, np.roll(self.cur_ids, 1)).astype(np.int32)
+
+        self.frequency = lexicon.freq_matrix[self.cur_ids]
+        self.semantic = lexicon.sim_matrix[self.prev_ids, self.cur_ids]
+        self.semantic[first] = .0001
+
+        self.corrected = np.zeros(T, dtype = bool)
+        self.phonological = None
+        if lexicon.phon_matrix is not None:
+            self.phonological = lexicon.phon_matrix[self.prev_ids, self.cur_ids]
+            self.phonological[first] = .0001
+            # original entry of each corrected item, keeping the first correction of a subject as with list.index
+            corrections = {}
+            for sid, original_word, replaced_word in zip(corrections_df['SID'].tolist(), corrections_df['entry'].tolist(), corrections_df['final_word'].tolist()):
+                corrections.setdefault((sid, replaced_word), original_word)
+            original = [corrections.get(item) for item in zip(self.subjects, self.words)] if corrections else [None] * T
+            self.corrected = np.array([entry is not None for entry in original], dtype = bool) & ~first
+            for t in np.flatnonzero(self.corrected):
+                self.phonological[t] = phonology_funcs.normalized_edit_distance(phonology_funcs.wordbreak(self.words[t-1])[0], phonology_funcs.wordbreak(original[t])[0])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def lexical_results(self):
+        '''
+            Description:
+                Returns the semantic, frequency and phonological values of every item as one table
+            Returns:
+                (1) lexical_results (DataFrame): Subject, Fluency_Item, Semantic_Similarity, Frequency_Value and
+                Phonological_Similarity of each item
+        '''
+        return pd.DataFrame({'Subject': pd.Series(self.subjects).infer_objects(),
+                             'Fluency_Item': self.words,
+                             'Semantic_Similarity': self.semantic,
+                             'Frequency_Value': self.frequency,
+                             'Phonological_Similarity': np.nan if self.phonological is None else self.phonological})
+
+    def history(self, k):
+        '''
+            Description:
+                Returns the cue lists and histories of the k-th fluency list, as create_history_variables does
+            Args:
+                (1) k (int): index of the list in the dataset
+            Returns:
+                (1) history (CueHistory)
+        '''
+        items = slice(self.offsets[k], self.offsets[k+1])
+        ids, prev_ids = self.cur_ids[items], self.prev_ids[items]
+        lexicon = self.lexicon
+        phon_list, phon_history = None, None
+        if self.phonological is not None:
+            # phonological rows of corrected items, shared through the cache of the lexicon
+            overrides = {int(t): lexicon.phon_cache.row(self.words[self.offsets[k] + t - 1]) for t in np.flatnonzero(self.corrected[items])}
+            phon_list, phon_history = self.phonological[items], HistoryRows(lexicon.phon_matrix, prev_ids, overrides)
+        return CueHistory(ids, prev_ids, self.semantic[items], HistoryRows(lexicon.sim_matrix, prev_ids),
+                          self.frequency[items], HistoryRows(lexicon.freq_matrix, ids), phon_list, phon_history)
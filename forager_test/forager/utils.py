@@ -5,6 +5,7 @@ import pandas as pd
 import difflib
 import nltk
 import zipfile
+from forager.bundle import source_paths
 
 def trunc(word, df):
     # function to truncate fluency list at word
@@ -35,7 +36,7 @@ def prepareData(path, domain):
     
 
     # load labels
-    labels = pd.read_csv('data/lexical_data/' + domain + '/USE_frequencies.csv', names=['word', 'logct'], header=None) 
+    labels = pd.read_csv(source_paths(domain)['frequencies'], names=['word', 'logct'], usecols=[0, 1], header=None)
     
 
      # set all replacements to actual word for all words in labels as the default
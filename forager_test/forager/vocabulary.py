@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+
+'''
+
+Hash-based index of the search space of words. Encodes fluency lists into integer ids in O(1) per item,
+    in place of list.index / np.where scans over the vocabulary.
+
+    Classes
+        (1) Vocabulary: word -> int32 id dictionary, id -> word array and optional case-folded aliases
+'''
+
+
+class Vocabulary:
+    '''
+        Description:
+            Maps the N words of a search space to the ids 0..N-1 (their row in the lexical matrices) and back.
+            Words are matched exactly by default, as list.index over the labels did. With aliases = True, words
+            are also found by their case-folded, whitespace-stripped form, unless that form is shared by several
+            words; this changes which items count as in the vocabulary, so it is only enabled on request.
+        Args:
+            (1) words: the space of words (iterable of length N), in the order of the lexical matrices
+            (2) aliases (bool): also index the case-folded forms of the words (default: False)
+    '''
+    def __init__(self, words, aliases = False):
+        self.words = np.array(list(words), dtype = object)
+        self.ids = {}
+        for i, word in enumerate(self.words):
+            # the first occurrence of a duplicated word keeps its id, as with list.index
+            self.ids.setdefault(word, i)
+        self.casefold = aliases
+        self.aliases = {}
+        if aliases:
+            folded = {}
+            for word, i in self.ids.items():
+                folded.setdefault(self.fold(word), []).append(i)
+            self.aliases = {key: i[0] for key, i in folded.items() if len(i) == 1 and key not in self.ids}
+
+    @classmethod
+    def from_frequencies(cls, path_to_frequencies, aliases = False):
+        '''
+            Description:
+                Builds the vocabulary from a headerless .csv file of words and their log-frequencies,
+                such as USE_frequencies.csv
+            Args:
+                (1) path_to_frequencies (str): path to the .csv file
+                (2) aliases (bool): also index the case-folded forms of the words (default: False)
+            Returns:
+                (1) vocabulary (Vocabulary)
+        '''
+        return cls(pd.read_csv(path_to_frequencies, header = None)[0].values.tolist(), aliases)
+
+    @staticmethod
+    def fold(word):
+        return str(word).strip().casefold()
+
+    def __len__(self):
+        return len(self.words)
+
+    def __iter__(self):
+        return iter(self.words)
+
+    def __contains__(self, word):
+        return self.lookup(word) is not None
+
+    def lookup(self, word):
+        # id of a word or of its case-folded form, or None if it is not in the vocabulary
+        i = self.ids.get(word)
+        if i is None and self.casefold:
+            key = self.fold(word)
+            i = self.ids.get(key, self.aliases.get(key))
+        return i
+
+    def index(self, word):
+        '''
+            Description:
+                Returns the id of a word, looking it up first as is and then by its case-folded alias
+            Args:
+                (1) word (str)
+            Returns:
+                (1) id (int): position of the word in the vocabulary
+        '''
+        i = self.lookup(word)
+        if i is None:
+            raise Exception("'" + str(word) + "' is not in the vocabulary")
+        return i
+
+    def encode(self, words):
+        '''
+            Description:
+                Encodes a fluency list into the ids of its items
+            Args:
+                (1) words: items produced by a participant (list of size L)
+            Returns:
+                (1) ids (np.array of int32, size L)
+        '''
+        return np.fromiter((self.index(word) for word in words), dtype = np.int32, count = len(words))
+
+    def decode(self, ids):
+        '''
+            Description:
+                Returns the words of a sequence of ids
+            Args:
+                (1) ids: ids of the items (array-like of size L)
+            Returns:
+                (1) words (list of size L)
+        '''
+        return self.words[np.asarray(ids, dtype = np.intp)].tolist()
@@ -1,16 +1,24 @@
 
 import argparse
-from scipy.optimize import fmin
 from forager.foraging import forage
 from forager.switch import *
-from forager.cues import create_history_variables
 from forager.utils import prepareData
+from forager.likelihood import CueStack, PopulationStack, RowDenominatorCache, phoncues
+from forager.vocabulary import Vocabulary
+from forager.lexical import LexicalSpace
+from forager.semantic import LowRankSimilarity
+from forager.embedding_store import open_embeddings
+from forager.bundle import read_manifest, load_lexicon, changed_sources, source_paths, arpabet_path
+from forager.transitions import TransitionTable
+from forager.cues import phonology_funcs
 import pandas as pd
 import numpy as np
-from scipy.optimize import fmin
 import os, sys
+import warnings
 from tqdm import tqdm
 import zipfile
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 
 """
@@ -42,32 +50,59 @@ switch_methods = ['simdrop','multimodal','norms','delta','svd', 'exp', 'multimod
 
 #Methods
 
-def get_lexical_data(domain):
-
-    animalnormspath =  'data/norms/animals_snafu_scheme_vocab.csv'
-    foodnormspath =  'data/norms/foods_snafu_scheme_vocab.csv'
-    similaritypath =  'data/lexical_data/' + domain + '/USE_semantic_matrix.csv'
-    frequencypath =  'data/lexical_data/' + domain + '/USE_frequencies.csv'
-    phonpath = 'data/lexical_data/' + domain + '/USE_phonological_matrix.csv'
+def get_lexical_data(domain, dtype = np.float64):
+    '''
+    Loads the lexical data of a domain into a read-only LexicalSpace, with the similarity floor applied once.
+    If the domain has a lexicon bundle (see build-lexicon), its arrays are memory-mapped instead of parsing the CSVs,
+    unless its CSV files changed since it was built.
+    '''
+    manifest = read_manifest(domain)
+    if manifest is not None:
+        changed = changed_sources(manifest)
+        if len(changed) == 0:
+            return load_lexicon(domain, dtype = dtype)
+        warnings.warn("The lexicon bundle of domain '{domain}' is out of date ({files} changed), reading the CSV files instead. Run build-lexicon {domain} again.".format(domain = domain, files = ', '.join(changed)))
+
+    sources = source_paths(domain)
+    animalnormspath = sources['norms_animals']
+    foodnormspath = sources['norms_foods']
+    similaritypath = sources['semantic']
+    embeddingspath = sources['embeddings']
+    frequencypath = sources['frequencies']
+    phonpath = sources['phonological']
 
     animalnorms = pd.read_csv(animalnormspath, encoding="unicode-escape")
     foodnorms = pd.read_csv(foodnormspath, encoding="unicode-escape")
     norms = [animalnorms, foodnorms]
-    similarity_matrix = np.loadtxt(similaritypath,delimiter=',')
-    frequency_list = np.array(pd.read_csv(frequencypath,header=None,encoding="unicode-escape")[1])
-    phon_matrix = np.loadtxt(phonpath,delimiter=',')
-    labels = pd.read_csv(frequencypath,header=None)[0].values.tolist()
+    frequency_list = np.array(pd.read_csv(frequencypath,header=None,encoding="unicode-escape")[1],dtype=dtype)
+    labels = Vocabulary.from_frequencies(frequencypath)
+    if os.path.exists(similaritypath):
+        similarity_matrix = np.loadtxt(similaritypath,delimiter=',',dtype=dtype)
+    else:
+        # without a dense semantic matrix, semantic rows are computed on demand from the embeddings of the labels,
+        # read from the binary store of the embeddings
+        embeddings = open_embeddings(embeddingspath)
+        similarity_matrix = LowRankSimilarity(embeddings.get(labels.words), dtype = dtype)
+    if os.path.exists(phonpath):
+        phon_matrix = np.loadtxt(phonpath,delimiter=',',dtype=dtype)
+    else:
+        # large vocabularies have no dense phonological matrix: rows are computed on demand, or read from a
+        # sparse top-k neighbor matrix if one was built for the domain
+        phon_matrix = phonology_funcs.create_phonological_similarity(labels, path = sources['phonological_topk'], dtype = dtype)
     
-    return norms, similarity_matrix, phon_matrix, frequency_list,labels
+    return LexicalSpace(labels, similarity_matrix, frequency_list, phon_matrix, norms, domain)
     
-def calculate_switch(switch, fluency_list, rt_list, svd_cluster_dict, semantic_similarity, phon_similarity, norms, domain, alpha = np.arange(0, 1.1, 0.1), rise = np.arange(0, 1.25, 0.25), fall = np.arange(0, 1.25, 0.25)):
+def calculate_switch(switch, fluency_list, rt_list, svd_cluster_dict, semantic_similarity, phon_similarity, lexicon, alpha = np.arange(0, 1.1, 0.1), rise = np.arange(0, 1.25, 0.25), fall = np.arange(0, 1.25, 0.25)):
     '''
     1. Check if specified switch model is valid
     2. Return set of switches, including parameter value, if required
 
     switch_methods are the following:
     switch_methods = ['simdrop','multimodal','norms','delta','svd', 'exp', 'multimodaldelta', 'all']
+
+    The norms and domain are taken from the LexicalSpace (lexicon) obtained via get_lexical_data
     '''
+    norms, domain = lexicon.norms, lexicon.domain
     switch_names = []
     switch_vecs = []
 
@@ -80,28 +115,32 @@ def calculate_switch(switch, fluency_list, rt_list, svd_cluster_dict, semantic_s
         switch_vecs.append(switch_simdrop(fluency_list, semantic_similarity))
 
     if switch == switch_methods[1] or switch == switch_methods[7]:
+        # all alphas at once, one row of the (n_alpha x L) switch matrix per alpha
+        multimodal = switch_multimodal_batch(fluency_list, semantic_similarity, phon_similarity, alpha)
         for i, a in enumerate(alpha):
             switch_names.append('multimodal_alpha={alpha}'.format(alpha=a))
-            switch_vecs.append(switch_multimodal(fluency_list, semantic_similarity, phon_similarity, a))
+            switch_vecs.append(multimodal[i].tolist())
 
     if (switch == switch_methods[2] or switch == switch_methods[7]) and domain in ['animals','foods']:
         
         if domain == 'animals':
             switch_names.append("norms_associative")
-            switch_vecs.append(switch_norms(fluency_list,norms[0]))
+            switch_vecs.append(switch_norms(fluency_list,lexicon.norms_index[0]))
             switch_names.append("norms_categorical")
             switch_vecs.append(switch_norms_categorical(fluency_list,norms[0]))
         else:
             switch_names.append("norms_associative")
-            switch_vecs.append(switch_norms(fluency_list,norms[1]))
+            switch_vecs.append(switch_norms(fluency_list,lexicon.norms_index[1]))
             switch_names.append("norms_categorical")
             switch_vecs.append(switch_norms_categorical(fluency_list,norms[1]))
 
     if switch == switch_methods[3] or switch == switch_methods[7]:
+        # all (rise, fall) combinations at once
+        delta = switch_delta_batch(fluency_list, semantic_similarity, rise, fall)
         for i, r in enumerate(rise):
             for j, f in enumerate(fall):
                 switch_names.append("delta_rise={rise}_fall={fall}".format(rise=r,fall=f))
-                switch_vecs.append(switch_delta(fluency_list, semantic_similarity, r, f))
+                switch_vecs.append(delta[i, j].tolist())
     
     if switch == switch_methods[4] or switch == switch_methods[7]:
         
@@ -118,14 +157,131 @@ def calculate_switch(switch, fluency_list, rt_list, svd_cluster_dict, semantic_s
         switch_vecs.append(fit_exponential_curve(rt_list))
     
     if switch == switch_methods[6] or switch == switch_methods[7]:
-        for i, a in enumerate(alpha):
+        # all (alpha, rise, fall) combinations at once
+        multimodaldelta = switch_multimodaldelta_batch(fluency_list, semantic_similarity, phon_similarity, rise, fall, alpha)
+        for h, a in enumerate(alpha):
             for i, r in enumerate(rise):
                 for j, f in enumerate(fall):
                     switch_names.append("multimodaldelta_alpha={alpha}_rise={rise}_fall={fall}".format(alpha=a,rise=r,fall=f))
-                    switch_vecs.append(switch_multimodaldelta(fluency_list, semantic_similarity, phon_similarity, r, f, a))
+                    switch_vecs.append(multimodaldelta[h, i, j].tolist())
             
     return switch_names, switch_vecs
 
+def init_fit_worker(lexicon):
+    '''
+    Stores the lexical data shared by all fits in a worker process, so that each fitting job only
+    carries the compact cue history of a fluency list and the fits to run on it
+    '''
+    global fit_context
+    fit_context = lexicon
+
+def subject_jobs(subj, history, model_choice, switch_names, switch_vecs, replacement, chunk_size = 16):
+    '''
+    Splits the fits of the chosen model(s) to a single fluency list into jobs of at most chunk_size fits, one model
+    (one phonological cue for pdynamic) and one chunk of switch vectors per job, so that subjects with many switch
+    vectors are spread over several workers. Each job carries the detached CueHistory built by the TransitionTable
+    (row ids and override rows, not the matrices), so workers neither look up the fluency list nor recompute
+    phonological rows. The first job of the subject also scores the random baseline.
+
+    Returns the jobs (subject, history, replacement, baseline, fits), where fits lists the
+    (model name, number of betas, model, switch vector, phonological cue) of each fit, in the order of model_results.
+    '''
+    groups = []
+    if model_choice in ['static', 'all']:
+        groups.append([('forage_static', 2, 'static', None, None)])
+    if model_choice in ['dynamic', 'all']:
+        groups.append([('forage_dynamic_' + name, 2, 'dynamic', vec, None) for name, vec in zip(switch_names, switch_vecs)])
+    if model_choice in ['pstatic', 'all']:
+        groups.append([('forage_phonologicalstatic', 3, 'pstatic', None, None)])
+    if model_choice in ['pdynamic', 'all']:
+        for cue in phoncues:
+            groups.append([('forage_phonologicaldynamic' + cue + '_' + name, 3, 'pdynamic', vec, cue) for name, vec in zip(switch_names, switch_vecs)])
+
+    history = history.detach()
+    chunks = [group[i:i + chunk_size] for group in groups for i in range(0, len(group), chunk_size)]
+    return [(subj, history, replacement, k == 0, fits) for k, fits in enumerate(chunks or [[]])]
+
+def fit_subject(job):
+    '''
+    Fits the betas of a chunk of models to a single fluency list (see subject_jobs). The cue history is attached
+    to the matrices of the worker's lexicon and stacked once, and shared by every fit of the job.
+
+    Returns a DataFrame with one row per fit: the optimized betas and negative log-likelihood, the number of
+    optimizer iterations and the wall time of the fit.
+    '''
+    subj, history, replacement, baseline, fits = job
+    lexicon = fit_context
+    history = history.attach(lexicon.sim_matrix, lexicon.freq_matrix, lexicon.phon_matrix)
+    stack = CueStack.from_history(history, replacement, lexicon.dtype)
+
+    rows = []
+    if baseline:
+        # all betas set to 0 make every item in the vocabulary equally likely
+        rows.append([subj, 'forage_random_baseline', 0.0, 0.0, np.nan, stack.nll([0, 0], stack.terms('static')), 0, 0.0])
+    for name, n_betas, model, vec, cue in fits:
+        active = stack.terms(model, vec, cue)
+        start = time.perf_counter()
+        res = stack.fit(np.zeros(n_betas), active)
+        fit_time = time.perf_counter() - start
+        beta_phon = res.x[2] if n_betas == 3 else np.nan
+        rows.append([subj, name, res.x[0], res.x[1], beta_phon, res.fun, res.nit, fit_time])
+
+    return pd.DataFrame(rows, columns = ['Subject', 'Model', 'Beta_Frequency', 'Beta_Semantic', 'Beta_Phonological', 'Negative_Log_Likelihood_Optimized', 'Iterations', 'Fit_Time'])
+
+def fit_models(jobs, lexicon, workers = None):
+    '''
+    Runs fit_subject over all jobs (see subject_jobs) on a process pool.
+    Results are merged in job order, so the output does not depend on the number of workers.
+    '''
+    if workers == 1:
+        init_fit_worker(lexicon)
+        model_results = [fit_subject(job) for job in tqdm(jobs)]
+    else:
+        with ProcessPoolExecutor(max_workers = workers, initializer = init_fit_worker, initargs = (lexicon,)) as executor:
+            model_results = list(tqdm(executor.map(fit_subject, jobs), total = len(jobs)))
+    return pd.concat(model_results, ignore_index = True)
+
+def fit_population(subjects, stacks, model_choice, switch_names, switch_vecs, hierarchical = False, cache = None):
+    '''
+    Fits group-level betas of the chosen model(s) jointly to all subjects, minimizing the summed negative
+    log-likelihood of every fluency list in one batched pass (once per switch method for the dynamic models).
+    With hierarchical = True, per-subject deviations from the group betas are fit as well. Group-level fits can
+    share a RowDenominatorCache, so each unique (previous word, beta) row is only summed once across subjects.
+
+    Returns a DataFrame with one 'population' row per model, followed by one row per subject for hierarchical fits.
+    '''
+    population = PopulationStack(stacks)
+    # switch_vecs holds the switch vectors of each subject, transpose to the vectors of all subjects per method
+    method_vecs = list(zip(*switch_vecs))
+
+    fits = []
+    if model_choice in ['static', 'all']:
+        fits.append(('forage_static', 2, population.terms('static')))
+    if model_choice in ['dynamic', 'all']:
+        for name, vecs in zip(switch_names, method_vecs):
+            fits.append(('forage_dynamic_' + name, 2, population.terms('dynamic', vecs)))
+    if model_choice in ['pstatic', 'all']:
+        fits.append(('forage_phonologicalstatic', 3, population.terms('pstatic')))
+    if model_choice in ['pdynamic', 'all']:
+        for cue in phoncues:
+            for name, vecs in zip(switch_names, method_vecs):
+                fits.append(('forage_phonologicaldynamic' + cue + '_' + name, 3, population.terms('pdynamic', vecs, cue)))
+
+    rows = []
+    for name, n_betas, active in tqdm(fits):
+        start = time.perf_counter()
+        res = population.fit(np.zeros(n_betas), active, hierarchical = hierarchical, cache = cache)
+        fit_time = time.perf_counter() - start
+        subject_nll, _ = population.subject_nll_and_grad(res.subject_betas, active)
+        beta_phon = res.beta[2] if n_betas == 3 else np.nan
+        rows.append(['population', name, res.beta[0], res.beta[1], beta_phon, subject_nll.sum(), res.nit, fit_time])
+        if hierarchical:
+            for subj, betas, nll in zip(subjects, res.subject_betas, subject_nll):
+                beta_phon = betas[2] if n_betas == 3 else np.nan
+                rows.append([subj, name, betas[0], betas[1], beta_phon, nll, np.nan, np.nan])
+
+    return pd.DataFrame(rows, columns = ['Subject', 'Model', 'Beta_Frequency', 'Beta_Semantic', 'Beta_Phonological', 'Negative_Log_Likelihood_Optimized', 'Iterations', 'Fit_Time'])
+
 def indiv_desc_stats(lexical_results, switch_results = None):
     metrics = lexical_results[['Subject', 'Semantic_Similarity', 'Frequency_Value', 'Phonological_Similarity']]
     # replace first row of each subject with NaN for Semantic_Similarity and Phonological_Similarity
@@ -198,7 +354,7 @@ def agg_desc_stats(switch_results, model_results=None):
     agg_df['Switches_per_Subj_SD'] = [np.std(switches_per_method[k]) for k in switches_per_method.keys()]
     
     if model_results is not None:
-        betas = model_results.drop(columns=['Subject', 'Negative_Log_Likelihood_Optimized'])
+        betas = model_results.drop(columns=['Subject', 'Negative_Log_Likelihood_Optimized', 'Iterations', 'Fit_Time'])
         betas.drop(betas[betas['Model'] == 'forage_random_baseline'].index, inplace=True)
         grouped = betas.groupby('Model').agg(['mean', 'std'])
         grouped.columns = ['{}_{}'.format(col[0], col[1]) for col in grouped.columns]
@@ -223,8 +379,12 @@ def agg_desc_stats(switch_results, model_results=None):
     return agg_df
  
 
-def run_models(data, switch_choice, domain, dname):
+def run_models(data, switch_choice, domain, dname, model_choice = 'all', workers = None, joint = None, replacement = True, precision = 'float64'):
+
 
+    if model_choice not in models:
+        ex_str = "Specified model is invalid. Model must be one of the following: {models}".format(models=models)
+        raise Exception(ex_str)
 
     # prepare the data
 
@@ -233,20 +393,16 @@ def run_models(data, switch_choice, domain, dname):
 
     corrections_df = pd.read_excel('data/input_files/animal_corrections.xlsx')
 
+    # pronunciations are read from the binary copy of the CMU dictionary if build-lexicon --arpabet wrote one,
+    # and otherwise from the NLTK corpus in memory; nothing is written
+    phonology_funcs.load_arpabet(arpabet_path())
+
     # Get Lexical Data needed for executing methods
-    norms, similarity_matrix, phon_matrix, frequency_list, labels = get_lexical_data(domain)
+    lexicon = get_lexical_data(domain, np.dtype(precision))
     print("Creating Lexical Data")
-    lexical_results = []
-    for i, (subj, fl_list) in enumerate(tqdm(data)):
-        history_vars = create_history_variables(fl_list, subj, corrections_df, labels, similarity_matrix, frequency_list, phon_matrix)
-        lexical_df = pd.DataFrame()
-        lexical_df['Subject'] = len(fl_list) * [subj]
-        lexical_df['Fluency_Item'] = fl_list
-        lexical_df['Semantic_Similarity'] = history_vars[0]
-        lexical_df['Frequency_Value'] = history_vars[2]
-        lexical_df['Phonological_Similarity'] = history_vars[4]
-        lexical_results.append(lexical_df)
-    lexical_results = pd.concat(lexical_results,ignore_index=True)
+    # every transition of the dataset is encoded and looked up once, and reused by the switch loop below
+    transitions = TransitionTable(lexicon, data, corrections_df)
+    lexical_results = transitions.lexical_results()
     
 
     # first calculate svd clusters, these do not depend on individual fluency lists
@@ -259,17 +415,18 @@ def run_models(data, switch_choice, domain, dname):
     print("Completed calculating SVD clusters")
     
     # Run through each fluency list in dataset
-    corrections_df = pd.read_excel('data/input_files/animal_corrections.xlsx')
 
     switch_results = []
+    fit_jobs = []
+    subjects, stacks, subject_switch_vecs = [], [], []
     for i, (subj, fl_list) in enumerate(tqdm(data)):
         print("\nRunning Model for Subject {subj}".format(subj=subj))
         rt_list = processed_df[processed_df['SID'] == subj]['rt'].values.tolist()
-        history_vars = create_history_variables(fl_list, subj, corrections_df, labels, similarity_matrix, frequency_list, phon_matrix)
+        history_vars = transitions.history(i)
         # history_vars contains the following:
         # sim_list, sim_history, freq_list, freq_history,phon_list, phon_history
         # Calculate Switch Vector(s)
-        switch_names, switch_vecs = calculate_switch(switch_choice, fl_list, rt_list, svd_cluster_dict, history_vars[0], history_vars[4], norms, domain)
+        switch_names, switch_vecs = calculate_switch(switch_choice, fl_list, rt_list, svd_cluster_dict, history_vars[0], history_vars[4], lexicon)
 
         switch_df = []
         for j, switch in enumerate(switch_vecs):
@@ -282,11 +439,32 @@ def run_models(data, switch_choice, domain, dname):
     
         switch_df = pd.concat(switch_df, ignore_index=True)
         switch_results.append(switch_df)
+        fit_jobs.extend(subject_jobs(subj, history_vars, model_choice, switch_names, switch_vecs, replacement))
+        if joint is not None:
+            subjects.append(subj)
+            stacks.append(CueStack.from_history(history_vars, replacement, lexicon.dtype))
+            subject_switch_vecs.append(switch_vecs)
     switch_results = pd.concat(switch_results, ignore_index=True)
 
+    print("Fitting model parameters")
+    model_results = fit_models(fit_jobs, lexicon, workers)
+    if joint is not None:
+        print("Fitting population-level model parameters")
+        # group-level fits share the denominators of common (previous word, beta) rows across subjects; the cache
+        # needs the full vocabulary in every denominator, so it is not used without replacement
+        denominators = None
+        if joint == 'group' and replacement:
+            denominators = RowDenominatorCache(lexicon.freq_matrix, lexicon.sim_matrix, lexicon.phon_matrix)
+        population_results = fit_population(subjects, stacks, model_choice, switch_names, subject_switch_vecs, hierarchical = joint == 'hierarchical', cache = denominators)
+        if denominators is not None:
+            print("Denominator rows of group-level fits: {misses} computed, {hits} reused".format(misses=denominators.misses, hits=denominators.hits))
+
+    if lexicon.phon_cache is not None:
+        print("Phonological rows of corrected words: {misses} computed, {hits} reused".format(misses=lexicon.phon_cache.misses, hits=lexicon.phon_cache.hits))
+
     print("Computing individual and aggregate descriptive statistics")
     ind_stats = indiv_desc_stats(lexical_results, switch_results)
-    agg_stats = agg_desc_stats(switch_results)
+    agg_stats = agg_desc_stats(switch_results, model_results)
     with zipfile.ZipFile(dname, 'w', zipfile.ZIP_DEFLATED) as zipf:
         # Save the first DataFrame as a CSV file inside the zip
         with zipf.open('evaluation_results.csv', 'w') as csvf:
@@ -311,6 +489,15 @@ def run_models(data, switch_choice, domain, dname):
         with zipf.open('switch_results.csv','w') as csvf:
             switch_results.to_csv(csvf, index=False) 
 
+        # save model results
+        with zipf.open('model_results.csv','w') as csvf:
+            model_results.to_csv(csvf, index=False)
+
+        # save population-level model results
+        if joint is not None:
+            with zipf.open('population_results.csv','w') as csvf:
+                population_results.to_csv(csvf, index=False)
+
         # save individual descriptive statistics
         with zipf.open('individual_descriptive_stats.csv', 'w') as csvf:
             ind_stats.to_csv(csvf, index=False)
@@ -324,21 +511,30 @@ def run_models(data, switch_choice, domain, dname):
         print(f"File 'forager_vocab.csv' containing the full vocabulary used by forager saved in '{dname}'")
         print(f"File 'lexical_results.csv' containing similarity and frequency values of fluency list data saved in '{dname}'")        
         print(f"File 'switch_results.csv' containing designated switch methods and switch values of fluency list data saved in '{dname}'")
+        print(f"File 'model_results.csv' containing optimized model parameters, negative log-likelihoods and fit times saved in '{dname}'")
+        if joint is not None:
+            print(f"File 'population_results.csv' containing jointly fitted population-level model parameters saved in '{dname}'")
         print(f"File 'individual_descriptive_stats.csv' containing individual-level statistics saved in '{dname}'")
         print(f"File 'aggregate_descriptive_stats.csv' containing the overall group-level statistics saved in '{dname}'")
 
 
 
-parser = argparse.ArgumentParser(description='Execute Semantic Foraging Code.')
-parser.add_argument('--data', type=str,  help='specifies path to fluency lists')
-parser.add_argument('--switch', type=str, help='specifies switch model to use')
-parser.add_argument('--domain', type=str, help='specifies domain to use')
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Execute Semantic Foraging Code.')
+    parser.add_argument('--data', type=str,  help='specifies path to fluency lists')
+    parser.add_argument('--switch', type=str, help='specifies switch model to use')
+    parser.add_argument('--domain', type=str, help='specifies domain to use')
+    parser.add_argument('--model', type=str, default='all', help='specifies foraging model(s) to fit')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes used for model fitting (default: all cores)')
+    parser.add_argument('--joint', type=str, default=None, choices=['group', 'hierarchical'], help='also fit population-level betas jointly across all subjects')
+    parser.add_argument('--without-replacement', action='store_true', help='remove previously produced items from the model denominators')
+    parser.add_argument('--precision', type=str, default='float64', choices=['float64', 'float32'], help='floating point precision of the lexical data and likelihood computations')
 
 
-args = parser.parse_args()
+    args = parser.parse_args()
 
-dname = 'output/' + args.domain + '_forager.zip'
-run_models(args.data, args.switch, args.domain, dname)
+    dname = 'output/' + args.domain + '_forager.zip'
+    run_models(args.data, args.switch, args.domain, dname, args.model, args.workers, args.joint, not args.without_replacement, args.precision)
 
 # Running all models and switches
 
@@ -25,6 +25,9 @@ setup(name='forager',
       install_requires=['numpy','scipy','more_itertools','pandas','tqdm','nltk','requests'],
       python_requires='>=3.8',
       zip_safe=False,
+      entry_points={
+            'console_scripts': ['build-lexicon=forager.bundle:main', 'import-embeddings=forager.embedding_store:main']
+      },
       classifiers=[
             'Programming Language :: Python :: 3.8'
       ]